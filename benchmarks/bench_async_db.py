@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарк: задержка обработки апдейтов при синхронной и асинхронной работе с БД
+Используй: python3 -m benchmarks.bench_async_db [--users 200] [--db-users 2000]
+
+Имитирует N одновременных пользователей. Каждый присылает серию апдейтов:
+часть из них «лёгкие» (только ответ в Telegram), часть — регистрация
+(load_data → изменение → save_data → track_event). Сравниваются два режима:
+
+  sync  — как раньше: db.* / load_data() / save_data() прямо в корутине
+  async — через utils.async_database.adb (отдельный поток БД)
+
+Задержка апдейта = время от его поступления до завершения обработки.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed_database(db, count):
+    """Заполнить тестовую БД пользователями и историей регистраций"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, name, phone, username, bot_version) VALUES (?, ?, ?, ?, ?)",
+            [(str(1000 + i), f"Бегун {i}", f"+7900{i:07d}", f"runner{i}", "1.0.0") for i in range(count)]
+        )
+        conn.executemany(
+            "INSERT INTO gruppenrun_registrations (user_id, location, type) VALUES (?, 'shartas', 'onetime')",
+            [(str(1000 + i),) for i in range(count) for _ in range(3)]
+        )
+
+
+async def simulate_user(index, mode, updates, latencies, helpers, db, adb):
+    """Один пользователь: серия апдейтов со случайными паузами"""
+    user_id = str(1000 + index)
+    rng = random.Random(index)
+
+    for n in range(updates):
+        await asyncio.sleep(rng.uniform(0.0, 0.05))
+        heavy = rng.random() < 0.3
+        started = time.perf_counter()
+
+        if heavy:
+            if mode == "sync":
+                all_data = helpers.load_data()
+                all_data.setdefault(user_id, {})["username"] = f"runner{index}_{n}"
+                helpers.save_data({user_id: all_data[user_id]})
+                db.track_event(user_id, "registration:bench")
+            else:
+                all_data = await helpers.load_data_async()
+                all_data.setdefault(user_id, {})["username"] = f"runner{index}_{n}"
+                await helpers.save_data_async({user_id: all_data[user_id]})
+                await adb.track_event(user_id, "registration:bench")
+
+        # Имитация ответа пользователю через Bot API
+        await asyncio.sleep(0.002)
+        latencies["heavy" if heavy else "light"].append((time.perf_counter() - started) * 1000)
+
+
+async def run_mode(mode, users, updates, helpers, db, adb):
+    latencies = {"light": [], "heavy": []}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(i, mode, updates, latencies, helpers, db, adb) for i in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+def print_report(mode, latencies, elapsed):
+    every = latencies["light"] + latencies["heavy"]
+    print(f"\n=== {mode} === ({len(every)} апдейтов за {elapsed:.2f} с)")
+    for kind in ("light", "heavy"):
+        values = latencies[kind]
+        if values:
+            print(
+                f"  {kind:<6} n={len(values):<5} "
+                f"p50={statistics.median(values):7.1f} мс  "
+                f"p95={percentile(values, 95):7.1f} мс  "
+                f"p99={percentile(values, 99):7.1f} мс"
+            )
+    print(f"  all    p99={percentile(every, 99):7.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="одновременных пользователей")
+    parser.add_argument("--updates", type=int, default=10, help="апдейтов на пользователя")
+    parser.add_argument("--db-users", type=int, default=2000, help="пользователей в тестовой БД")
+    args = parser.parse_args()
+
+    # Тестовая БД во временной папке: боевой bot_data.db не трогаем
+    workdir = tempfile.mkdtemp(prefix="bench_async_db_")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir)
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from utils import helpers
+    from utils.database import db
+    from utils.async_database import adb
+
+    seed_database(db, args.db_users)
+    print(f"Тестовая БД: {workdir}/bot_data.db ({args.db_users} пользователей)")
+
+    for mode in ("sync", "async"):
+        latencies, elapsed = asyncio.run(run_mode(mode, args.users, args.updates, helpers, db, adb))
+        print_report(mode, latencies, elapsed)
+
+    adb.close()
+
+
+if __name__ == "__main__":
+    main()
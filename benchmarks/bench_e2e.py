@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Нагрузочный тест: весь бот целиком против локального «Telegram»
+Используй: python3 -m benchmarks.bench_e2e [--users 2000] [--ramp 20] [--think 0.6]
+
+Поднимает на 127.0.0.1 поддельный Telegram Bot API (getUpdates,
+sendMessage, sendPhoto, answerCallbackQuery, deleteMessage, editMessage*)
+и запускает против него настоящий диспетчер из main.build_dispatcher -
+все middleware и все роутеры handlers/, обычный start_polling. БД и
+FSM - во временной папке, боевой bot_data.db не трогается.
+
+Каждый виртуальный пользователь проходит сценарии так, как это делает
+человек: /start, Группенран Шарташ с заказом завтрака, Группенран
+Трейл, Кругосветка, Иремель (или лист ожидания, если места кончились).
+Следующий шаг отправляется только после того, как бот обработал
+предыдущий, с паузой не меньше rate limit (иначе меряем RateLimit).
+Кнопки для нажатия берутся из ответов бота.
+
+В отчёте - апдейтов в секунду и p50/p95/p99 по каждому обработчику:
+«обработка» - от получения апдейта диспетчером до конца обработчика,
+«ожидание» - от появления апдейта в getUpdates до начала обработки.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import CallbackQuery
+
+# config требует токен и админа; админ - не из виртуальных пользователей
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+FIRST_USER_ID = 100000
+PHONE = "+79001234567"
+# Имена проходят validate_name: только буквы
+NAMES = ("Иванов Иван", "Петрова Анна", "Смирнов Олег", "Кузнецова Мария", "Попов Денис")
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+# ==================== ПОДДЕЛЬНЫЙ TELEGRAM ====================
+
+class FakeTelegram:
+    """
+    Bot API на aiohttp: апдейты отдаёт через getUpdates (long polling),
+    исходящие сообщения складывает в «входящие» чатов
+    """
+
+    def __init__(self, api_latency: float = 0.0):
+        self.api_latency = api_latency
+        self.updates: List[dict] = []
+        self.enqueued: Dict[int, float] = {}  # update_id -> момент появления
+        self.inbox: Dict[int, List[dict]] = defaultdict(list)  # chat_id -> сообщения бота
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push(self, update: dict) -> int:
+        update_id = next(self._update_ids)
+        update["update_id"] = update_id
+        self.updates.append(update)
+        self.enqueued[update_id] = time.perf_counter()
+        self._new_updates.set()
+        return update_id
+
+    # ----- методы Bot API -----
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        handler = getattr(self, f"_api_{method.lower()}", None)
+        if handler is None:
+            result = self._message(params) if method.startswith(("send", "edit")) else True
+        else:
+            result = await handler(params)
+        if self.api_latency and method.lower() != "getupdates":
+            await asyncio.sleep(self.api_latency)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _api_getme(self, params):
+        return {"id": 1000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+    async def _api_getupdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        # Подтверждённые (id < offset) больше не нужны
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    def _message(self, params) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or 0) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1000, "is_bot": True, "first_name": "Bench"},
+            "text": params.get("text") or params.get("caption") or "",
+        }
+        markup = json.loads(params.get("reply_markup") or "{}")
+        # В Message бывает только inline-клавиатура
+        if "inline_keyboard" in markup:
+            message["reply_markup"] = markup
+        if chat_id:
+            self.inbox[chat_id].append(message)
+        return message
+
+
+# ==================== ВИРТУАЛЬНЫЙ ПОЛЬЗОВАТЕЛЬ ====================
+
+class SimUser:
+    """Один пользователь: шлёт апдейт, ждёт обработки, читает ответ бота"""
+
+    def __init__(self, user_id: int, server: FakeTelegram, pending: Dict[int, asyncio.Future], think: float):
+        self.id = user_id
+        self.server = server
+        self.pending = pending
+        self.think = think
+        self.buttons: Dict[str, int] = {}  # callback_data -> message_id из последних ответов
+        self.replies: List[str] = []  # тексты последних ответов
+        self.last_message_id = 0
+        self.name = NAMES[user_id % len(NAMES)]
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"Runner{user_id}",
+                     "username": f"runner{user_id}", "language_code": "ru"}
+
+    async def _send(self, update: dict):
+        # Пауза «на подумать» не меньше rate limit, иначе меряем RateLimitMiddleware
+        await asyncio.sleep(self.think * random.uniform(1.0, 1.5))
+        inbox = self.server.inbox[self.id]
+        seen = len(inbox)
+        update_id = self.server.push(update)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = future
+        await future
+
+        replies = inbox[seen:]
+        self.buttons = {}
+        self.replies = [message["text"] for message in replies]
+        for message in replies:
+            self.last_message_id = message["message_id"]
+            for row in (message.get("reply_markup") or {}).get("inline_keyboard", []):
+                for button in row:
+                    if button.get("callback_data"):
+                        self.buttons[button["callback_data"]] = message["message_id"]
+        # Старые ответы больше не нужны
+        inbox.clear()
+
+    def _message(self, **fields) -> dict:
+        return {
+            "message_id": random.randint(1, 2 ** 31), "date": int(time.time()),
+            "chat": {"id": self.id, "type": "private"}, "from": self.user, **fields,
+        }
+
+    async def text(self, text: str):
+        await self._send({"message": self._message(text=text)})
+
+    async def contact(self, phone: str = PHONE):
+        await self._send({"message": self._message(
+            contact={"phone_number": phone, "first_name": self.user["first_name"], "user_id": self.id}
+        )})
+
+    async def press(self, data: str):
+        message_id = self.buttons.get(data, self.last_message_id)
+        await self._send({"callback_query": {
+            "id": str(random.randint(1, 2 ** 62)), "from": self.user, "chat_instance": str(self.id),
+            "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": self.id, "type": "private"},
+                        "from": {"id": 1000, "is_bot": True, "first_name": "Bench"}, "text": "…"},
+        }})
+
+
+# ==================== СЦЕНАРИИ ====================
+
+async def flow_start(u: SimUser):
+    # Первый апдейт нового пользователя перехватывает VersionCheck («бот обновлён»)
+    await u.text("/start")
+    await u.text("/start")
+
+
+async def flow_gruppenrun(u: SimUser, breakfast_items: List[str]):
+    await u.text("⚪ Группенран Шарташ")
+    await u.press("gruppenrun_register")
+    if "payment_onetime" not in u.buttons:
+        await u.text(u.name)
+        await u.text(PHONE)
+    await u.press("payment_onetime")
+    await u.text("✅ Я оплатил(а)")
+
+    if "order_breakfast" in u.buttons:
+        await u.press("order_breakfast")
+        for item in random.sample(breakfast_items, 2):
+            await u.press(f"breakfast_{item}")
+        await u.press("finish_breakfast_order")
+
+
+async def flow_trail(u: SimUser):
+    await u.text("⚫ Группенран Трейл")
+    await u.press("uktus_register")
+    if "uktus_payment_onetime" not in u.buttons:
+        if not u.buttons:
+            return  # уже зарегистрирован
+        await u.text(u.name)
+        await u.text(PHONE)
+    await u.press("uktus_payment_onetime")
+    await u.text("✅ Я оплатил(а)")
+
+
+async def flow_krugosvetka(u: SimUser):
+    await u.text("🗺 Кругосветка 2025")
+    await u.press("krugosvetka_stages_list")
+    await u.press("krugosvetka_register")
+    if "change_krugosvetka_stages" in u.buttons:
+        return  # уже зарегистрирован
+    await u.text(u.name)
+    await u.text(PHONE)
+    for stage in random.sample(range(1, 10), 2):
+        await u.press(f"stage_{stage}")
+    await u.press("finish_selection")
+    await u.text("5:30")
+    await u.text("✅ Я оплатил(а)")
+
+
+async def flow_iremel(u: SimUser):
+    await u.text("🏔 Иремель Кэмп 2025")
+    await u.press("iremel_register")
+    if "iremel_waiting_list" in u.buttons:
+        # Места кончились - лист ожидания
+        await u.press("iremel_waiting_list")
+        # С заполненным профилем записывает сразу, без вопросов
+        if any("имя" in reply for reply in u.replies):
+            await u.text(u.name)
+            await u.contact()
+        return
+    if "register_friend_iremel" in u.buttons:
+        return  # уже зарегистрирован
+    await u.text("-")
+    await u.text("-")
+    await u.press(random.choice(["iremel_pay_50", "iremel_pay_100"]))
+    await u.text("✅ Я оплатил(а)")
+
+
+async def simulate_user(u: SimUser, delay: float, breakfast_items: List[str], failures: List[str]):
+    await asyncio.sleep(delay)
+    try:
+        await flow_start(u)
+        await flow_gruppenrun(u, breakfast_items)
+        await flow_trail(u)
+        await flow_krugosvetka(u)
+        await flow_iremel(u)
+        await u.text("👤 Мой профиль")
+    except Exception as e:
+        failures.append(f"{u.id}: {type(e).__name__}: {e}")
+
+
+# ==================== ЗАМЕРЫ ====================
+
+def event_type(event) -> str:
+    return "callback_query" if isinstance(event, CallbackQuery) else "message"
+
+
+class Recorder:
+    """Middleware диспетчера: время каждого апдейта и обработчик, который его обработал"""
+
+    def __init__(self, server: FakeTelegram, pending: Dict[int, asyncio.Future]):
+        self.server = server
+        self.pending = pending
+        self.processing: Dict[str, List[float]] = defaultdict(list)
+        self.waiting: List[float] = []
+        self.end_to_end: List[float] = []
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def outer(self, handler, event, data):
+        """dp.update.outer_middleware: весь путь апдейта через middleware и роутеры"""
+        started = time.perf_counter()
+        enqueued = self.server.enqueued.pop(event.update_id, started)
+        # Сюда inner-middleware запишет имя обработчика
+        holder = data["bench_handler"] = {"name": None}
+        result = UNHANDLED
+        try:
+            result = await handler(event, data)
+            return result
+        finally:
+            finished = time.perf_counter()
+            if holder["name"] is not None:
+                name = holder["name"]
+            elif result is UNHANDLED:
+                name = f"нет обработчика ({event.event_type})"
+            else:
+                name = f"остановлен middleware ({event.event_type})"
+            self.processing[name].append((finished - started) * 1000)
+            self.waiting.append((started - enqueued) * 1000)
+            self.end_to_end.append((finished - enqueued) * 1000)
+            future = self.pending.pop(event.update_id, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    async def inner(self, handler, event, data):
+        """dp.message/callback_query.middleware: вызывается, только если апдейт дошёл до обработчика"""
+        callback = data["handler"].callback
+        # Тип апдейта в имени: в модуле бывают одноимённые обработчики сообщения и callback
+        name = f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__} ({event_type(event)})"
+        data["bench_handler"]["name"] = name
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[name] += 1
+            raise
+
+
+def print_report(recorder: Recorder, server: FakeTelegram, elapsed: float, users: int, failures: List[str]):
+    total = len(recorder.end_to_end)
+    print(f"\n=== {users} пользователей, {total} апдейтов за {elapsed:.1f} с "
+          f"=== {total / elapsed:,.1f} апдейтов/с")
+    print(f"\n{'обработчик':<64} {'n':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  мс")
+    rows = sorted(recorder.processing.items(), key=lambda item: -len(item[1]))
+    for name, values in rows:
+        print(f"{name:<64} {len(values):>6} {statistics.median(values):>8.1f} "
+              f"{percentile(values, 95):>8.1f} {percentile(values, 99):>8.1f} {max(values):>8.1f}")
+    for name, values in (("ожидание в getUpdates", recorder.waiting), ("всего (ожидание + обработка)", recorder.end_to_end)):
+        if values:
+            print(f"{name:<64} {len(values):>6} {statistics.median(values):>8.1f} "
+                  f"{percentile(values, 95):>8.1f} {percentile(values, 99):>8.1f} {max(values):>8.1f}")
+
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(server.calls.items(), key=lambda i: -i[1]))
+    print(f"\n📤 Запросов к Bot API: {calls}")
+    if recorder.errors:
+        print("❌ Ошибки обработчиков: " + ", ".join(f"{n} {c}" for n, c in recorder.errors.items()))
+    if failures:
+        print(f"❌ Сценарии не дошли до конца: {len(failures)} (первый: {failures[0]})")
+
+
+# ==================== ЗАПУСК ====================
+
+async def run(args):
+    import logging
+    logging.disable(logging.WARNING)
+
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    import main as bot_main
+    from config import API_TOKEN, BREAKFAST_MENU
+    from utils.analytics import analytics
+    from utils.async_database import adb
+    from utils.storage import SQLiteStorage
+    from utils.tracing import tracer
+    from utils.metrics import metrics_exporter
+    from utils.database import db
+    from middlewares.metrics import TelegramMetricsMiddleware
+    from middlewares.tracing import TracingRequestMiddleware
+
+    server = FakeTelegram(api_latency=args.api_latency / 1000)
+    await server.start()
+
+    pending: Dict[int, asyncio.Future] = {}
+    recorder = Recorder(server, pending)
+
+    storage = SQLiteStorage()
+    bot = Bot(token=API_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(server.url)))
+    if args.trace:
+        # Как в main.py: трейсы апдейтов с запросами к БД и Bot API
+        tracer.enable(args.trace, database=db)
+        bot.session.middleware(TracingRequestMiddleware())
+    if args.metrics:
+        await metrics_exporter.start(args.metrics, database=db)
+        bot.session.middleware(TelegramMetricsMiddleware())
+    dp = bot_main.build_dispatcher(storage)
+    dp.update.outer_middleware(recorder.outer)
+    # Inner-middleware срабатывают по порядку регистрации - наш после VersionCheck и RateLimit
+    dp.message.middleware(recorder.inner)
+    dp.callback_query.middleware(recorder.inner)
+
+    analytics.start()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+
+    breakfast_items = list(BREAKFAST_MENU)
+    failures: List[str] = []
+    sim_users = [SimUser(FIRST_USER_ID + i, server, pending, args.think) for i in range(args.users)]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(u, random.uniform(0, args.ramp), breakfast_items, failures) for u in sim_users
+    ))
+    elapsed = time.perf_counter() - started
+
+    await dp.stop_polling()
+    await polling
+    await analytics.stop()
+    await storage.close()
+    await bot.session.close()
+    await server.stop()
+    await metrics_exporter.stop()
+    adb.close()
+    tracer.close()
+
+    print_report(recorder, server, elapsed, args.users, failures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000, help="виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=20.0, help="за сколько секунд приходят все пользователи")
+    parser.add_argument("--think", type=float, default=0.6,
+                        help="минимальная пауза между шагами пользователя, с (rate limit - 0.5)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="писать трейсы апдейтов в FILE (NDJSON), как TRACE_FILE у бота")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="писать метрики Prometheus в FILE, как METRICS_FILE у бота")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="задержка ответа поддельного Bot API, мс (у настоящего - десятки мс)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    # Тестовая БД во временной папке: боевой bot_data.db не трогаем
+    if args.trace:
+        args.trace = os.path.abspath(args.trace)
+    if args.metrics:
+        args.metrics = os.path.abspath(args.metrics)
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir)
+    print(f"Тестовая БД: {workdir}/bot_data.db")
+
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
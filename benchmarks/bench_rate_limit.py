@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Бенчмарк: RateLimitMiddleware на 10 000 разных пользователей
+Используй: python3 -m benchmarks.bench_rate_limit [--users 10000] [--rounds 20]
+
+Каждый раунд - по одному запросу от каждого пользователя. Сравниваются:
+
+  legacy - прежняя схема: dict с datetime, который пересобирается
+           на каждом запросе (очистка записей старше 2 минут)
+  bucket - token bucket со слотами и кучей сроков истечения
+
+Меряется время на один запрос и память под состояние пользователей,
+в конце проверяется, что молчащие пользователи удаляются.
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from middlewares.rate_limit import RateLimitMiddleware
+
+
+class LegacyLimiter:
+    """Ядро старого RateLimitMiddleware (без отправки сообщений)"""
+
+    def __init__(self, rate_limit=0.5):
+        self.rate_limit = rate_limit
+        self.user_timers = {}
+
+    def allow(self, user_id):
+        now = datetime.now()
+        if user_id in self.user_timers:
+            if (now - self.user_timers[user_id]).total_seconds() < self.rate_limit:
+                return False
+        self.user_timers[user_id] = now
+        cutoff_time = now - timedelta(minutes=2)
+        self.user_timers = {
+            uid: t for uid, t in self.user_timers.items() if t > cutoff_time
+        }
+        return True
+
+
+def run(name, allow, users, rounds):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for user_id in range(users):
+            allow(user_id)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls = users * rounds
+    print(f"{name:<8} {calls / elapsed:>12,.0f} запр/с  "
+          f"{elapsed / calls * 1e6:>8.2f} мкс/запрос  "
+          f"память {current / 1024:>8.0f} КБ (пик {peak / 1024:.0f} КБ)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк rate limiter")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--legacy-rounds", type=int, default=2,
+                        help="раундов для legacy (он O(N) на запрос)")
+    args = parser.parse_args()
+
+    print(f"👥 Пользователей: {args.users}\n")
+    run("legacy", LegacyLimiter().allow, args.users, args.legacy_rounds)
+
+    limiter = RateLimitMiddleware(rate_limit=0.5, burst=3)
+    run("bucket", limiter.allow, args.users, args.rounds)
+
+    # Все замолчали: через idle_ttl первый же запрос вычищает остальных
+    later = time.monotonic() + limiter.idle_ttl + 1
+    limiter.allow(-1, now=later)
+    print(f"\n🧹 После {limiter.idle_ttl:.0f} с тишины: "
+          f"{len(limiter.buckets)} пользователей, {len(limiter._expiry)} сроков в куче")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Проверка планов запросов (EXPLAIN QUERY PLAN) для bot_data.db
+Используй: python3 check_query_plans.py [-v]
+
+Собирает все SQL-запросы из utils/database.py и web/routes.py (строки
+в вызовах execute/executemany), создаёт во временной папке пустую БД
+со схемой из utils/migrations.py и прогоняет каждый запрос через
+EXPLAIN QUERY PLAN. Модули бота не импортируются: bot_data.db
+в текущей папке скрипт не открывает.
+
+Полный проход таблицы (SCAN без индекса) по горячей таблице - ошибка,
+скрипт завершается с кодом 1. Осознанные полные проходы перечислены
+в ALLOWED_SCANS.
+"""
+
+import argparse
+import ast
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# utils/migrations.py не проверяем: миграция выполняется один раз и пишется
+# под схему своей версии, а план строится по итоговой схеме
+SOURCES = ["utils/database.py", "web/routes.py"]
+
+# Таблицы, которые растут с числом пользователей и историей
+HOT_TABLES = {
+    "users",
+    "gruppenrun_registrations",
+    "active_registrations",
+    "event_tracking",
+    "fsm_storage",
+}
+
+# Значения для подстановок в f-строках: {выражение: {вариант: текст}}.
+# Константы модуля (например ACTIVE_EVENT_DATE_SQL) подставляются сами.
+SUBSTITUTIONS = {
+    "user_filter": {"all": "", "one": "AND user_id = ?"},
+}
+
+# Разрешённые полные проходы: (функция, таблица, вариант) -> причина
+ALLOWED_SCANS = {
+    ("get_all_users", "users", ""): "выгрузка всех пользователей",
+    ("_build_all_data", "users", "all"): "полный снимок all_data",
+    ("get_user_ids_by_version", "users", ""): "один раз при старте бота",
+}
+
+SQL_KEYWORDS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+class QueryCollector(ast.NodeVisitor):
+    """Находит SQL в conn.execute(...) / cursor.execute(...)"""
+
+    def __init__(self, path, constants):
+        self.path = path
+        self.constants = constants
+        self.function = "<module>"
+        self.queries = []
+        self.errors = []
+
+    def visit_FunctionDef(self, node):
+        outer, self.function = self.function, node.name
+        self.generic_visit(node)
+        self.function = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in ("execute", "executemany") and node.args:
+            for variant, sql in self._render(node.args[0]):
+                if sql.lstrip().upper().startswith(SQL_KEYWORDS):
+                    self.queries.append((self.path, node.lineno, self.function, variant, sql))
+        self.generic_visit(node)
+
+    def _render(self, arg):
+        """Текст запроса (для f-строк - все варианты подстановок)"""
+        if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+            return [("", arg.value)]
+        if not isinstance(arg, ast.JoinedStr):
+            return []
+        # DDL и PRAGMA не проверяем - не разбираем и подстановки
+        head = arg.values[0]
+        if not (isinstance(head, ast.Constant) and head.value.lstrip().upper().startswith(SQL_KEYWORDS)):
+            return []
+
+        parts = []
+        for value in arg.values:
+            if isinstance(value, ast.Constant):
+                parts.append({"": value.value})
+                continue
+            expr = ast.unparse(value.value)
+            if expr in SUBSTITUTIONS:
+                parts.append(SUBSTITUTIONS[expr])
+                continue
+            if expr in self.constants:
+                parts.append({"": str(self.constants[expr])})
+            else:
+                self.errors.append(
+                    f"{self.path}:{arg.lineno} ({self.function}): нет подстановки для {{{expr}}} в SUBSTITUTIONS"
+                )
+                return []
+
+        rendered = []
+        for combo in itertools.product(*(part.items() for part in parts)):
+            variant = "+".join(name for name, _ in combo if name)
+            rendered.append((variant, "".join(text for _, text in combo)))
+        return rendered
+
+
+def module_constants(tree):
+    """Константы модуля (NAME = литерал) - без импорта самого модуля"""
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    return constants
+
+
+def collect_queries():
+    queries, errors = [], []
+    for path in SOURCES:
+        with open(os.path.join(BASE_DIR, path), encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        collector = QueryCollector(path, module_constants(tree))
+        collector.visit(tree)
+        queries.extend(collector.queries)
+        errors.extend(collector.errors)
+    return queries, errors
+
+
+def full_scans(plan):
+    """Таблицы, которые план проходит целиком без индекса"""
+    tables = []
+    for row in plan:
+        detail = row[3]
+        if not detail.startswith("SCAN "):
+            continue
+        words = detail.split()
+        # «SCAN t USING [COVERING] INDEX ...» - проход по индексу, это нормально
+        if "INDEX" in words:
+            continue
+        tables.append(words[1])
+    return tables
+
+
+sys.path.insert(0, BASE_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов SQL-запросов")
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать план каждого запроса")
+    args = parser.parse_args()
+
+    queries, errors = collect_queries()
+
+    # Только схема: utils.database при импорте открывает ./bot_data.db
+    from utils.migrations import apply_migrations
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "plans.db"))
+        try:
+            apply_migrations(conn)
+            for path, lineno, function, variant, sql in queries:
+                where = f"{path}:{lineno} ({function}{', ' + variant if variant else ''})"
+                try:
+                    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?")).fetchall()
+                except sqlite3.Error as e:
+                    errors.append(f"{where}: запрос не разбирается: {e}")
+                    continue
+
+                if args.verbose:
+                    print(f"\n{where}")
+                    for row in plan:
+                        print(f"    {row[3]}")
+
+                for table in full_scans(plan):
+                    if table not in HOT_TABLES or (function, table, variant) in ALLOWED_SCANS:
+                        continue
+                    errors.append(f"{where}: полный проход таблицы {table}")
+        finally:
+            conn.close()
+
+    print(f"\n🔎 Проверено запросов: {len(queries)}")
+    if errors:
+        print(f"❌ Проблем: {len(errors)}")
+        for error in errors:
+            print(f"  • {error}")
+        return 1
+
+    print("✅ Полных проходов по горячим таблицам нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
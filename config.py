@@ -14,6 +14,39 @@ if not API_TOKEN or not ADMIN_ID:
 
 ADMIN_ID = int(ADMIN_ID)
 
+# Общий лимит исходящих сообщений в Telegram (в секунду, 0 - без лимита)
+OUTBOUND_RATE_LIMIT = float(os.getenv("OUTBOUND_RATE_LIMIT", "30"))
+# Сколько запросов можно отправить подряд, прежде чем включится лимит
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "30"))
+
+# Сколько дней хранить сырые события аналитики (дневные счётчики - всегда)
+EVENT_RETENTION_DAYS = int(os.getenv("EVENT_RETENTION_DAYS", "90"))
+
+# Трейсы апдейтов (NDJSON с ротацией, например traces.ndjson). По умолчанию
+# выключены: trace callback на каждый SQL-запрос и строка с user_id на апдейт
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+
+# Метрики Prometheus: файл, который отдаёт веб-панель на /metrics (пустая строка - выключены)
+METRICS_FILE = os.getenv("METRICS_FILE", "bot_metrics.prom")
+
+# --- Webhook вместо long polling (пустой WEBHOOK_URL - polling) ---
+# Публичный https-адрес (reverse proxy с TLS пересылает его на WEBHOOK_HOST:WEBHOOK_PORT)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token (пусто - случайный при запуске)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8081"))
+# Очередь апдейтов (полна - Telegram получает 503 и повторяет) и число обработчиков
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+
+# --- Несколько процессов (BOT_WORKERS > 1) ---
+# Супервизор получает апдейты и раздаёт их воркерам по user_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Очередь супервизора к каждому воркеру и сколько апдейтов воркер обрабатывает одновременно
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "64"))
+
 # --- Ссылки на оплату ---
 PAYMENT_LINK = "https://yoomoney.ru/fundraise/1C59KCB3HTO.250815"
 PAYMENT_MONTH_LINK = "https://yoomoney.ru/fundraise/1C5SH5U4OP8.250816"
@@ -5,8 +5,8 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from keyboards.reply import main_kb, admin_kb, back_kb
 from utils.helpers import (
-    load_data,
-    save_data,
+    load_data_async,
+    save_data_async,
     escape_markdown,
     can_user_order_breakfast,
     get_user_profile,
@@ -61,7 +61,7 @@ async def start_breakfast_order(callback_query: types.CallbackQuery, state: FSMC
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Проверяем, может ли пользователь заказать завтрак
     breakfast_check = can_user_order_breakfast(user_id, all_data)
@@ -89,7 +89,7 @@ async def modify_breakfast_order(callback_query: types.CallbackQuery, state: FSM
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Получаем текущий заказ
     user_data = all_data.get(user_id, {})
@@ -113,11 +113,11 @@ async def cancel_breakfast_order_from_profile(callback_query: types.CallbackQuer
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     if user_id in all_data and "breakfast_order" in all_data[user_id]:
         del all_data[user_id]["breakfast_order"]
-        save_data(all_data)
+        await save_data_async(all_data)
         
         await callback_query.message.edit_text(
             "❌ Заказ завтрака отменён.\nТы можешь оформить новый заказ в любое время."
@@ -182,7 +182,7 @@ async def finish_breakfast_order(callback_query: types.CallbackQuery, state: FSM
         await state.clear()
         return
     
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Проверяем регистрацию на Группенран
     if not check_gruppenrun_registration(user_id, all_data)["is_active"]:
@@ -217,7 +217,7 @@ async def finish_breakfast_order(callback_query: types.CallbackQuery, state: FSM
         "order_date": __import__('datetime').datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
     
-    save_data(all_data)
+    await save_data_async(all_data)
     
     await callback_query.message.edit_text(
         f"{order_text}\n\n✅ Заказ принят! Увидимся на пробежке!"
@@ -12,19 +12,21 @@ from utils.helpers import (
     get_current_gruppenrun_number,
     get_next_saturday,
     get_current_uktus_number,
-    load_data,
+    load_data_async,
+    load_user_async,
     get_user_profile,
     check_gruppenrun_registration,
     check_krugosvetka_registration,
     escape_markdown,
     can_user_order_breakfast,
-    save_data,
+    save_data_async,
     delete_last_admin_message,
     save_admin_message_id
 )
 
 from config import ADMIN_ID, BREAKFAST_MENU, PHOTO_HOW_TO_GET_COVER, IREMEL_MAX_PARTICIPANTS
 from utils.analytics import analytics
+from utils.async_database import adb
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -71,8 +73,8 @@ async def show_profile(message: types.Message, state: FSMContext):
     from utils.helpers import format_profile_display
     
     user_id = str(message.from_user.id)
-    all_data = load_data()
-    profile = get_user_profile(user_id, all_data)
+    user_data = await load_user_async(user_id)
+    profile = get_user_profile(user_id, {user_id: user_data} if user_data else {})
     
     if not profile or not profile.get("name"):
         await message.answer(
@@ -125,7 +127,7 @@ async def process_phone_contact(message: types.Message, state: FSMContext):
     data = await state.get_data()
     fullname = data.get("fullname")
     user_id = str(message.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     if user_id not in all_data:
         all_data[user_id] = {}
@@ -133,7 +135,7 @@ async def process_phone_contact(message: types.Message, state: FSMContext):
     all_data[user_id]["name"] = fullname
     all_data[user_id]["phone"] = phone
     all_data[user_id]["username"] = message.from_user.username
-    save_data(all_data)
+    await save_data_async(all_data)
     
     await message.answer(
         f"Ваш профиль сохранён:\n\nИмя: {fullname}\nТелефон: {phone}",
@@ -256,57 +258,35 @@ async def show_registrations(message: types.Message):
         await message.answer("❌ Эта команда доступна только администратору.")
         return
     
-    all_data = load_data()
+    all_data = await load_data_async()
     next_gruppenrun_date_str = get_next_sunday()
     next_gruppenrun_date_obj = datetime.strptime(next_gruppenrun_date_str, "%d.%m.%Y").date()
     next_gruppenrun_number = get_current_gruppenrun_number(next_gruppenrun_date_obj)
     
     # ===== ГРУППЕНРАН ШАРТАШ =====
+    from utils.async_database import adb
     gruppenrun_shartas_list = []
-    for user_id, user_data in all_data.items():
-        gruppenrun_data = user_data.get("gruppenrun", {})
-        if gruppenrun_data.get("is_registered"):
-            reg_type = gruppenrun_data.get("type", "onetime")
-            is_active = False
-        
-            if reg_type == "monthly":
-                valid_until = gruppenrun_data.get("valid_until")
-                if valid_until:
-                    try:
-                        valid_date = datetime.strptime(valid_until, "%Y-%m-%d").date()
-                        if datetime.now().date() <= valid_date:
-                            is_active = True
-                    except:
-                        pass
-            else:  # onetime
-                reg_date = gruppenrun_data.get("registration_for_date")
-                if reg_date == next_gruppenrun_date_str:
-                    is_active = True
-        
-            if is_active:
-                name = user_data.get("name", "Неизвестно")
-                phone = user_data.get("phone", "Нет")
-                username = user_data.get("username", "Нет")
-                gruppenrun_shartas_list.append(f"{name} | @{username} | {phone}")
+    shartas_regs = await adb.get_active_registrations('shartas', next_gruppenrun_date_obj.isoformat())
+    for reg in shartas_regs:
+        name = reg.get("name") or "Неизвестно"
+        phone = reg.get("phone") or "Нет"
+        username = reg.get("username") or "Нет"
+        gruppenrun_shartas_list.append(f"{name} | @{username} | {phone}")
 
     # ===== ГРУППЕНРАН ТРЕЙЛ =====
-    from utils.database import db
     gruppenrun_uktus_list = []
-    all_users = db.get_all_users()
 
     # Дата следующей тренировки Трейл (вручную или из конфига)
     next_uktus_date = get_next_saturday()
     next_uktus_number = get_current_uktus_number()
     next_uktus_date_str = next_uktus_date.strftime("%d.%m.%Y")
 
-    for user in all_users:
-        user_id = user['user_id']
-        reg = db.check_gruppenrun_registration(user_id, location='uktus')
-        if reg.get('is_active'):
-            name = user.get('name', 'Неизвестно')
-            phone = user.get('phone', 'Нет')
-            username = user.get('username', 'Нет')
-            gruppenrun_uktus_list.append(f"{name} | @{username} | {phone}")
+    uktus_regs = await adb.get_active_registrations('uktus', next_uktus_date.isoformat())
+    for reg in uktus_regs:
+        name = reg.get('name') or 'Неизвестно'
+        phone = reg.get('phone') or 'Нет'
+        username = reg.get('username') or 'Нет'
+        gruppenrun_uktus_list.append(f"{name} | @{username} | {phone}")
  
     # ===== КРУГОСВЕТКА =====
     krugosvetka_list = []
@@ -447,25 +427,20 @@ async def back_to_main_menu(message: types.Message, state: FSMContext):
     # Удаляем предыдущее сообщение
     await delete_last_admin_message(message, state, message.bot)
     
-    from utils.database import db
+    from utils.async_database import adb
     
-    # Получаем регистрации Трейл (location='uktus')
+    # Получаем регистрации Трейл (location='uktus') - один запрос по индексу
     uktus_list = []
+    next_uktus_date = get_next_saturday()
     
-    all_users = db.get_all_users()
-    for user in all_users:
-        user_id = user['user_id']
-        reg = db.check_gruppenrun_registration(user_id, location='uktus')
-        
-        if reg.get('is_active'):
-            name = user.get('name', 'Неизвестно')
-            phone = user.get('phone', 'Нет')
-            username = user.get('username', 'Нет')
-            reg_type = reg.get('type', 'onetime')
-            type_text = "Месячный" if reg_type == 'monthly' else "Разовый"
-            uktus_list.append(f"{name} | {type_text} | @{username} | {phone}")
+    for reg in await adb.get_active_registrations('uktus', next_uktus_date.isoformat()):
+        name = reg.get('name') or 'Неизвестно'
+        phone = reg.get('phone') or 'Нет'
+        username = reg.get('username') or 'Нет'
+        reg_type = reg.get('type', 'onetime')
+        type_text = "Месячный" if reg_type == 'monthly' else "Разовый"
+        uktus_list.append(f"{name} | {type_text} | @{username} | {phone}")
     
-    next_uktus_date = get_next_saturday()
     next_uktus_number = get_current_uktus_number()
     next_uktus_date_str = next_uktus_date.strftime("%d.%m.%Y")
 
@@ -494,7 +469,7 @@ async def show_breakfast_list(message: types.Message, state: FSMContext):
     # Удаляем предыдущее сообщение
     await delete_last_admin_message(message, state, message.bot)
     
-    all_data = load_data()
+    all_data = await load_data_async()
     
     breakfast_list = []
     
@@ -538,7 +513,7 @@ async def show_krugosvetka_list(message: types.Message, state: FSMContext):
     # Удаляем предыдущее сообщение
     await delete_last_admin_message(message, state, message.bot)
     
-    all_data = load_data()
+    all_data = await load_data_async()
     
     krugosvetka_list = []
     
@@ -591,7 +566,7 @@ async def show_iremel_list(message: types.Message, state: FSMContext):
     # Удаляем предыдущее сообщение
     await delete_last_admin_message(message, state, message.bot)
     
-    all_data = load_data()
+    all_data = await load_data_async()
     
     iremel_list = []
     waiting_list = []
@@ -662,7 +637,7 @@ async def admin_stats(message: types.Message):
         return
     
     # Получаем отчёт
-    report = analytics.get_stats_report()
+    report = await adb.run(analytics.get_stats_report)
     await message.answer(report, parse_mode="HTML")
     
     logger.info(f"📊 Админ {message.from_user.id} запросил статистику")
@@ -677,7 +652,7 @@ async def show_analytics(message: types.Message, state: FSMContext):
     await delete_last_admin_message(message, state, message.bot)
     
     # Получаем отчёт аналитики
-    report = analytics.get_stats_report()
+    report = await adb.run(analytics.get_stats_report)
     
     # Отправляем отчёт с админ-панелью
     sent_message = await message.answer(
@@ -5,7 +5,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from keyboards.reply import main_kb, admin_kb, back_kb, phone_kb, payment_kb
 from datetime import datetime, timedelta, date
-from utils.helpers import load_data, save_data, get_next_sunday, get_current_gruppenrun_number
+from utils.helpers import load_data_async, save_data_async, get_next_sunday, get_current_gruppenrun_number
 from config import ADMIN_ID, PAYMENT_LINK, PAYMENT_MONTH_LINK, PHONE_PAYMENT_INFO, PHOTO_GRUPPENRUN_COVER
 from utils.analytics import analytics
 from config import PAYMENT_DETAILS
@@ -67,7 +67,7 @@ async def gruppenrun_register(callback_query: types.CallbackQuery, state: FSMCon
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Получаем дату и номер ближайшего Группенрана
     next_gruppenrun_date_str = get_next_sunday()
@@ -296,7 +296,7 @@ async def gruppenrun_payment_callback(callback_query: types.CallbackQuery, state
     user_id = str(callback_query.from_user.id)
     reg_data = await state.get_data()
     
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
     
     reg_type = reg_data.get("payment_type", "onetime")
@@ -319,7 +319,7 @@ async def gruppenrun_payment_callback(callback_query: types.CallbackQuery, state
     }
     
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
 
     analytics.track_registration(message.from_user.id, "gruppenrun")
     
@@ -379,7 +379,7 @@ async def gruppenrun_payment_confirm_reply(message: types.Message, state: FSMCon
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
     
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
     
     reg_type = reg_data.get("payment_type", "onetime")
@@ -404,7 +404,7 @@ async def gruppenrun_payment_confirm_reply(message: types.Message, state: FSMCon
     }
     
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
     
     # Формируем сообщение пользователю
     reg_info_text = f"Группенран №{next_gruppenrun_number} ({next_gruppenrun_date_str})"
@@ -636,7 +636,7 @@ async def gruppenrun_friend_payment_confirm(message: types.Message, state: FSMCo
     """Подтверждение оплаты за друга"""
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Получаем данные регистратора
     registrator_name = all_data.get(user_id, {}).get("name", "Неизвестно")
@@ -670,7 +670,7 @@ async def gruppenrun_friend_payment_confirm(message: types.Message, state: FSMCo
         }
     }
     
-    save_data(all_data)
+    await save_data_async(all_data)
     
     # Уведомление пользователю
     is_admin = user_id == str(ADMIN_ID)
@@ -3,9 +3,9 @@ from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from keyboards.reply import main_kb, admin_kb, back_kb, phone_kb, payment_kb, register_friend_uktus_kb
+from keyboards.reply import main_kb, admin_kb, back_kb, phone_kb, payment_kb
 from datetime import datetime, timedelta, date
-from utils.database import db
+from utils.async_database import adb
 from config import ADMIN_ID, PAYMENT_LINK_UKTUS, PAYMENT_MONTH_LINK_UKTUS
 from utils.analytics import analytics
 from config import PAYMENT_DETAILS
@@ -94,11 +94,11 @@ async def uktus_register_callback(callback_query: types.CallbackQuery, state: FS
     """Начало регистрации"""
     await callback_query.answer()
     user_id = str(callback_query.from_user.id)
-    user = db.get_user(user_id)
+    user = await adb.get_user(user_id)
     
     # Проверка активной регистрации на Уктус
     if user:
-        uktus_reg = db.check_gruppenrun_registration(user_id, location='uktus')
+        uktus_reg = await adb.check_gruppenrun_registration(user_id, location='uktus')
         if uktus_reg.get("is_active"):
             await callback_query.message.answer(
                 f"✅ Ты уже зарегистрирован на Группенран Трейл!"
@@ -236,7 +236,7 @@ async def gruppenrun_uktus_payment_confirm(message: types.Message, state: FSMCon
     reg_type = "monthly" if "monthly" in payment_type else "onetime"
     
     # Сохраняем пользователя в единую базу
-    db.save_user(
+    await adb.save_user(
         user_id=user_id,
         name=reg_data.get("name"),
         phone=reg_data.get("phone"),
@@ -245,7 +245,7 @@ async def gruppenrun_uktus_payment_confirm(message: types.Message, state: FSMCon
     
     # Сохраняем регистрацию на Уктус
     valid_until = (date.today() + timedelta(days=30)).strftime("%Y-%m-%d") if reg_type == "monthly" else None
-    db.save_gruppenrun_registration(user_id, reg_type, valid_until, location='uktus')
+    await adb.save_gruppenrun_registration(user_id, reg_type, valid_until, location='uktus')
     
     # Формируем сообщение для пользователя
     reg_info_text = "Уровень подготовки: выбираешь сам в день тренировки!\n"
@@ -278,7 +278,7 @@ async def gruppenrun_uktus_payment_confirm(message: types.Message, state: FSMCon
         print(f"Ошибка отправки уведомления администратору: {e}")
     
     analytics.track_registration(message.from_user.id, "gruppenrun_uktus")
-    db.track_event(user_id, "registered_uktus", {"type": reg_type})
+    analytics.log_event(user_id, "registered_uktus", {"type": reg_type})
     
     await state.clear()
 
@@ -522,10 +522,10 @@ async def uktus_friend_payment_onetime(callback: types.CallbackQuery, state: FSM
     
     # Регистрируем друга
     valid_until = None
-    db.save_gruppenrun_registration(friend_temp_id, 'onetime', valid_until, location='uktus')
+    await adb.save_gruppenrun_registration(friend_temp_id, 'onetime', valid_until, location='uktus')
     
     # Сохраняем данные друга
-    db.save_user(
+    await adb.save_user(
         user_id=friend_temp_id,
         name=friend_name,
         phone=friend_phone,
@@ -561,10 +561,10 @@ async def uktus_friend_payment_monthly(callback: types.CallbackQuery, state: FSM
     
     # Регистрируем друга
     valid_until = (date.today() + timedelta(days=30)).strftime("%Y-%m-%d")
-    db.save_gruppenrun_registration(friend_temp_id, 'monthly', valid_until, location='uktus')
+    await adb.save_gruppenrun_registration(friend_temp_id, 'monthly', valid_until, location='uktus')
     
     # Сохраняем данные друга
-    db.save_user(
+    await adb.save_user(
         user_id=friend_temp_id,
         name=friend_name,
         phone=friend_phone,
@@ -4,7 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from datetime import datetime
-from utils.helpers import load_data, save_data
+from utils.helpers import load_data_async, save_data_async, load_user_async, get_iremel_participants_async
 from config import ADMIN_ID, PHONE_PAYMENT_INFO, PHOTO_IREMEL_COVER, IREMEL_PAYMENT_50, IREMEL_PAYMENT_100, IREMEL_MAX_PARTICIPANTS
 from keyboards.reply import main_kb, admin_kb, back_kb, phone_kb, payment_kb
 from utils.analytics import analytics
@@ -172,8 +172,7 @@ async def iremel_register(callback_query: types.CallbackQuery, state: FSMContext
         logging.info("🔍 Состояние очищено")
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
-    user_data = all_data.get(user_id, {})
+    user_data = await load_user_async(user_id) or {}
     
     # Проверка активной регистрации
     iremel_data = user_data.get("iremel", {})
@@ -195,8 +194,8 @@ async def iremel_register(callback_query: types.CallbackQuery, state: FSMContext
         return
     
     # ПРОВЕРКА КОЛИЧЕСТВА СВОБОДНЫХ МЕСТ
-    registered_count = sum(1 for uid, data in all_data.items()
-                           if data.get("iremel", {}).get("is_registered"))
+    iremel_participants = await get_iremel_participants_async()
+    registered_count = len(iremel_participants["registered"])
     
     logging.info(f"🔍 Зарегистрировано: {registered_count}/{IREMEL_MAX_PARTICIPANTS}")
     
@@ -429,7 +428,7 @@ async def iremel_payment_confirm(callback_query: types.CallbackQuery, state: FSM
     user_id = str(callback_query.from_user.id)
     reg_data = await state.get_data()
     
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
     
     # Сохраняем данные пользователя
@@ -447,7 +446,7 @@ async def iremel_payment_confirm(callback_query: types.CallbackQuery, state: FSM
     }
     
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
 
     analytics.track_registration(message.from_user.id, "iremel")
     
@@ -515,7 +514,7 @@ async def iremel_waiting_list_start(callback_query: types.CallbackQuery, state:
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     user_data = all_data.get(user_id, {})
     
     # Проверка профиля
@@ -534,7 +533,7 @@ async def iremel_waiting_list_start(callback_query: types.CallbackQuery, state:
             "waiting_list_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
         
-        save_data(all_data)
+        await save_data_async(all_data)
         
         # Уведомление админу
         admin_text = (
@@ -591,7 +590,7 @@ async def iremel_waiting_list_phone(message: types.Message, state: FSMContext):
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
     
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
     
     user_info["name"] = reg_data.get("name")
@@ -604,7 +603,7 @@ async def iremel_waiting_list_phone(message: types.Message, state: FSMContext):
     }
     
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
     
     # Уведомление админу
     admin_text = (
@@ -633,18 +632,9 @@ async def show_iremel_participants(callback_query: types.CallbackQuery):
     """Показать список участников кэмпа"""
     await callback_query.answer()
     
-    all_data = load_data()
-    participants = []
-    waiting_list = []
-    
-    for user_id, user_data in all_data.items():
-        iremel_data = user_data.get("iremel", {})
-        name = user_data.get("name", "Неизвестно")
-        
-        if iremel_data.get("is_registered"):
-            participants.append(name)
-        elif iremel_data.get("waiting_list"):
-            waiting_list.append(name)
+    iremel_participants = await get_iremel_participants_async()
+    participants = iremel_participants["registered"]
+    waiting_list = iremel_participants["waiting"]
     
     text = f"🏔 <b>Участники кэмпа на Иремель</b>\n\n"
     text += f"✅ Зарегистрировано: {len(participants)} из {IREMEL_MAX_PARTICIPANTS}\n\n"
@@ -683,7 +673,7 @@ async def iremel_payment_confirm_logic(message_or_callback, state: FSMContext):
     
     user_id = str(user.id)
     reg_data = await state.get_data()
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
 
     # Сохраняем данные
@@ -700,7 +690,7 @@ async def iremel_payment_confirm_logic(message_or_callback, state: FSMContext):
     }
 
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
 
     # Уведомление пользователю
     is_admin = user_id == str(ADMIN_ID)
@@ -899,7 +889,7 @@ async def iremel_friend_payment_confirm(message: types.Message, state: FSMContex
     """Подтверждение оплаты за друга на Иремель"""
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Получаем данные регистратора
     registrator_name = all_data.get(user_id, {}).get("name", "Неизвестно")
@@ -925,7 +915,7 @@ async def iremel_friend_payment_confirm(message: types.Message, state: FSMContex
         }
     }
     
-    save_data(all_data)
+    await save_data_async(all_data)
     
     # Уведомление пользователю
     is_admin = user_id == str(ADMIN_ID)
@@ -5,7 +5,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 
 from keyboards.reply import main_kb, admin_kb, back_kb, phone_kb, payment_kb
-from utils.helpers import load_data, escape_markdown, save_data
+from utils.helpers import load_data_async, escape_markdown, save_data_async
 from config import ADMIN_ID, KRUGOSVETKA_PAYMENT_LINK, KRUGOSVETKA_SUPPORT_PAYMENT_LINK, PHONE_PAYMENT_INFO, TRACK_LINK, KRUGOSVETKA_TABLE_LINK, PHOTO_KRUGOSVETKA_COVER
 from datetime import datetime
 import logging
@@ -169,7 +169,7 @@ async def krugosvetka_register_start(callback_query: types.CallbackQuery, state:
     """Начало регистрации на Кругосветку"""
     await callback_query.answer()
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     user_data = all_data.get(user_id, {})
 
     # Проверка, зарегистрирован ли уже пользователь
@@ -230,7 +230,7 @@ async def change_krugosvetka_stages_handler(callback_query: types.CallbackQuery,
     await callback_query.answer()
     
     user_id = str(callback_query.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     
     # Получаем текущие выбранные этапы
     krugosvetka_data = all_data.get(user_id, {}).get("krugosvetka", {})
@@ -396,14 +396,14 @@ async def krugosvetka_stage_selection(callback_query: types.CallbackQuery, state
         
         # Проверяем, это новая регистрация или изменение этапов
         user_id = str(callback_query.from_user.id)
-        all_data = load_data()
+        all_data = await load_data_async()
         is_registered = all_data.get(user_id, {}).get("krugosvetka", {}).get("is_registered", False)
         
         if is_registered:
             # Изменение существующих этапов
             all_data[user_id]["krugosvetka"]["stages"] = ", ".join(selected_stages_names)
             all_data[user_id]["krugosvetka"]["stages_ids"] = selected_stages_ids
-            save_data(all_data)
+            await save_data_async(all_data)
             
             await callback_query.message.delete()
             await callback_query.message.answer(
@@ -452,13 +452,13 @@ async def krugosvetka_pace(message: types.Message, state: FSMContext):
     reg_data = await state.get_data()
     
     user_id = str(message.from_user.id)
-    all_data = load_data()
+    all_data = await load_data_async()
     is_registered = all_data.get(user_id, {}).get("krugosvetka", {}).get("is_registered", False)
     
     if is_registered:
         # Изменение темпа для существующей регистрации
         all_data[user_id]["krugosvetka"]["pace"] = message.text
-        save_data(all_data)
+        await save_data_async(all_data)
         
         await message.answer(f"✅ Темп успешно изменён!\n\nНовый темп: {message.text}")
         await state.clear()
@@ -486,7 +486,7 @@ async def krugosvetka_payment(message: types.Message, state: FSMContext):
     """Подтверждение оплаты и завершение регистрации"""
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
 
     # Сохраняем данные пользователя
@@ -502,7 +502,7 @@ async def krugosvetka_payment(message: types.Message, state: FSMContext):
     }
 
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
 
     analytics.track_registration(message.from_user.id, "krugosvetka")
 
@@ -533,7 +533,7 @@ async def krugosvetka_payment_confirm_reply(message: types.Message, state: FSMCo
     user_id = str(message.from_user.id)
     reg_data = await state.get_data()
     
-    all_data = load_data()
+    all_data = await load_data_async()
     user_info = all_data.get(user_id, {})
     
     # Сохраняем данные
@@ -549,7 +549,7 @@ async def krugosvetka_payment_confirm_reply(message: types.Message, state: FSMCo
     }
     
     all_data[user_id] = user_info
-    save_data(all_data)
+    await save_data_async(all_data)
     
     # Уведомление пользователю
     is_admin = user_id == str(ADMIN_ID)
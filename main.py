@@ -1,19 +1,38 @@
 import asyncio
+import functools
 import logging
+import os
+import sys
 import traceback
 from datetime import datetime
 from typing import Dict, Any
 
 from aiogram import Bot, Dispatcher, types, Router
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import ErrorEvent
 
 # Импорт конфига и логирования
-from config import API_TOKEN, ADMIN_ID, BOT_VERSION
+from config import API_TOKEN, ADMIN_ID, BOT_VERSION, OUTBOUND_RATE_LIMIT, OUTBOUND_BURST, TRACE_FILE, METRICS_FILE
+from config import (
+    WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+)
+from config import BOT_WORKERS, WORKER_QUEUE_SIZE, WORKER_CONCURRENCY
 from handlers import common, gruppenrun, gruppenrun_uktus, krugosvetka, breakfast, iremel, fallback
 from middlewares.version_check import VersionCheckMiddleware
-from middlewares.rate_limit import RateLimitMiddleware
-from utils.helpers import load_data, save_data, cleanup_expired_onetime_registrations
+from middlewares.rate_limit import RateLimitMiddleware, OutboundRateLimiter
+from middlewares.metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware, TelegramMetricsMiddleware
+from middlewares.tracing import (
+    UpdateTracingMiddleware, StageTimer, HandlerTracingMiddleware, TracingRequestMiddleware
+)
+from utils.storage import SQLiteStorage
+from utils.analytics import analytics
+from utils.expiry import expiry_scheduler
+from utils.scheduler import scheduler, DailyAt, Every
+from utils.retention import apply_retention
+from utils.tracing import tracer
+from utils.metrics import metrics, metrics_exporter
+from utils.webhook import WebhookServer
+from utils.sharding import Supervisor, ShardWorker, ChangeFeedFollower, process_file
+from utils.database import db
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,101 +44,55 @@ logger = logging.getLogger(__name__)
 # Глобальные переменные
 bot: Bot = None
 dp: Dispatcher = None
-storage: MemoryStorage = None
+storage: SQLiteStorage = None
 
 async def on_startup(dp):
     """Выполняется при запуске бота"""
-    logger.info("Бот запущен. Выполняю очистку истёкших регистраций...")
-    
-    from utils.database import db
-    from datetime import datetime
+    logger.info("Бот запущен. Запускаю истечение регистраций по расписанию...")
     
-    # ===== ОЧИСТКА ШАРТАШ =====
-    all_data = load_data()
-    cleanup_expired_onetime_registrations(all_data)
-    
-    # ===== ОЧИСТКА ТРЕЙЛ =====
-    # Очистка в воскресенье 00:00 (после субботней тренировки)
-    today = datetime.now()
-    if today.weekday() == 6:  # 6 = Воскресенье
-        logger.info("🗑️ Очистка регистраций Трейл...")
-    
-        all_users = db.get_all_users()
-        for user in all_users:
-            user_id = user['user_id']
-            reg = db.check_gruppenrun_registration(user_id, location='uktus')
-        
-            if reg.get('is_active') and reg.get('type') == 'onetime':
-                db.unregister_gruppenrun(user_id, location='uktus')
-                logger.info(f"🗑️ Трейл: {user_id} - регистрация удалена")
+    # ===== ИСТЕЧЕНИЕ РЕГИСТРАЦИЙ ШАРТАШ И ТРЕЙЛ =====
+    # Регистрации убираются ровно после своей тренировки (min-heap сроков),
+    # пропущенные за время простоя бота - сразу при старте
+    expiry_scheduler.start()
 
 # ==================== ЕЖЕДНЕВНЫЙ ОТЧЁТ ====================
 
 async def send_daily_report(bot: Bot):
-    """Отправляет ежедневный отчёт админу в 9:00"""
-    import asyncio
-    from datetime import datetime, time
-    from utils.analytics import analytics
+    """Отправляет ежедневный отчёт админу (задача планировщика, 9:00)"""
+    from utils.async_database import adb
     
-    while True:
-        try:
-            now = datetime.now()
-            target_time = time(9, 0)  # 9:00 утра
-            
-            # Если текущее время после 9:00, отправляем
-            if now.time() >= target_time:
-                report = analytics.get_stats_report()
-                await bot.send_message(ADMIN_ID, report, parse_mode="HTML")
-                logger.info("📊 Ежедневный отчёт отправлен админу")
-                
-                # Ждём 24 часа до следующего отчёта
-                await asyncio.sleep(86400)
-            else:
-                # Ждём 1 час и проверим снова
-                await asyncio.sleep(3600)
-        except Exception as e:
-            logger.error(f"❌ Ошибка при отправке отчёта: {e}")
-            # Ждём 1 час и попробуем снова
-            await asyncio.sleep(3600)
+    report = await adb.run(analytics.get_stats_report)
+    await bot.send_message(ADMIN_ID, report, parse_mode="HTML")
+    logger.info("📊 Ежедневный отчёт отправлен админу")
 
-# ===== ФУНКЦИЯ ОЧИСТКИ ТРЕЙЛ =====
-async def clear_uktus_registrations():
-    """Очищает разовые регистрации Трейл в воскресенье 00:00"""
-    import sqlite3
-    logger.info("🗑️ Очистка регистраций Трейл...")
-    
-    conn = sqlite3.connect('bot_data.db')
-    cursor = conn.cursor()
-    
-    # Удаляем разовые регистрации
-    cursor.execute("DELETE FROM gruppenrun_registrations WHERE location = 'uktus' AND type = 'onetime'")
-    deleted = cursor.rowcount
-    
-    conn.commit()
-    conn.close()
-    
-    logger.info(f"Очистка Трейл завершена. Удалено: {deleted}")
+# ==================== ДИСПЕТЧЕР ====================
 
-async def main():
-    """Основная функция бота"""
-    global bot, dp, storage
-    
-    logger.info("Запуск бота...")
-    
-    # Инициализация хранилища FSM
-    storage = MemoryStorage()
-    
-    # Создание объектов бота и диспетчера
-    bot = Bot(token=API_TOKEN)
+def build_dispatcher(storage) -> Dispatcher:
+    """
+    Диспетчер со всеми middleware, обработчиком ошибок и роутерами
+
+    Роутеры - глобальные объекты модулей handlers, поэтому вызывать
+    один раз на процесс (бот или нагрузочный тест benchmarks/bench_e2e.py).
+    """
     dp = Dispatcher(storage=storage)
     
+    # Метрики и трейс на каждый апдейт (трейс пишется, только если включён tracer)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(UpdateTracingMiddleware())
+    
     # Подключение middleware
-    dp.message.middleware(VersionCheckMiddleware())
-    dp.callback_query.middleware(VersionCheckMiddleware())
+    dp.message.middleware(StageTimer("version_check", VersionCheckMiddleware()))
+    dp.callback_query.middleware(StageTimer("version_check", VersionCheckMiddleware()))
     
     # ✅ Rate Limiting - защита от спама
-    dp.message.middleware(RateLimitMiddleware(rate_limit=0.5))
-    dp.callback_query.middleware(RateLimitMiddleware(rate_limit=0.3))
+    dp.message.middleware(StageTimer("rate_limit", RateLimitMiddleware(rate_limit=0.5)))
+    dp.callback_query.middleware(StageTimer("rate_limit", RateLimitMiddleware(rate_limit=0.3)))
+    
+    # Последним: какой обработчик сработал и сколько работал
+    dp.message.middleware(HandlerTracingMiddleware())
+    dp.callback_query.middleware(HandlerTracingMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
     
     # Подключение обработчика ошибок
     @dp.error()
@@ -161,8 +134,89 @@ async def main():
     dp.include_router(iremel.router)
     dp.include_router(fallback.router)
     
-    # Удаление webhook (на случай, если использовался ранее)
-    await bot.delete_webhook(drop_pending_updates=True)
+    return dp
+
+# ==================== ПРОЦЕСС БОТА ====================
+
+def create_bot(share: int = 1) -> Bot:
+    """
+    Bot с middleware исходящих запросов: трейсы, метрики, общий лимит
+
+    share - на сколько процессов делится лимит бота (воркеры при BOT_WORKERS > 1):
+    и скорость, и burst, иначе вместе они разом отправят burst * share запросов
+    """
+    bot = Bot(token=API_TOKEN)
+    # Первым, чтобы в трейс попало и ожидание в лимитере исходящих
+    bot.session.middleware(TracingRequestMiddleware())
+    bot.session.middleware(TelegramMetricsMiddleware())
+    if OUTBOUND_RATE_LIMIT > 0:
+        # Общий лимит исходящих запросов (рассылки не упираются в 429)
+        bot.session.middleware(OutboundRateLimiter(
+            rate_per_second=OUTBOUND_RATE_LIMIT / share,
+            burst=max(1, OUTBOUND_BURST // share)
+        ))
+    return bot
+
+async def start_telemetry(process: str = None):
+    """Трейсы и метрики (у каждого процесса при BOT_WORKERS > 1 - свои файлы)"""
+    metrics.process = process
+    # Трейсы апдейтов: этапы, запросы к БД и к Bot API
+    if TRACE_FILE:
+        tracer.enable(process_file(TRACE_FILE, process) if process else TRACE_FILE, database=db)
+    # Метрики Prometheus: файл для /metrics веб-панели
+    if METRICS_FILE:
+        await metrics_exporter.start(process_file(METRICS_FILE, process) if process else METRICS_FILE, database=db)
+
+def start_scheduler(bot: Bot):
+    """✅ Периодические задачи: слоты по часам, отметки запусков в БД"""
+    from utils.async_database import adb
+    
+    scheduler.add_job(
+        "daily_report", DailyAt(9, 0), functools.partial(send_daily_report, bot),
+        jitter=60, misfire_grace=3 * 3600
+    )
+    scheduler.add_job("event_retention", DailyAt(4, 0), apply_retention, jitter=600, misfire_grace=12 * 3600)
+    if BOT_WORKERS > 1:
+        scheduler.add_job("change_feed_prune", Every(60), adb.prune_change_feed, misfire_grace=60)
+    scheduler.start()
+    logger.info("📊 Система ежедневных отчётов запущена")
+
+async def shutdown(bot: Bot, storage: SQLiteStorage = None):
+    """Сохранить всё несохранённое и остановить фоновые задачи"""
+    logger.info("Закрываем соединение с ботом...")
+    if storage is not None:
+        await storage.close()
+    await bot.session.close()
+    await analytics.stop()
+    await expiry_scheduler.stop()
+    await scheduler.stop()
+    await metrics_exporter.stop()
+    from utils.async_database import adb
+    adb.close()
+    tracer.close()
+
+async def main():
+    """Основная функция бота"""
+    global bot, dp, storage
+    
+    if BOT_WORKERS > 1:
+        await run_supervisor()
+        return
+    
+    logger.info("Запуск бота...")
+    
+    # Инициализация хранилища FSM (в bot_data.db - переживает перезапуск)
+    storage = SQLiteStorage()
+    
+    await start_telemetry()
+    
+    # Создание объектов бота и диспетчера
+    bot = create_bot()
+    dp = build_dispatcher(storage)
+    
+    if not WEBHOOK_URL:
+        # Удаление webhook (на случай, если использовался ранее)
+        await bot.delete_webhook(drop_pending_updates=True)
     
     # Проверяем подключение к Telegram API
     try:
@@ -176,29 +230,126 @@ async def main():
     # ✅ ВЫЗЫВАЕМ ОЧИСТКУ ПРИ СТАРТЕ
     await on_startup(dp)
     
-    # ✅ Запускаем отправку ежедневного отчёта в фоне
-    asyncio.create_task(send_daily_report(bot))  
-    logger.info("📊 Система ежедневных отчётов запущена")
+    # ✅ Аналитика пишется в БД пачками в фоне
+    analytics.start()
+    
+    start_scheduler(bot)
 
-    # Запуск поллинга (бесконечное получение обновлений)
+    # Запуск поллинга (бесконечное получение обновлений) или webhook
     try:
         logger.info("Начинаем получение обновлений...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if WEBHOOK_URL:
+            webhook = WebhookServer(
+                bot, dp, url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS
+            )
+            await webhook.serve(WEBHOOK_HOST, WEBHOOK_PORT)
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except KeyboardInterrupt:
         logger.info("Получен сигнал прерывания, завершаем работу...")
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
     finally:
-        logger.info("Закрываем соединение с ботом...")
-        await storage.close()
-        await bot.session.close()
+        await shutdown(bot, storage)
+
+# ==================== НЕСКОЛЬКО ПРОЦЕССОВ ====================
+
+def worker_command(index: int):
+    """Команда запуска воркера: этот же main.py с --worker"""
+    return [sys.executable, os.path.abspath(__file__), "--worker", str(index)]
+
+async def run_supervisor():
+    """
+    Супервизор (BOT_WORKERS > 1): получает апдейты и раздаёт их воркерам
+    
+    Сам апдейты не обрабатывает: только раздача, ежедневные задачи,
+    истечение регистраций и очистка change_feed - по одному разу на бота.
+    Обработчики работают в воркерах.
+    """
+    logger.info(f"Запуск бота: супервизор и воркеров {BOT_WORKERS}...")
+    await start_telemetry("supervisor")
+    # Изменения супервизора (истечение, очистка) видны воркерам, а новые
+    # регистрации из воркеров попадают в планировщик истечения
+    follower = ChangeFeedFollower(db)
+    await follower.start()
+    
+    bot = create_bot()
+    # Диспетчер супервизора - только для списка типов апдейтов
+    dp = build_dispatcher(None)
+    
+    try:
+        bot_info = await bot.get_me()
+        logger.info(f"Бот запущен: @{bot_info.username}")
+    except Exception as e:
+        logger.error(f"Ошибка при подключении к Telegram API: {e}")
+        await follower.stop()
+        await shutdown(bot)
+        return
+    
+    await on_startup(dp)
+    supervisor = Supervisor(worker_command, BOT_WORKERS, queue_size=WORKER_QUEUE_SIZE)
+    await supervisor.start()
+    start_scheduler(bot)
+    
+    try:
+        logger.info("Начинаем получение обновлений...")
+        if WEBHOOK_URL:
+            # Одна задача раздачи: апдейты пользователя уходят воркеру по порядку
+            webhook = WebhookServer(
+                bot, dp, url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                queue_size=WEBHOOK_QUEUE_SIZE, workers=1, handler=supervisor.route
+            )
+            await webhook.serve(WEBHOOK_HOST, WEBHOOK_PORT)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await supervisor.serve_polling(bot, dp.resolve_used_update_types())
+    except Exception as e:
+        logger.error(f"Ошибка при работе бота: {e}")
+    finally:
+        await supervisor.close()
+        await follower.stop()
+        await shutdown(bot)
+
+async def run_worker(index: int):
+    """Воркер (BOT_WORKERS > 1): обрабатывает апдейты своих пользователей от супервизора"""
+    global bot, dp, storage
+    
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(
+            f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s'
+        ))
+    
+    storage = SQLiteStorage()
+    await start_telemetry(f"worker{index}")
+    # Кэши узнают об изменениях, сделанных другими воркерами
+    follower = ChangeFeedFollower(db)
+    await follower.start()
+    
+    # Лимит исходящих общий на бота - делим между воркерами
+    bot = create_bot(share=BOT_WORKERS)
+    dp = build_dispatcher(storage)
+    
+    # Истечение регистраций (on_startup) - в супервизоре, одно на всех
+    analytics.start()
+    
+    try:
+        await ShardWorker(bot, dp, concurrency=WORKER_CONCURRENCY).serve()
+    except Exception as e:
+        logger.error(f"Ошибка при работе воркера: {e}")
+    finally:
+        await follower.stop()
+        await shutdown(bot, storage)
 
 
 if __name__ == "__main__":
     """Точка входа в программу"""
     try:
         # Запуск асинхронной функции
-        asyncio.run(main())
+        if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+            asyncio.run(run_worker(int(sys.argv[2])))
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("\nПрограмма прервана пользователем")
     except Exception as e:
@@ -0,0 +1,76 @@
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import Update
+from typing import Callable, Dict, Any, Awaitable
+import time
+
+from utils.metrics import metrics
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Outer-middleware апдейтов (dp.update.outer_middleware): число апдейтов
+    и полное время обработки по типам (message, callback_query, ...)
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.update_seconds.labels(event.event_type).observe(time.perf_counter() - started)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Последний inner-middleware: время обработчика по роутерам
+
+    Роутер - модуль обработчика (handlers/gruppenrun.py -> gruppenrun).
+    """
+
+    async def __call__(self, handler, event, data):
+        router = data["handler"].callback.__module__.rsplit(".", 1)[-1]
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.labels(router).inc()
+            raise
+        finally:
+            metrics.handler_seconds.labels(router).observe(time.perf_counter() - started)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Запросы к Bot API (bot.session.middleware): число по методам
+    и результату, время, ответы 429
+
+    Подключать до OutboundRateLimiter: в замер входит ожидание лимита.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            result = "429"
+            metrics.api_retry_after.labels().inc()
+            raise
+        except TelegramNetworkError:
+            result = "network"
+            raise
+        except Exception as e:
+            result = type(e).__name__
+            raise
+        finally:
+            # getUpdates - long polling, его время - ожидание апдейтов, а не задержка API
+            if method.__api_method__ != "getUpdates":
+                metrics.api_seconds.labels().observe(time.perf_counter() - started)
+            metrics.api_requests.labels(method.__api_method__, result).inc()
@@ -1,29 +1,102 @@
 from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
 from aiogram.types import Message, CallbackQuery
-from typing import Callable, Dict, Any, Awaitable
-from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, Awaitable, List, Tuple
+import asyncio
+import heapq
 import logging
+import time
+
+from utils.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
+class _Bucket:
+    """Состояние одного пользователя (слоты вместо __dict__ - ~100 байт)"""
+    __slots__ = ("tokens", "updated", "expires", "warnings", "last_warning")
+
+    def __init__(self, tokens: float, now: float, expires: float):
+        self.tokens = tokens
+        self.updated = now
+        self.expires = expires
+        self.warnings = 0
+        self.last_warning = 0.0
+
+
 class RateLimitMiddleware(BaseMiddleware):
     """
     Middleware для ограничения частоты запросов (rate limiting)
     
     Защищает бота от спама и флуда со стороны пользователей
+
+    Token bucket на пользователя: до burst запросов подряд, дальше
+    refill_rate запросов в секунду. Время - time.monotonic() (не зависит
+    от перевода часов). Пользователи, молчащие idle_ttl секунд, удаляются
+    через кучу сроков истечения - без обхода всех пользователей.
     """
     
-    def __init__(self, rate_limit: float = 0.5):
+    def __init__(self, rate_limit: float = 0.5, burst: int = 1,
+                 refill_rate: float = None, idle_ttl: float = 120.0):
         """
         Args:
             rate_limit: Минимальный интервал между запросами в секундах
                        (по умолчанию 0.5 секунды = 2 запроса в секунду максимум)
+            burst: Сколько запросов можно сделать подряд без ожидания
+            refill_rate: Скорость пополнения (запросов в секунду),
+                        по умолчанию 1 / rate_limit
+            idle_ttl: Через сколько секунд тишины забыть пользователя
         """
         super().__init__()
         self.rate_limit = rate_limit
-        self.user_timers: Dict[int, datetime] = {}
-        self.spam_warnings: Dict[int, int] = {}  # Счётчик предупреждений
+        self.burst = float(burst)
+        self.refill_rate = refill_rate if refill_rate is not None else 1.0 / rate_limit
+        self.idle_ttl = idle_ttl
+        self.buckets: Dict[int, _Bucket] = {}
+        # (момент истечения, user_id) - самый ранний срок наверху
+        self._expiry: List[Tuple[float, int]] = []
+
+    def _expire(self, now: float):
+        """Удалить пользователей, чей срок истёк (ленивая куча)"""
+        expiry = self._expiry
+        buckets = self.buckets
+        while expiry and expiry[0][0] <= now:
+            expires, user_id = heapq.heappop(expiry)
+            bucket = buckets.get(user_id)
+            if bucket is None:
+                continue
+            if bucket.expires <= now:
+                del buckets[user_id]
+            else:
+                # Пользователь был активен - переносим срок, а не удаляем
+                heapq.heappush(expiry, (bucket.expires, user_id))
+
+    def allow(self, user_id: int, now: float = None) -> Tuple[bool, _Bucket]:
+        """Списать токен пользователя. Возвращает (разрешено, состояние)"""
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = _Bucket(self.burst, now, now + self.idle_ttl)
+            self.buckets[user_id] = bucket
+            heapq.heappush(self._expiry, (bucket.expires, user_id))
+        else:
+            tokens = bucket.tokens + (now - bucket.updated) * self.refill_rate
+            bucket.tokens = tokens if tokens < self.burst else self.burst
+            bucket.updated = now
+            bucket.expires = now + self.idle_ttl
+
+        if bucket.tokens >= 1.0:
+            bucket.tokens -= 1.0
+            # Уменьшаем счётчик при каждом нормальном запросе
+            if bucket.warnings > 0:
+                bucket.warnings -= 1
+            return True, bucket
+
+        bucket.warnings += 1
+        return False, bucket
     
     async def __call__(
         self,
@@ -32,64 +105,72 @@ class RateLimitMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         user_id = event.from_user.id
-        now = datetime.now()
+        now = time.monotonic()
+        allowed, bucket = self.allow(user_id, now)
         
-        # Проверяем время последнего запроса от пользователя
-        if user_id in self.user_timers:
-            time_passed = (now - self.user_timers[user_id]).total_seconds()
+        if not allowed:
+            # Слишком быстро - засчитываем нарушение
+            metrics.rate_limited.labels("callback_query" if isinstance(event, CallbackQuery) else "message").inc()
+            logger.warning(
+                f"⏱ Rate limit для пользователя {user_id} "
+                f"({event.from_user.username or 'no username'}). "
+                f"Нарушений: {bucket.warnings}"
+            )
+            
+            # Отправляем разные сообщения в зависимости от типа события
+            if isinstance(event, CallbackQuery):
+                # Для callback просто показываем уведомление
+                await event.answer("⏱ Подожди немного", show_alert=False)
             
-            if time_passed < self.rate_limit:
-                # Слишком быстро - засчитываем нарушение
-                self.spam_warnings[user_id] = self.spam_warnings.get(user_id, 0) + 1
-                
-                logger.warning(
-                    f"⏱ Rate limit для пользователя {user_id} "
-                    f"({event.from_user.username or 'no username'}). "
-                    f"Нарушений: {self.spam_warnings[user_id]}"
-                )
-                
-                # Отправляем разные сообщения в зависимости от типа события
-                if isinstance(event, CallbackQuery):
-                    # Для callback просто показываем уведомление
-                    await event.answer("⏱ Подожди немного", show_alert=False)
-                
-                elif isinstance(event, Message):
-                    # Для сообщений отправляем предупреждение только раз в 5 секунд
-                    last_warning_time = getattr(self, f'_last_warning_{user_id}', None)
+            elif isinstance(event, Message):
+                # Для сообщений отправляем предупреждение только раз в 5 секунд
+                if bucket.last_warning == 0.0 or now - bucket.last_warning > 5:
+                    bucket.last_warning = now
                     
-                    if last_warning_time is None or (now - last_warning_time).total_seconds() > 5:
-                        setattr(self, f'_last_warning_{user_id}', now)
-                        
-                        warnings_count = self.spam_warnings[user_id]
-                        
-                        if warnings_count <= 3:
-                            await event.answer("⏱ Не так быстро! Подожди секунду.")
-                        elif warnings_count <= 6:
-                            await event.answer(
-                                "⚠️ Слишком много запросов!\n"
-                                "Подожди несколько секунд перед следующим действием."
-                            )
-                        else:
-                            # При частом спаме можем временно игнорировать
-                            logger.warning(f"🚨 Пользователь {user_id} превысил лимит спама")
-                
-                return  # Прерываем обработку — игнорируем запрос
-        
-        # Обновляем время последнего запроса
-        self.user_timers[user_id] = now
-        
-        # Сбрасываем счётчик предупреждений, если пользователь "успокоился"
-        if user_id in self.spam_warnings and self.spam_warnings[user_id] > 0:
-            # Уменьшаем счётчик при каждом нормальном запросе
-            self.spam_warnings[user_id] = max(0, self.spam_warnings[user_id] - 1)
-        
-        # Очистка старых записей (старше 2 минут)
-        cutoff_time = now - timedelta(minutes=2)
-        self.user_timers = {
-            uid: time 
-            for uid, time in self.user_timers.items() 
-            if time > cutoff_time
-        }
+                    warnings_count = bucket.warnings
+                    
+                    if warnings_count <= 3:
+                        await event.answer("⏱ Не так быстро! Подожди секунду.")
+                    elif warnings_count <= 6:
+                        await event.answer(
+                            "⚠️ Слишком много запросов!\n"
+                            "Подожди несколько секунд перед следующим действием."
+                        )
+                    else:
+                        # При частом спаме можем временно игнорировать
+                        logger.warning(f"🚨 Пользователь {user_id} превысил лимит спама")
+            
+            return  # Прерываем обработку — игнорируем запрос
         
         # Пропускаем запрос к основному обработчику
         return await handler(event, data)
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Общий лимит исходящих запросов к Telegram API (bot.session.middleware)
+
+    Token bucket на весь бот: до burst запросов подряд, дальше
+    rate_per_second. Лишние запросы не отбрасываются, а ждут своей
+    очереди (рассылки и ответы при всплеске не упираются в 429).
+    """
+
+    def __init__(self, rate_per_second: float = 30.0, burst: int = 30):
+        self.rate = rate_per_second
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, make_request, bot, method):
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1.0:
+                # Ждём ровно до появления токена (под замком - очередь FIFO)
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated = time.monotonic()
+            self.tokens -= 1.0
+        return await make_request(bot, method)
@@ -0,0 +1,130 @@
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+from typing import Callable, Dict, Any, Awaitable
+import time
+
+from utils.tracing import current_span, tracer
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware апдейтов (dp.update.outer_middleware): span на апдейт
+
+    Внутри span-а отмечаются этапы (StageTimer, HandlerTracingMiddleware),
+    вызовы БД (adb.run) и запросы к Bot API (TracingRequestMiddleware).
+    Пока трейсы не включены (tracer.enable), ничего не делает.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not tracer.enabled:
+            return await handler(event, data)
+
+        user = data.get("event_from_user")
+        span, token = tracer.start_span(event.update_id, event.event_type, user.id if user else None)
+        try:
+            result = await handler(event, data)
+            if result is UNHANDLED and span.handler is None:
+                span.outcome = "unhandled"
+            return result
+        except Exception as e:
+            span.outcome = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            tracer.finish_span(span, token)
+
+
+class StageTimer(BaseMiddleware):
+    """
+    Обёртка над inner-middleware: сколько времени занял он сам
+
+    Время дальнейшей обработки (следующие middleware и обработчик)
+    вычитается - в span попадает только работа middleware:
+
+        dp.message.middleware(StageTimer("rate_limit", RateLimitMiddleware()))
+    """
+
+    def __init__(self, name: str, middleware: BaseMiddleware):
+        self.name = name
+        self.middleware = middleware
+
+    async def __call__(self, handler, event, data):
+        span = current_span()
+        if span is None:
+            return await self.middleware(handler, event, data)
+
+        downstream = 0.0
+
+        async def timed_handler(event, data):
+            nonlocal downstream
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                downstream += time.perf_counter() - started
+
+        span.stages.setdefault(self.name, 0.0)  # порядок этапов в трейсе - порядок вызова
+        started = time.perf_counter()
+        try:
+            return await self.middleware(timed_handler, event, data)
+        finally:
+            span.add_stage(self.name, time.perf_counter() - started - downstream)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """
+    Последний inner-middleware: какой обработчик сработал и сколько работал
+
+    Регистрируется после остальных - вызывается, только если апдейт
+    прошёл VersionCheck и RateLimit и нашёлся подходящий обработчик.
+    """
+
+    async def __call__(self, handler, event, data):
+        span = current_span()
+        if span is None:
+            return await handler(event, data)
+
+        callback = data["handler"].callback
+        span.handler = f"{callback.__module__.rsplit('.', 1)[-1]}.{callback.__name__}"
+        span.outcome = "handled"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            # Ошибку обработает dp.error() - до UpdateTracingMiddleware она не дойдёт
+            span.outcome = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.add_stage("handler", time.perf_counter() - started)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """
+    Запросы к Bot API в span апдейта (bot.session.middleware)
+
+    Подключать первым: тогда в замер входит и ожидание
+    в OutboundRateLimiter.
+    """
+
+    async def __call__(self, make_request, bot, method):
+        span = current_span()
+        if span is None:
+            return await make_request(bot, method)
+
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            # Здесь же TelegramRetryAfter (429) и прочие ошибки API
+            span.add_api_call(method.__api_method__, time.perf_counter() - started, type(e).__name__)
+            raise
+        span.add_api_call(method.__api_method__, time.perf_counter() - started)
+        return response
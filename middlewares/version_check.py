@@ -1,9 +1,24 @@
+import asyncio
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery, ReplyKeyboardRemove
 from aiogram import types
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional, Set
 from config import BOT_VERSION
-from utils.helpers import load_data, save_data
+from utils.async_database import adb
+
+# Пользователи, уже перешедшие на BOT_VERSION. Общее для всех экземпляров
+# middleware (сообщения и callback-и): загружается из БД один раз,
+# дальше пополняется точечно при обновлении пользователя.
+_current_version_users: Optional[Set[str]] = None
+_load_lock = asyncio.Lock()
+
+async def _get_current_version_users() -> Set[str]:
+    global _current_version_users
+    if _current_version_users is None:
+        async with _load_lock:
+            if _current_version_users is None:
+                _current_version_users = await adb.get_user_ids_by_version(BOT_VERSION)
+    return _current_version_users
 
 class VersionCheckMiddleware(BaseMiddleware):
     async def __call__(
@@ -13,23 +28,24 @@ class VersionCheckMiddleware(BaseMiddleware):
         data: Dict[str, Any]
     ) -> Any:
         user_id = str(event.from_user.id)
-        all_data = load_data()
-        user_data = all_data.get(user_id, {})
         
-        # Проверяем версию пользователя
-        user_version = user_data.get("bot_version", "0.0.0")
+        # Проверяем версию пользователя: O(1) по множеству, без БД
+        current_users = await _get_current_version_users()
         
-        if user_version != BOT_VERSION:
+        if user_id not in current_users:
             # Обновляем версию и сбрасываем состояние
             state = data.get("state")
             if state:
                 await state.clear()
             
-            # Сохраняем новую версию
-            if user_id not in all_data:
-                all_data[user_id] = {}
-            all_data[user_id]["bot_version"] = BOT_VERSION
-            save_data(all_data)
+            # Сохраняем новую версию только этому пользователю (одна строка в БД).
+            # В множество добавляем сразу, чтобы двойной клик не дал второе уведомление
+            current_users.add(user_id)
+            try:
+                await adb.save_user(user_id, bot_version=BOT_VERSION)
+            except Exception:
+                current_users.discard(user_id)
+                raise
             
             # Отправляем уведомление пользователю
             if isinstance(event, Message):
@@ -3,14 +3,30 @@
 
 """
 Скрипт миграции данных из JSON в SQLite БД
-Используй: python3 migrate_to_sqlite.py
+Используй: python3 migrate_to_sqlite.py [--file registrations_db.json] [--batch-size 500]
+           python3 migrate_to_sqlite.py --vacuum   (при остановленном боте)
+
+JSON читается потоково (по одному пользователю, файл целиком в память
+не загружается), строки пишутся пачками executemany в одной транзакции.
+Повторный запуск безопасен: пользователи, Иремель, Кругосветка и завтраки
+обновляются через upsert, уже перенесённые регистрации Группенран не
+дублируются.
+
+--vacuum - одноразовый перевод старой bot_data.db в auto_vacuum=INCREMENTAL
+(полный VACUUM): после него ежедневная очистка аналитики возвращает
+место ОС по частям.
 """
 
+import argparse
 import json
 import logging
+import os
 import sys
-from datetime import datetime
-from utils.database import db
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from utils.database import db, to_iso_date
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,98 +35,327 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+JSON_FILE = "registrations_db.json"
+BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+# Старые названия типов регистрации в JSON -> как их пишет бот
+REG_TYPES = {"one_time": "onetime"}
+
+# PRAGMA на время загрузки: без fsync на каждую страницу, большой кэш
+BULK_PRAGMAS = (
+    "PRAGMA synchronous = OFF",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA temp_store = MEMORY",
+)
+RESTORE_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -2000",
+)
+
+# ==================== ЗАПРОСЫ ====================
+
+UPSERT_USER = """
+INSERT INTO users (user_id, name, phone, username, bot_version)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    name = COALESCE(excluded.name, users.name),
+    phone = COALESCE(excluded.phone, users.phone),
+    username = COALESCE(excluded.username, users.username),
+    bot_version = COALESCE(excluded.bot_version, users.bot_version),
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+# История регистраций: та же запись (пользователь, тип, время) не повторяется.
+# Без registration_date в JSON время - момент импорта (NULL нарушил бы
+# NOT NULL event_date в active_registrations), а повтор узнаём по датам записи
+INSERT_GRUPPENRUN = """
+INSERT INTO gruppenrun_registrations
+    (user_id, location, type, valid_until, registration_for_date, registered_at)
+SELECT ?1, ?2, ?3, ?4, ?5, COALESCE(?6, CURRENT_TIMESTAMP)
+WHERE NOT EXISTS (
+    SELECT 1 FROM gruppenrun_registrations
+    WHERE user_id = ?1 AND location = ?2 AND type = ?3
+      AND CASE WHEN ?6 IS NULL
+               THEN valid_until IS ?4 AND registration_for_date IS ?5
+               ELSE registered_at = ?6
+          END
+)
+"""
+
+UPSERT_IREMEL = """
+INSERT INTO iremel_registrations
+    (user_id, is_registered, waiting_list, payment_type, diet_restrictions, preferences)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    is_registered = excluded.is_registered,
+    waiting_list = excluded.waiting_list,
+    payment_type = excluded.payment_type,
+    diet_restrictions = excluded.diet_restrictions,
+    preferences = excluded.preferences
+"""
+
+UPSERT_KRUGOSVETKA = """
+INSERT INTO krugosvetka_registrations (user_id, stages, stages_ids, pace)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET
+    stages = excluded.stages,
+    stages_ids = excluded.stages_ids,
+    pace = excluded.pace
+"""
+
+UPSERT_BREAKFAST = """
+INSERT INTO breakfast_orders (user_id, order_date, items, total_price)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(user_id, order_date) DO UPDATE SET
+    items = excluded.items,
+    total_price = excluded.total_price
+"""
+
+# Порядок важен: сначала пользователи, потом ссылающиеся на них таблицы
+TABLES = (
+    ("users", UPSERT_USER),
+    ("gruppenrun", INSERT_GRUPPENRUN),
+    ("iremel", UPSERT_IREMEL),
+    ("krugosvetka", UPSERT_KRUGOSVETKA),
+    ("breakfast", UPSERT_BREAKFAST),
+)
+
+
+# ==================== ПОТОКОВОЕ ЧТЕНИЕ JSON ====================
+
+def iter_json_object(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """Пары (ключ, значение) верхнего уровня JSON-объекта, без загрузки файла целиком"""
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            """Дочитать следующий кусок; False - файл кончился"""
+            nonlocal buffer, pos, eof
+            if eof:
+                return False
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            return True
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos].isspace():
+                    pos += 1
+                if pos < len(buffer) or not fill():
+                    return
+
+        def expect(chars: str) -> str:
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buffer) or buffer[pos] not in chars:
+                found = buffer[pos] if pos < len(buffer) else "конец файла"
+                raise json.JSONDecodeError(f"Ожидалось {chars!r}, найдено {found!r}", buffer, pos)
+            pos += 1
+            return buffer[pos - 1]
+
+        def decode():
+            nonlocal pos
+            skip_ws()
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # Значение оборвалось на границе куска - дочитываем
+                    if fill():
+                        continue
+                    raise
+                # Число на границе куска может быть неполным («12» из «123»)
+                if end == len(buffer) and not eof and fill():
+                    continue
+                pos = end
+                return value
+
+        expect("{")
+        skip_ws()
+        if pos < len(buffer) and buffer[pos] == "}":
+            return
+        while True:
+            key = decode()
+            expect(":")
+            yield key, decode()
+            if expect(",}") == "}":
+                return
+
+
+# ==================== СТРОКИ ДЛЯ ТАБЛИЦ ====================
+
+def to_utc_timestamp(value: Optional[str]) -> Optional[str]:
+    """
+    Время 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' из JSON (местное) -> UTC
 
-def migrate_from_json():
+    В БД registered_at хранится в UTC (CURRENT_TIMESTAMP), от этого
+    считают дату тренировки и дневные счётчики.
+    """
+    if not value:
+        return None
+    try:
+        local = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return value
+    return local.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def user_rows(user_id: str, user_data: Dict[str, Any]) -> Dict[str, List[tuple]]:
+    """Строки всех таблиц для одного пользователя из JSON"""
+    rows = {name: [] for name, _ in TABLES}
+
+    rows["users"].append((
+        user_id,
+        user_data.get("name"),
+        user_data.get("phone"),
+        user_data.get("username"),
+        user_data.get("bot_version", "1.0.0"),
+    ))
+
+    # В старых записях раздел назывался «gruppenran»
+    for key in ("gruppenran", "gruppenrun"):
+        gr_data = user_data.get(key)
+        if gr_data and gr_data.get("is_registered", True):
+            reg_type = gr_data.get("type", "onetime")
+            rows["gruppenrun"].append((
+                user_id,
+                gr_data.get("location", "shartas"),
+                REG_TYPES.get(reg_type, reg_type),
+                gr_data.get("valid_until"),
+                to_iso_date(gr_data.get("registration_for_date")),
+                to_utc_timestamp(gr_data.get("registration_date")),
+            ))
+
+    ir_data = user_data.get("iremel")
+    if ir_data:
+        rows["iremel"].append((
+            user_id,
+            ir_data.get("is_registered", False),
+            ir_data.get("waiting_list", False),
+            ir_data.get("payment_type"),
+            ir_data.get("diet_restrictions"),
+            ir_data.get("preferences"),
+        ))
+
+    kr_data = user_data.get("krugosvetka")
+    if kr_data and kr_data.get("is_registered", True):
+        rows["krugosvetka"].append((
+            user_id,
+            kr_data.get("stages"),
+            json.dumps(kr_data.get("stages_ids") or [], ensure_ascii=False),
+            kr_data.get("pace"),
+        ))
+
+    order = user_data.get("breakfast_order")
+    if order and order.get("items"):
+        rows["breakfast"].append((
+            user_id,
+            order.get("order_date") or user_data.get("registration_date"),
+            json.dumps(order["items"], ensure_ascii=False),
+            order.get("total_price"),
+        ))
+
+    return rows
+
+
+# ==================== МИГРАЦИЯ ====================
+
+def migrate_from_json(path: str = JSON_FILE, batch_size: int = BATCH_SIZE) -> bool:
     """Миграция данных из registrations_db.json в SQLite"""
-    
+
     logger.info("=" * 60)
     logger.info("🔄 НАЧАЛО МИГРАЦИИ ДАННЫХ ИЗ JSON В SQLITE")
     logger.info("=" * 60)
-    
-    # Загружаем данные из JSON
-    try:
-        with open("registrations_db.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-            logger.info(f"✅ Загружен файл registrations_db.json ({len(data)} пользователей)")
-    except FileNotFoundError:
-        logger.error("❌ Файл registrations_db.json не найден!")
-        logger.info("📌 Убедись, что скрипт запущен из папки /root/gruppenrun_bot/")
-        return False
-    except json.JSONDecodeError:
-        logger.error("❌ Ошибка при чтении JSON файла (повреждённый формат)")
-        return False
-    
-    # Счётчики
-    migrated_users = 0
-    migrated_gruppenrun = 0
-    migrated_iremel = 0
+
+    pending = {name: [] for name, _ in TABLES}
+    written = {name: 0 for name, _ in TABLES}
+    users = 0
     errors = 0
-    
-    logger.info(f"\n📝 Начинаю миграцию {len(data)} пользователей...\n")
-    
-    for user_id, user_data in data.items():
-        try:
-            # ✅ Мигрируем пользователя
-            db.save_user(
-                user_id=user_id,
-                name=user_data.get("name"),
-                phone=user_data.get("phone"),
-                username=user_data.get("username"),
-                bot_version=user_data.get("bot_version", "1.0.0")
-            )
-            migrated_users += 1
-            
-            # ✅ Мигрируем Группенран (если есть)
-            if "gruppenrun" in user_data and user_data["gruppenrun"]:
-                try:
-                    gr_data = user_data["gruppenrun"]
-                    db.save_gruppenrun_registration(
-                        user_id=user_id,
-                        reg_type=gr_data.get("type", "onetime"),
-                        valid_until=gr_data.get("valid_until")
-                    )
-                    migrated_gruppenrun += 1
-                    logger.debug(f"  ✓ Групpenrun: {user_id}")
-                except Exception as e:
-                    logger.warning(f"  ⚠ Ошибка Групpenrun для {user_id}: {e}")
-            
-            # ✅ Мигрируем Иремель (если есть)
-            if "iremel" in user_data and user_data["iremel"]:
+    undated = 0
+
+    def flush(conn):
+        # Порядок TABLES: пользователи пишутся раньше ссылающихся на них строк
+        for name, sql in TABLES:
+            batch = pending[name]
+            if batch:
+                written[name] += conn.executemany(sql, batch).rowcount
+                batch.clear()
+
+    if not os.path.exists(path):
+        logger.error(f"❌ Файл {path} не найден!")
+        logger.info("📌 Запусти скрипт из папки бота или укажи путь: --file путь/к/registrations_db.json")
+        return False
+
+    started = time.perf_counter()
+    try:
+        # Одна транзакция на весь импорт: либо всё, либо ничего
+        with db.get_connection() as conn:
+            for pragma in BULK_PRAGMAS:
+                conn.execute(pragma)
+
+            for user_id, user_data in iter_json_object(path):
                 try:
-                    ir_data = user_data["iremel"]
-                    db.save_iremel_registration(
-                        user_id=user_id,
-                        is_registered=ir_data.get("is_registered", False),
-                        waiting_list=ir_data.get("waiting_list", False),
-                        payment_type=ir_data.get("payment_type"),
-                        diet_restrictions=ir_data.get("diet_restrictions"),
-                        preferences=ir_data.get("preferences")
-                    )
-                    migrated_iremel += 1
-                    logger.debug(f"  ✓ Иремель: {user_id}")
+                    rows = user_rows(user_id, user_data)
                 except Exception as e:
-                    logger.warning(f"  ⚠ Ошибка Иремель для {user_id}: {e}")
-        
-        except Exception as e:
-            logger.error(f"❌ Ошибка миграции пользователя {user_id}: {e}")
-            errors += 1
-    
+                    logger.error(f"❌ Ошибка в данных пользователя {user_id}: {e}")
+                    errors += 1
+                    continue
+
+                users += 1
+                # Без registration_date: время регистрации - момент импорта
+                undated += sum(1 for row in rows["gruppenrun"] if row[5] is None)
+                for name, table_rows in rows.items():
+                    pending[name].extend(table_rows)
+                if any(len(batch) >= batch_size for batch in pending.values()):
+                    flush(conn)
+            flush(conn)
+    except json.JSONDecodeError as e:
+        logger.error(f"❌ Ошибка при чтении JSON файла (повреждённый формат): {e}")
+        logger.info("↩️ Изменения в БД отменены")
+        return False
+    finally:
+        with db.get_connection() as conn:
+            for pragma in RESTORE_PRAGMAS:
+                conn.execute(pragma)
+
+    elapsed = time.perf_counter() - started
+    total = sum(written.values())
+    rate = total / elapsed if elapsed > 0 else 0.0
+
     # Итоги миграции
     logger.info("\n" + "=" * 60)
     logger.info("✅ МИГРАЦИЯ ЗАВЕРШЕНА!")
     logger.info("=" * 60)
     logger.info(f"""
 📊 РЕЗУЛЬТАТЫ:
-   • Всего пользователей: {migrated_users}
-   • Регистраций Групpenран: {migrated_gruppenrun}
-   • Регистраций Иремель: {migrated_iremel}
+   • Всего пользователей: {users}
+   • Строк пользователей: {written['users']}
+   • Регистраций Группенран (новых): {written['gruppenrun']}
+   • Из них без registration_date (время импорта): {undated}
+   • Регистраций Иремель: {written['iremel']}
+   • Регистраций Кругосветка: {written['krugosvetka']}
+   • Заказов завтраков: {written['breakfast']}
    • Ошибок: {errors}
-   
+
+⚡ СКОРОСТЬ:
+   • Записано строк: {total} за {elapsed:.3f} с
+   • {rate:,.0f} строк/с (пачки по {batch_size})
+
 📁 Новые файлы:
    • bot_data.db (SQLite база данных)
-   • registrations_db.json (оригинальный файл, сохранён)
+   • {path} (оригинальный файл, сохранён)
     """)
-    
+
     if errors == 0:
         logger.info("✅ Миграция прошла успешно без ошибок!")
         return True
@@ -120,8 +365,19 @@ def migrate_from_json():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграция registrations_db.json в SQLite")
+    parser.add_argument("--file", default=JSON_FILE, help="JSON-файл с данными бота")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="строк в одном executemany")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="только включить auto_vacuum=INCREMENTAL (VACUUM, бот должен быть остановлен)")
+    args = parser.parse_args()
+
     try:
-        success = migrate_from_json()
+        if args.vacuum:
+            if not db.enable_incremental_vacuum():
+                logger.info("✅ auto_vacuum=INCREMENTAL уже включён")
+            sys.exit(0)
+        success = migrate_from_json(args.file, args.batch_size)
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         logger.warning("\n⚠️ Миграция прервана пользователем")
@@ -5,55 +5,155 @@
 Система аналитики и мониторинга бота
 """
 
+import asyncio
 import logging
 import json
-from datetime import datetime, date
+from collections import deque
+from datetime import datetime, date, timezone
 from utils.database import db
 
 logger = logging.getLogger(__name__)
 
 
 class Analytics:
-    """Класс для работы с аналитикой бота"""
-    
-    @staticmethod
-    def track_button_click(user_id: str, button_name: str, context: dict = None):
-        """Отследить клик на кнопку"""
+    """
+    Класс для работы с аналитикой бота
+
+    События не пишутся в БД из обработчика: track_*() только кладёт
+    событие в очередь в памяти (без ожидания). Очередь сбрасывается
+    в event_tracking пачками (executemany, одна транзакция):
+    - как только набралось batch_size событий
+    - раз в flush_interval секунд (фоновая задача, start())
+    - при остановке бота (stop())
+    Если БД не успевает и в очереди max_pending событий, самые старые
+    отбрасываются (счётчик dropped) - память не растёт бесконечно.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5.0,
+                 max_pending: int = 10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._queue = deque()
+        self._flush_task = None
+        self._flusher = None
+        self.dropped = 0
+        self.flushed = 0
+
+    # ==================== ОЧЕРЕДЬ СОБЫТИЙ ====================
+    def _enqueue(self, user_id, event_name: str, event_data: dict = None):
+        """Положить событие в очередь (без обращения к БД)"""
+        self._trim(self.max_pending - 1)
+
+        # Время фиксируем сейчас (в формате CURRENT_TIMESTAMP, UTC)
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._queue.append((
+            str(user_id),
+            event_name,
+            json.dumps(event_data) if event_data else None,
+            created_at
+        ))
+
+        if len(self._queue) >= self.batch_size:
+            self._schedule_flush()
+
+    def _trim(self, limit: int):
+        """Отбросить самые старые события, пока в очереди больше limit"""
+        while len(self._queue) > limit:
+            self._queue.popleft()
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"⚠️ Очередь аналитики переполнена, отброшено событий: {self.dropped}")
+
+    def _requeue(self, batch):
+        """Вернуть несохранённую пачку в начало очереди (в пределах max_pending)"""
+        self._queue.extendleft(reversed(batch))
+        # Пока пачка писалась, очередь могла дорасти до предела
+        self._trim(self.max_pending)
+
+    def _schedule_flush(self):
+        """Запустить сброс в фоне (если есть event loop и сброс ещё не идёт)"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
         try:
-            db.track_event(
-                user_id=str(user_id),
-                event_name=f"button:{button_name}",
-                event_data={"button": button_name, **(context or {})}
-            )
-            logger.info(f"🔘 Клик на кнопку '{button_name}' от {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при отслеживании клика: {e}")
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты) - пишем сразу
+            self.flush_sync()
+            return
+        self._flush_task = loop.create_task(self.flush())
+
+    def _take_batch(self):
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        return batch
+
+    async def flush(self):
+        """Сбросить всю очередь в БД пачками через поток БД"""
+        from utils.async_database import adb
+        while self._queue:
+            batch = self._take_batch()
+            try:
+                await adb.track_events_batch(batch)
+                self.flushed += len(batch)
+            except Exception as e:
+                logger.error(f"Ошибка при записи событий аналитики: {e}")
+                # Вернём пачку в начало очереди - попробуем при следующем сбросе
+                self._requeue(batch)
+                return
+
+    def flush_sync(self):
+        """Сбросить очередь синхронно (вне event loop)"""
+        while self._queue:
+            batch = self._take_batch()
+            try:
+                db.track_events_batch(batch)
+                self.flushed += len(batch)
+            except Exception as e:
+                logger.error(f"Ошибка при записи событий аналитики: {e}")
+                self._requeue(batch)
+                return
+
+    async def _periodic_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Запустить фоновый сброс по времени (вызывать из event loop)"""
+        if self._flusher is None:
+            self._flusher = asyncio.get_running_loop().create_task(self._periodic_flush())
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать всё, что осталось"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        logger.info(f"📊 Аналитика остановлена (записано: {self.flushed}, отброшено: {self.dropped})")
+
+    # ==================== ОТСЛЕЖИВАНИЕ ====================
+    def log_event(self, user_id: str, event_name: str, event_data: dict = None):
+        """Отследить произвольное событие"""
+        self._enqueue(user_id, event_name, event_data)
+
+    def track_button_click(self, user_id: str, button_name: str, context: dict = None):
+        """Отследить клик на кнопку"""
+        self._enqueue(user_id, f"button:{button_name}", context)
+        logger.info(f"🔘 Клик на кнопку '{button_name}' от {user_id}")
     
-    @staticmethod
-    def track_registration(user_id: str, service: str):
+    def track_registration(self, user_id: str, service: str):
         """Отследить регистрацию"""
-        try:
-            db.track_event(
-                user_id=str(user_id),
-                event_name=f"registration:{service}",
-                event_data={"service": service}
-            )
-            logger.info(f"📝 Регистрация на {service} от {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при отслеживании регистрации: {e}")
+        self._enqueue(user_id, f"registration:{service}")
+        logger.info(f"📝 Регистрация на {service} от {user_id}")
     
-    @staticmethod
-    def track_command(user_id: str, command: str):
+    def track_command(self, user_id: str, command: str):
         """Отследить команду"""
-        try:
-            db.track_event(
-                user_id=str(user_id),
-                event_name=f"command:{command}",
-                event_data={"command": command}
-            )
-            logger.info(f"⚙️ Команда /{command} от {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при отслеживании команды: {e}")
+        self._enqueue(user_id, f"command:{command}")
+        logger.info(f"⚙️ Команда /{command} от {user_id}")
     
     @staticmethod
     def get_stats_report() -> str:
@@ -0,0 +1,82 @@
+# Файл: utils/async_database.py
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный фасад над utils.database.Database
+
+Все запросы выполняются в одном выделенном потоке БД, поэтому
+обработчики aiogram не блокируют event loop, а записи в SQLite
+по-прежнему идут строго последовательно.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from utils.database import Database, db
+from utils.metrics import metrics
+from utils.tracing import current_span, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """
+    Та же поверхность методов, что у Database, но каждый метод — корутина:
+
+        user = await adb.get_user(user_id)
+        await adb.save_user(user_id, name=name)
+    """
+
+    def __init__(self, database: Database):
+        self._db = database
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._wait_seconds = metrics.db_wait_seconds.labels()
+        self._call_seconds = metrics.db_call_seconds.labels()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполнить произвольную синхронную функцию в потоке БД"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        span = current_span()
+        if span is not None:
+            # Вызов из обработки апдейта - время и запросы попадут в его трейс
+            name = getattr(func, "__name__", type(func).__name__)
+            call = functools.partial(tracer.run_db_call, span, name, call)
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._timed, time.perf_counter(), call)
+        )
+
+    def _timed(self, submitted: float, call: Callable[[], Any]) -> Any:
+        """Выполнение в потоке БД: сколько вызов ждал очереди и сколько работал"""
+        started = time.perf_counter()
+        self._wait_seconds.observe(started - submitted)
+        try:
+            return call()
+        finally:
+            self._call_seconds.observe(time.perf_counter() - started)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._db, name)
+        if name.startswith('_') or name == 'get_connection' or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        # Кэшируем обёртку, чтобы не создавать её на каждый вызов
+        setattr(self, name, method)
+        return method
+
+    def close(self):
+        """Дождаться завершения запросов и остановить поток БД"""
+        self._executor.shutdown(wait=True)
+        self._db.close()
+
+
+# Глобальный экземпляр
+adb = AsyncDatabase(db)
@@ -1,75 +1,233 @@
-from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
 import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Callable, Iterable, Tuple
 
 logger = logging.getLogger(__name__)
 
+# Ключ полного снимка all_data
+SNAPSHOT_KEY = ("all_data",)
+
+# Какие агрегаты устаревают при изменении раздела пользователя.
+# Профиль (имя) входит в списки участников, поэтому сбрасывает все агрегаты;
+# смена bot_version не влияет ни на один агрегат.
+SECTION_EVENTS = {
+    "profile": None,
+    "version": (),
+    "gruppenrun": ("gruppenrun",),
+    "iremel": ("iremel",),
+    "breakfast": (),
+}
+
 
 class DataCache:
     """
     In-memory кэш для данных регистраций
-    
+
     Решает проблему:
     - Каждый обработчик вызывает load_data() (чтение с диска)
     - При 100+ пользователей это замораживает бот
-    
+
     Решение:
-    - Кэшируем данные в памяти на 30-60 секунд
-    - Автоматически инвалидируем после save_data()
+    - Кэшируем по ключам: полный снимок, отдельные пользователи
+      ("user", user_id) и агрегаты мероприятий ("event", event, name)
+    - LRU + TTL: не больше max_entries записей, каждая живёт ttl секунд
+    - Точечная инвалидация: изменение пользователя сбрасывает только его
+      запись и агрегаты затронутого мероприятия, а в снимке пользователь
+      помечается устаревшим и перечитывается при следующем load_data()
     """
-    
-    def __init__(self, ttl_seconds: int = 60):
+
+    def __init__(self, ttl_seconds: int = 60, max_entries: int = 1024):
         """
         Args:
-            ttl_seconds: Time To Live кэша в секундах (по умолчанию 60)
+            ttl_seconds: Time To Live записи в секундах (по умолчанию 60)
+            max_entries: Максимум записей, дальше вытесняются самые старые
         """
-        self._cache: Optional[Dict[str, Any]] = None
-        self._last_update: Optional[datetime] = None
-        self.ttl = timedelta(seconds=ttl_seconds)
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        # key -> (значение, момент истечения по time.monotonic())
+        self._entries: "OrderedDict[Tuple, Tuple[Any, float]]" = OrderedDict()
+        # Пользователи, изменённые в БД после загрузки снимка
+        self._stale_users = set()
+        # Кэш читают и поток БД (load_data_async), и event loop
+        self._lock = threading.RLock()
         self.hits = 0
         self.misses = 0
-    
-    def get_data(self, load_func) -> Dict[str, Any]:
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ==================== ОБЩИЕ ОПЕРАЦИИ ====================
+    def _lookup(self, key: Tuple):
+        """Значение из кэша или None (с учётом TTL и порядка LRU)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            if key == SNAPSHOT_KEY:
+                self._stale_users.clear()
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: Tuple, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.evictions += 1
+            if evicted_key == SNAPSHOT_KEY:
+                self._stale_users.clear()
+
+    def get(self, key: Tuple, load_func: Callable[[], Any]) -> Any:
+        """
+        Получить значение по ключу, при промахе вызвать load_func()
+
+        None не кэшируется (нет пользователя - спросим БД ещё раз).
         """
-        Получить данные с кэшированием
-        
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            logger.debug(f"📥 Cache MISS — {key}")
+            value = load_func()
+            if value is not None:
+                self._store(key, value)
+            return value
+
+    # ==================== СНИМОК ====================
+    def get_data(self, load_func, refresh_func=None) -> Dict[str, Any]:
+        """
+        Получить полный снимок с кэшированием
+
         Args:
-            load_func: Функция load_data() из helpers.py
-        
+            load_func: Функция загрузки снимка из helpers.py
+            refresh_func: refresh_func(snapshot, user_ids) - перечитать
+                пользователей, изменённых в БД после загрузки снимка
+
         Returns:
             Кэшированные или свежие данные
         """
-        now = datetime.now()
-        
-        # Если кэш устарел или пуст — загружаем свежие данные
-        if self._cache is None or (now - self._last_update) > self.ttl:
-            logger.debug("📥 Cache MISS — загружаю данные с диска")
-            self._cache = load_func()
-            self._last_update = now
-            self.misses += 1
-        else:
-            # Используем кэшированные данные
+        with self._lock:
+            snapshot = self._lookup(SNAPSHOT_KEY)
+            if snapshot is None:
+                logger.debug("📥 Cache MISS — загружаю данные с диска")
+                self.misses += 1
+                self._stale_users.clear()
+                snapshot = load_func()
+                self._store(SNAPSHOT_KEY, snapshot)
+                return snapshot
+
             logger.debug("✅ Cache HIT — использую кэшированные данные")
             self.hits += 1
-        
-        return self._cache
-    
-    def invalidate(self):
-        """Инвалидировать кэш (вызвать после save_data())"""
-        self._cache = None
-        self._last_update = None
-        logger.debug("🔄 Cache invalidated")
-    
+            if self._stale_users:
+                stale, self._stale_users = self._stale_users, set()
+                if refresh_func is not None:
+                    refresh_func(snapshot, stale)
+                else:
+                    # Без функции обновления снимок больше не доверяем
+                    self._entries.pop(SNAPSHOT_KEY, None)
+                    snapshot = load_func()
+                    self._store(SNAPSHOT_KEY, snapshot)
+            return snapshot
+
+    def take_stale_users(self) -> Tuple[Optional[Dict[str, Any]], set]:
+        """
+        Снимок (или None) и пользователи, устаревшие в нём
+
+        Список устаревших очищается: обновить их в снимке должен
+        вызывающий (load_data_async - в event loop, а не в потоке БД).
+        """
+        with self._lock:
+            snapshot = self._lookup(SNAPSHOT_KEY)
+            if snapshot is None:
+                return None, set()
+            self.hits += 1
+            stale, self._stale_users = self._stale_users, set()
+            return snapshot, stale
+
+    def peek_data(self) -> Optional[Dict[str, Any]]:
+        """Снимок, если он есть в кэше (без загрузки и без статистики)"""
+        with self._lock:
+            entry = self._entries.get(SNAPSHOT_KEY)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def is_user_fresh(self, user_id: str) -> bool:
+        """Данные пользователя в кэшированном снимке актуальны"""
+        return str(user_id) not in self._stale_users
+
+    def mark_fresh(self, user_ids: Iterable[str]):
+        """Снимок уже содержит актуальные данные этих пользователей"""
+        with self._lock:
+            self._stale_users.difference_update(str(user_id) for user_id in user_ids)
+
+    # ==================== ПОЛЬЗОВАТЕЛИ И АГРЕГАТЫ ====================
+    def get_user(self, user_id: str, load_func: Callable[[], Any]) -> Any:
+        """Данные одного пользователя (ключ ("user", user_id))"""
+        return self.get(("user", str(user_id)), load_func)
+
+    def get_event(self, event: str, name: str, load_func: Callable[[], Any]) -> Any:
+        """Агрегат мероприятия: счётчик, список участников и т.п."""
+        return self.get(("event", event, name), load_func)
+
+    # ==================== ИНВАЛИДАЦИЯ ====================
+    def invalidate(self, user_id: str = None, events: Optional[Iterable[str]] = None):
+        """
+        Инвалидировать кэш
+
+        Без аргументов - сбросить всё. С user_id - только запись
+        пользователя (в снимке он помечается устаревшим) и агрегаты
+        мероприятий events (None - все агрегаты, () - ни одного).
+        """
+        with self._lock:
+            self.invalidations += 1
+            if user_id is None:
+                self._entries.clear()
+                self._stale_users.clear()
+                logger.debug("🔄 Cache invalidated")
+                return
+
+            user_id = str(user_id)
+            self._entries.pop(("user", user_id), None)
+            if SNAPSHOT_KEY in self._entries:
+                self._stale_users.add(user_id)
+
+            if events is None:
+                drop = [key for key in self._entries if key[0] == "event"]
+            else:
+                events = set(events)
+                drop = [key for key in self._entries if key[0] == "event" and key[1] in events]
+            for key in drop:
+                del self._entries[key]
+            logger.debug(f"🔄 Cache invalidated: {user_id} {sorted(events) if events is not None else 'all events'}")
+
+    def on_db_change(self, user_id: str, section: str):
+        """Подписчик Database.add_change_listener"""
+        self.invalidate(user_id, SECTION_EVENTS.get(section))
+
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику кэша"""
         total_requests = self.hits + self.misses
         hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
-        
+
         return {
             'hits': self.hits,
             'misses': self.misses,
             'total_requests': total_requests,
-            'hit_rate': f"{hit_rate:.1f}%"
+            'hit_rate': f"{hit_rate:.1f}%",
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'stale_users': len(self._stale_users)
         }
 
 
@@ -1,123 +1,237 @@
 import sqlite3
 import json
 import logging
-from datetime import datetime
+import os
+import threading
+from datetime import date, datetime, timedelta, timezone
 from contextlib import contextmanager
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+from utils.metrics import metrics
+from utils.migrations import apply_migrations
 
 logger = logging.getLogger(__name__)
 
+# Настройки соединений
+CACHED_STATEMENTS = 256          # Кэш подготовленных запросов на соединение
+MMAP_SIZE = 64 * 1024 * 1024     # 64 МБ файла БД отображаются в память
+BUSY_TIMEOUT = 5.0               # Сколько ждать снятия блокировки (сек)
+CHANGE_FEED_KEEP = 300           # Сколько секунд хранить строки change_feed
+
+
+def to_iso_date(value: Optional[str]) -> Optional[str]:
+    """Дата 'ДД.ММ.ГГГГ' (как в данных бота) -> 'ГГГГ-ММ-ДД' для SQLite"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return value
+
+
 class Database:
     def __init__(self, db_file: str = "bot_data.db"):
         self.db_file = db_file
+        # Одно постоянное соединение на поток (sqlite3 не любит общие соединения)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        # Процесс - origin строк change_feed (свои изменения не повторяем)
+        self._pid = os.getpid()
+        # Писать изменения в change_feed для других процессов (BOT_WORKERS > 1)
+        self._change_feed = False
+        # Подписчики на изменения данных (кэш): callback(user_id, section)
+        self._change_listeners: List[Callable[[str, str], None]] = []
+        # sqlite3 trace callback-и для всех соединений (трейсы, метрики)
+        self._trace_callbacks: List[Callable[[str], None]] = []
+        self._trace_callback: Optional[Callable[[str], None]] = None
         self._init_db()
 
     def _init_db(self):
-        """Создание таблиц БД при первом запуске"""
-        with self.get_connection() as conn:
-            # Таблица пользователей
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                name TEXT,
-                phone TEXT,
-                username TEXT,
-                bot_version TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """)
-
-            # Таблица регистраций Группенран (с location)
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS gruppenrun_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                location TEXT DEFAULT 'shartas',
-                type TEXT NOT NULL,
-                valid_until DATE,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Таблица регистраций Иремель
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS iremel_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                is_registered BOOLEAN DEFAULT 0,
-                waiting_list BOOLEAN DEFAULT 0,
-                payment_type TEXT,
-                diet_restrictions TEXT,
-                preferences TEXT,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Таблица регистраций Кругосветка
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS krugosvetka_registrations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                stages_ids TEXT,
-                pace TEXT,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Таблица заказов завтраков
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS breakfast_orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                order_date DATE NOT NULL,
-                items TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id),
-                UNIQUE(user_id, order_date)
-            )
-            """)
-
-            # Таблица для отслеживания событий
-            conn.execute("""
-            CREATE TABLE IF NOT EXISTS event_tracking (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                event_name TEXT NOT NULL,
-                event_data TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-            """)
-
-            # Индексы
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_gruppenrun_user ON gruppenrun_registrations(user_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_gruppenrun_location ON gruppenrun_registrations(location)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_iremel_user ON iremel_registrations(user_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_breakfast_date ON breakfast_orders(order_date)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date ON event_tracking(created_at)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_events_name ON event_tracking(event_name)")
+        """Довести схему БД до последней версии (utils/migrations.py)"""
+        with self.get_connection() as conn:
+            applied = apply_migrations(conn)
+            if applied:
+                logger.info(f"✅ База данных инициализирована (миграций применено: {applied})")
 
-            logger.info("✅ База данных инициализирована")
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть и настроить новое соединение (WAL, mmap, кэш запросов)"""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=BUSY_TIMEOUT,
+            cached_statements=CACHED_STATEMENTS,
+            check_same_thread=False,
+            # Транзакция с записью сразу берёт блокировку писателя (с ожиданием
+            # BUSY_TIMEOUT). При DEFERRED запись из другого процесса между
+            # началом транзакции и первым INSERT даёт SQLITE_BUSY без ожидания
+            isolation_level="IMMEDIATE"
+        )
+        conn.row_factory = sqlite3.Row
+        # Для новой БД: место от удалённых строк можно вернуть ОС по частям
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL: читатели (веб-дашборд) не блокируют писателя (бот) и наоборот
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        with self._connections_lock:
+            conn.set_trace_callback(self._trace_callback)
+            self._connections.append(conn)
+        return conn
 
     @contextmanager
     def get_connection(self):
-        """Context manager для работы с БД"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        """
+        Context manager для работы с БД
+
+        Соединение открывается один раз на поток и переиспользуется.
+        Вложенные вызовы (метод внутри метода) работают в той же
+        транзакции: commit/rollback делает только внешний уровень.
+        """
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = self._connect()
+            local.depth = 0
+            local.pending = []
+
+        depth = local.depth
+        local.depth = depth + 1
         try:
             yield conn
-            conn.commit()
+            if depth == 0:
+                conn.commit()
         except Exception as e:
-            conn.rollback()
-            logger.error(f"❌ Ошибка БД: {e}")
+            if isinstance(e, sqlite3.OperationalError) and ("locked" in str(e) or "busy" in str(e)):
+                metrics.db_locked.labels().inc()
+            if depth == 0:
+                conn.rollback()
+                local.pending.clear()
+                logger.error(f"❌ Ошибка БД: {e}")
             raise
         finally:
-            conn.close()
+            local.depth = depth
+
+        # Подписчики узнают об изменениях только после commit
+        if depth == 0 and local.pending:
+            pending, local.pending = local.pending, []
+            for user_id, section in pending:
+                self._emit(user_id, section)
+
+    def close(self):
+        """Закрыть все открытые соединения (при остановке бота)"""
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+    def add_trace_callback(self, callback: Callable[[str], None]):
+        """callback(sql) на каждый запрос всех соединений"""
+        with self._connections_lock:
+            self._trace_callbacks.append(callback)
+            self._apply_trace_callbacks()
+
+    def remove_trace_callback(self, callback: Callable[[str], None]):
+        with self._connections_lock:
+            if callback in self._trace_callbacks:
+                self._trace_callbacks.remove(callback)
+            self._apply_trace_callbacks()
+
+    def _apply_trace_callbacks(self):
+        """Поставить trace callback на соединения (под _connections_lock)"""
+        callbacks = tuple(self._trace_callbacks)
+        if not callbacks:
+            trace = None
+        elif len(callbacks) == 1:
+            trace = callbacks[0]
+        else:
+            def trace(statement: str):
+                for callback in callbacks:
+                    callback(statement)
+        self._trace_callback = trace
+        for conn in self._connections:
+            conn.set_trace_callback(trace)
+
+    def add_change_listener(self, callback: Callable[[str, str], None]):
+        """
+        Подписаться на изменения: callback(user_id, section)
+
+        section: 'profile' (имя/телефон/username), 'version' (только
+        bot_version), 'gruppenrun', 'iremel' или 'breakfast' (заказ
+        завтрака снят вместе с регистрацией)
+        """
+        self._change_listeners.append(callback)
+
+    def _notify(self, user_id: str, section: str):
+        """
+        Сообщить об изменении (внутри транзакции - отложить до commit)
+
+        Вызывать внутри with get_connection() изменения: тогда строка
+        change_feed входит в ту же транзакцию и не теряется без него.
+        """
+        if self._change_feed:
+            # Для других процессов - в той же транзакции, что и изменение
+            with self.get_connection() as conn:
+                conn.execute(
+                    "INSERT INTO change_feed (origin, user_id, section) VALUES (?, ?, ?)",
+                    (self._pid, str(user_id), section)
+                )
+        local = self._local
+        if getattr(local, 'depth', 0) > 0:
+            local.pending.append((str(user_id), section))
+        else:
+            self._emit(str(user_id), section)
+
+    def _emit(self, user_id: str, section: str):
+        for callback in self._change_listeners:
+            try:
+                callback(user_id, section)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика изменений БД: {e}")
+
+    # ==================== ЛЕНТА ИЗМЕНЕНИЙ (НЕСКОЛЬКО ПРОЦЕССОВ) ====================
+    def enable_change_feed(self):
+        """Писать изменения в change_feed: их увидят подписчики в других процессах"""
+        self._change_feed = True
+
+    def get_change_feed_position(self) -> int:
+        """Номер последней записи ленты (читать после него)"""
+        with self.get_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_feed").fetchone()[0]
+
+    def follow_change_feed(self, after_id: int, limit: int = 1000) -> Tuple[int, bool]:
+        """
+        Передать подписчикам изменения других процессов после after_id
+
+        Возвращает (новая позиция, пропуск). Пропуск - нужные строки уже
+        удалены очисткой (процесс долго не читал ленту): подписчики
+        могли пропустить изменения, кэш надо сбросить целиком.
+        """
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                "SELECT id, origin, user_id, section FROM change_feed WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit)
+            ).fetchall()
+        if not rows:
+            return after_id, False
+        gap = rows[0]['id'] > after_id + 1
+        for row in rows:
+            if row['origin'] != self._pid:
+                self._emit(row['user_id'], row['section'])
+        return rows[-1]['id'], gap
+
+    def prune_change_feed(self, keep_seconds: int = CHANGE_FEED_KEEP) -> int:
+        """Удалить записи ленты старше keep_seconds"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM change_feed WHERE created_at < datetime('now', ?)",
+                (f"-{int(keep_seconds)} seconds",)
+            )
+            return cursor.rowcount
 
     # ==================== ПОЛЬЗОВАТЕЛИ ====================
     def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
@@ -129,7 +243,9 @@ class Database:
     def save_user(self, user_id: str, name: str = None, phone: str = None,
                   username: str = None, bot_version: str = None):
         with self.get_connection() as conn:
-            existing = self.get_user(user_id)
+            existing = conn.execute(
+                "SELECT 1 FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
             if existing:
                 updates = []
                 params = []
@@ -155,38 +271,210 @@ class Database:
                     (user_id, name, phone, username, bot_version)
                 )
             logger.info(f"💾 Пользователь {user_id} сохранён")
+            profile_changed = name is not None or phone is not None or username is not None
+            self._notify(user_id, 'profile' if profile_changed else 'version')
+
+    def get_user_ids_by_version(self, bot_version: str) -> set:
+        """Множество user_id пользователей, уже перешедших на bot_version"""
+        with self.get_connection() as conn:
+            return {
+                row['user_id'] for row in conn.execute(
+                    "SELECT user_id FROM users WHERE bot_version = ?", (bot_version,)
+                )
+            }
 
     def get_all_users(self) -> List[Dict[str, Any]]:
         with self.get_connection() as conn:
             cursor = conn.execute("SELECT * FROM users")
             return [dict(row) for row in cursor.fetchall()]
 
+    # ==================== СНИМОК ДАННЫХ ====================
+    def get_all_data(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Снимок всех пользователей в формате all_data (как у load_data())
+
+        Три set-based запроса на одном соединении вместо 1 + 2N отдельных:
+        пользователи, актуальная регистрация Шарташа (active_registrations)
+        и записи Иремеля. Результаты склеиваются по user_id в памяти.
+        """
+        return self._build_all_data()
+
+    def get_user_data(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Данные одного пользователя в формате all_data[user_id] (или None)"""
+        return self._build_all_data(str(user_id)).get(str(user_id))
+
+    def _build_all_data(self, user_id: str = None) -> Dict[str, Dict[str, Any]]:
+        today = datetime.now().date().isoformat()
+        all_data = {}
+        # Для одного пользователя те же запросы, но с фильтром по user_id
+        user_filter = "AND user_id = ?" if user_id is not None else ""
+        params = (user_id,) if user_id is not None else ()
+
+        with self.get_connection() as conn:
+            for row in conn.execute(
+                f"SELECT user_id, name, phone, username, bot_version FROM users WHERE 1 = 1 {user_filter}",
+                params
+            ):
+                all_data[row['user_id']] = {
+                    "name": row['name'],
+                    "phone": row['phone'],
+                    "username": row['username'],
+                    "bot_version": row['bot_version']
+                }
+
+            # Актуальная регистрация каждого пользователя на Шарташ
+            # (прошедшие тренировки и истёкшие абонементы не попадают)
+            for row in conn.execute(f"""
+                SELECT user_id, type, valid_until, event_date
+                FROM active_registrations
+                WHERE location = 'shartas' AND event_date >= ? {user_filter}
+            """, (today, *params)):
+                user_data = all_data.get(row['user_id'])
+                if user_data is None:
+                    continue
+                registration_for_date = None
+                if row['type'] != 'monthly':
+                    registration_for_date = date.fromisoformat(row['event_date']).strftime("%d.%m.%Y")
+                user_data["gruppenrun"] = {
+                    "type": row['type'],
+                    "valid_until": row['valid_until'],
+                    "registration_for_date": registration_for_date
+                }
+
+            # Первая запись Иремеля каждого пользователя
+            for row in conn.execute(f"""
+                SELECT user_id, is_registered, waiting_list, payment_type,
+                       diet_restrictions, preferences
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id) AS rn
+                    FROM iremel_registrations
+                    WHERE 1 = 1 {user_filter}
+                )
+                WHERE rn = 1
+            """, params):
+                user_data = all_data.get(row['user_id'])
+                if user_data is None:
+                    continue
+                user_data["iremel"] = {
+                    "is_registered": row['is_registered'],
+                    "waiting_list": row['waiting_list'],
+                    "payment_type": row['payment_type'],
+                    "diet_restrictions": row['diet_restrictions'],
+                    "preferences": row['preferences']
+                }
+
+        return all_data
+
     # ==================== ГРУППЕНРАН ====================
     def save_gruppenrun_registration(self, user_id: str, reg_type: str,
-                                     valid_until: str = None, location: str = 'shartas'):
+                                     valid_until: str = None, location: str = 'shartas',
+                                     registration_for_date: str = None):
         """Сохранить регистрацию на Группенран"""
         with self.get_connection() as conn:
             conn.execute(
-                "INSERT INTO gruppenrun_registrations (user_id, location, type, valid_until) VALUES (?, ?, ?, ?)",
-                (user_id, location, reg_type, valid_until)
+                "INSERT INTO gruppenrun_registrations (user_id, location, type, valid_until, registration_for_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, location, reg_type, valid_until, to_iso_date(registration_for_date))
             )
+            self._notify(user_id, 'gruppenrun')
 
     def check_gruppenrun_registration(self, user_id: str, location: str = 'shartas') -> Dict[str, Any]:
-        """Проверить регистрацию на Группенран"""
+        """Проверить регистрацию на Группенран (поиск по ключу active_registrations)"""
+        today = datetime.now().date().isoformat()
         with self.get_connection() as conn:
-            cursor = conn.execute(
-                "SELECT * FROM gruppenrun_registrations WHERE user_id = ? AND location = ? ORDER BY registered_at DESC LIMIT 1",
-                (user_id, location)
-            )
-            row = cursor.fetchone()
+            row = conn.execute(
+                "SELECT type, valid_until FROM active_registrations "
+                "WHERE location = ? AND user_id = ? AND event_date >= ?",
+                (location, str(user_id), today)
+            ).fetchone()
             if not row:
                 return {"is_active": False}
-            reg = dict(row)
-            if reg['type'] == 'monthly' and reg['valid_until']:
-                valid_until = datetime.strptime(reg['valid_until'], '%Y-%m-%d').date()
-                if valid_until < datetime.now().date():
-                    return {"is_active": False}
-            return {"is_active": True, "type": reg['type'], "valid_until": reg['valid_until']}
+            return {"is_active": True, "type": row['type'], "valid_until": row['valid_until']}
+
+    def get_active_registrations(self, location: str, event_date: str) -> List[Dict[str, Any]]:
+        """
+        Все, кто зарегистрирован на тренировку event_date (YYYY-MM-DD)
+
+        Разовые - на эту дату, месячные - действующие в этот день
+        (их event_date - valid_until). Один проход по индексу
+        (location, event_date) + профили по ключу.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT a.user_id, a.type, a.valid_until, a.event_date,
+                       u.name, u.phone, u.username
+                FROM active_registrations a
+                LEFT JOIN users u ON u.user_id = a.user_id
+                WHERE a.location = ? AND a.event_date >= ?
+                  AND (a.event_date = ? OR a.type = 'monthly')
+                ORDER BY a.registered_at
+            """, (location, event_date, event_date))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_active_event_dates(self) -> List[tuple]:
+        """Тренировки, на которые есть актуальные регистрации: [(location, event_date)]"""
+        with self.get_connection() as conn:
+            cursor = conn.execute("SELECT DISTINCT location, event_date FROM active_registrations")
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def get_user_event_dates(self, user_id: str) -> List[tuple]:
+        """Тренировки, на которые зарегистрирован пользователь: [(location, event_date)]"""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "SELECT location, event_date FROM active_registrations "
+                "WHERE location IN ('shartas', 'uktus') AND user_id = ?",
+                (user_id,)
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def _clear_breakfast_orders(self, conn, user_ids: List[str]):
+        """
+        Снять заказы завтрака вместе с регистрацией (в её транзакции)
+
+        Заказ делается к тренировке и без регистрации не нужен. Живой
+        заказ хранится в снимке all_data - его убирает подписчик на
+        раздел 'breakfast'.
+        """
+        conn.executemany(
+            "DELETE FROM breakfast_orders WHERE user_id = ?",
+            [(user_id,) for user_id in user_ids]
+        )
+        for user_id in user_ids:
+            self._notify(user_id, 'breakfast')
+
+    def expire_event(self, location: str, event_date: str) -> List[str]:
+        """
+        Убрать из active_registrations регистрации на прошедшую тренировку
+        (и все более ранние на этой локации) вместе с заказами завтрака.
+        Возвращает user_id затронутых.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM active_registrations WHERE location = ? AND event_date <= ? RETURNING user_id",
+                (location, event_date)
+            )
+            user_ids = [row[0] for row in cursor.fetchall()]
+            for user_id in user_ids:
+                self._notify(user_id, 'gruppenrun')
+            self._clear_breakfast_orders(conn, user_ids)
+        return user_ids
+
+    def unregister_gruppenrun(self, user_id: str, location: str = 'shartas') -> int:
+        """
+        Снять актуальную регистрацию на Группенран
+
+        Как и expire_event, удаляет строку active_registrations и заказ
+        завтрака: история в gruppenrun_registrations остаётся для статистики.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "DELETE FROM active_registrations WHERE location = ? AND user_id = ?",
+                (location, str(user_id))
+            )
+            self._notify(user_id, 'gruppenrun')
+            if cursor.rowcount:
+                self._clear_breakfast_orders(conn, [str(user_id)])
+        return cursor.rowcount
 
     # ==================== ИРЕМЕЛЬ ====================
     def save_iremel_registration(self, user_id: str, is_registered: bool = False,
@@ -199,6 +487,7 @@ class Database:
                 (user_id, is_registered, waiting_list, payment_type, diet_restrictions, preferences)
             )
             logger.info(f"✅ Иремель: {user_id} зарегистрирован")
+            self._notify(user_id, 'iremel')
 
     def get_iremel_registration(self, user_id: str) -> Optional[Dict[str, Any]]:
         with self.get_connection() as conn:
@@ -206,6 +495,21 @@ class Database:
             row = cursor.fetchone()
             return dict(row) if row else None
 
+    def get_iremel_participants(self) -> Dict[str, List[str]]:
+        """Имена участников Иремеля: {"registered": [...], "waiting": [...]}"""
+        participants = {"registered": [], "waiting": []}
+        with self.get_connection() as conn:
+            # Порядок - как у пользователей в снимке all_data
+            for row in conn.execute("""
+                SELECT u.name, i.is_registered
+                FROM iremel_registrations i
+                JOIN users u ON u.user_id = i.user_id
+                WHERE i.is_registered = 1 OR i.waiting_list = 1
+                ORDER BY u.rowid
+            """):
+                participants["registered" if row['is_registered'] else "waiting"].append(row['name'])
+        return participants
+
     def count_iremel_registrations(self) -> int:
         with self.get_connection() as conn:
             cursor = conn.execute("SELECT COUNT(*) FROM iremel_registrations WHERE is_registered = 1")
@@ -213,11 +517,193 @@ class Database:
 
     # ==================== АНАЛИТИКА ====================
     def track_event(self, user_id: str, event_name: str, event_data: dict = None):
+        self.track_events_batch([(
+            str(user_id), event_name, json.dumps(event_data) if event_data else None,
+            datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        )])
+
+    def track_events_batch(self, events: List[tuple]):
+        """
+        Пакетная запись событий одной транзакцией
+
+        events: [(user_id, event_name, event_data_json, created_at)]
+        Имена событий хранятся в справочнике event_names, в строке - id.
+        """
         with self.get_connection() as conn:
-            conn.execute(
-                "INSERT INTO event_tracking (user_id, event_name, event_data) VALUES (?, ?, ?)",
-                (str(user_id), event_name, json.dumps(event_data) if event_data else None)
+            conn.executemany(
+                "INSERT OR IGNORE INTO event_names (name) VALUES (?)",
+                [(name,) for name in {event[1] for event in events}]
             )
+            conn.executemany("""
+                INSERT INTO event_tracking (user_id, event_id, event_data, created_at)
+                VALUES (?, (SELECT id FROM event_names WHERE name = ?), ?, ?)
+            """, events)
+
+    def purge_events(self, before: str, limit: int = 5000) -> int:
+        """
+        Удалить сырые события старше before (UTC, 'ГГГГ-ММ-ДД ЧЧ:ММ:СС'),
+        не больше limit за вызов - блокировка записи держится недолго.
+        Счётчики в event_daily_stats остаются.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                DELETE FROM event_tracking WHERE id IN (
+                    SELECT id FROM event_tracking WHERE created_at < ? LIMIT ?
+                )
+            """, (before, limit))
+            return cursor.rowcount
+
+    def purge_daily_users(self, before_day: str) -> int:
+        """Удалить списки уникальных пользователей за дни до before_day (счётчики уже посчитаны)"""
+        with self.get_connection() as conn:
+            cursor = conn.execute("DELETE FROM event_daily_users WHERE day < ?", (before_day,))
+            return cursor.rowcount
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """
+        Вернуть ОС до pages свободных страниц файла БД, сколько освобождено
+
+        Старая БД (создана без auto_vacuum) так место не возвращает:
+        её один раз переводят в INCREMENTAL offline - см.
+        enable_incremental_vacuum.
+        """
+        with self.get_connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("🧹 auto_vacuum не INCREMENTAL: запусти при остановленном боте "
+                            "python3 migrate_to_sqlite.py --vacuum")
+                return 0
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # Прагма освобождает страницу за шаг, а sqlite3 для запроса без
+            # колонок делает один шаг (fetchall не продолжает) - по странице
+            for _ in range(min(int(pages), before)):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Перевести БД в auto_vacuum=INCREMENTAL полным VACUUM (один раз)
+
+        Offline-шаг при остановленном боте: VACUUM переписывает весь файл
+        и держит блокировку писателя. Выполняется на отдельном соединении,
+        мимо соединений потоков. True - режим включён сейчас.
+        """
+        conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            logger.info("🧹 Включаю auto_vacuum=INCREMENTAL (полный VACUUM)")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+        finally:
+            conn.close()
+
+    def get_daily_stats(self, day: str = None) -> Dict[str, int]:
+        """
+        Сводка за день (по умолчанию сегодня) для ежедневного отчёта
+
+        События берутся из свёртки event_daily_stats (строки одного дня),
+        новые пользователи - диапазоном по индексу users(created_at).
+        """
+        day = day or date.today().isoformat()
+        # created_at пишется в UTC (CURRENT_TIMESTAMP), день - местный
+        start = datetime.combine(date.fromisoformat(day), datetime.min.time()).astimezone(timezone.utc)
+        end = start + timedelta(days=1)
+        with self.get_connection() as conn:
+            events = {
+                row['event_name']: row['events']
+                for row in conn.execute(
+                    "SELECT event_name, events FROM event_daily_stats WHERE day = ?", (day,)
+                )
+            }
+            new_users = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE created_at >= ? AND created_at < ?",
+                (start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'))
+            ).fetchone()[0]
+            total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        return {
+            "new_users": new_users,
+            "total_users": total_users,
+            "gruppenrun_regs": events.get("registration:gruppenrun", 0)
+                               + events.get("registration:gruppenrun_uktus", 0),
+            "iremel_regs": events.get("registration:iremel", 0),
+            "events": sum(events.values()),
+        }
+
+    def get_popular_events(self, limit: int = 5, days: int = 1) -> Dict[str, int]:
+        """Самые частые события за последние days дней: {event_name: count}"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                SELECT event_name, SUM(events) AS total
+                FROM event_daily_stats
+                WHERE day >= ?
+                GROUP BY event_name
+                ORDER BY total DESC
+                LIMIT ?
+            """, (since, limit))
+            return {row['event_name']: row['total'] for row in cursor}
+
+    # ==================== СОСТОЯНИЯ FSM ====================
+    def get_fsm_record(self, bot_id: int, chat_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+        """Состояние и данные FSM по ключу (поиск по первичному ключу)"""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT state, data FROM fsm_storage WHERE bot_id = ? AND chat_id = ? AND user_id = ?",
+                (bot_id, chat_id, user_id)
+            ).fetchone()
+            if row is None:
+                return None
+            return {
+                "state": row['state'],
+                "data": json.loads(row['data']) if row['data'] else {}
+            }
+
+    def save_fsm_records(self, records: List[tuple]):
+        """
+        Пакетная запись состояний FSM одной транзакцией
+
+        records: [(bot_id, chat_id, user_id, state, data_json)]
+        Пустые записи (нет состояния и данных) удаляются.
+        """
+        upserts = [r for r in records if r[3] is not None or r[4] is not None]
+        deletes = [r[:3] for r in records if r[3] is None and r[4] is None]
+        with self.get_connection() as conn:
+            if upserts:
+                conn.executemany("""
+                    INSERT INTO fsm_storage (bot_id, chat_id, user_id, state, data)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(bot_id, chat_id, user_id) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = CURRENT_TIMESTAMP
+                """, upserts)
+            if deletes:
+                conn.executemany(
+                    "DELETE FROM fsm_storage WHERE bot_id = ? AND chat_id = ? AND user_id = ?",
+                    deletes
+                )
+
+    # ==================== ПЛАНИРОВЩИК ====================
+    def get_last_run(self, job: str) -> Optional[str]:
+        """Слот последнего запуска задачи планировщика (или None)"""
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT last_run FROM scheduler_runs WHERE job = ?", (job,)).fetchone()
+            return row['last_run'] if row else None
+
+    def claim_run(self, job: str, slot: str) -> bool:
+        """
+        Занять слот запуска задачи: True, если он ещё не выполнялся
+        (ни этим, ни другим процессом бота с той же БД)
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO scheduler_runs (job, last_run) VALUES (?, ?)
+                ON CONFLICT(job) DO UPDATE SET last_run = excluded.last_run
+                WHERE scheduler_runs.last_run < excluded.last_run
+            """, (job, slot))
+            return cursor.rowcount == 1
+
 
 # Глобальный экземпляр БД
 db = Database()
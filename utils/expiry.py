@@ -0,0 +1,174 @@
+# Файл: utils/expiry.py
+# -*- coding: utf-8 -*-
+
+"""
+Истечение регистраций Группенран (Шарташ и Трейл) по расписанию
+
+Вместо обхода всех пользователей при старте бота - min-heap моментов
+истечения, по одному элементу на (локация, дата тренировки). Когда
+тренировка прошла, её регистрации убираются из active_registrations
+одним DELETE по индексу (location, event_date): работа пропорциональна
+числу истекающих строк, а не числу пользователей, и не зависит от того,
+когда бот перезапускали.
+
+Новые даты попадают в кучу сами: планировщик подписан на изменения БД
+и на регистрацию пользователя смотрит его актуальные записи (поиск по
+первичному ключу).
+"""
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from utils.async_database import adb
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+# Дольше не спим: часы могли перевести (NTP, смена часового пояса)
+MAX_SLEEP = 3600.0
+# Через сколько повторить истечение, если запрос упал
+RETRY_DELAY = 60.0
+
+
+def expires_at(event_date: str) -> Optional[float]:
+    """
+    Момент истечения регистраций на тренировку: начало следующего дня
+    по местному времени (как и «event_date >= сегодня» в запросах).
+    None - не истекает (бессрочная запись '9999-12-31').
+    """
+    try:
+        day = date.fromisoformat(event_date) + timedelta(days=1)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+class ExpiryScheduler:
+    """
+    Планировщик истечения регистраций
+
+        expiry_scheduler.start()       # в on_startup, внутри event loop
+        await expiry_scheduler.stop()  # при остановке бота
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str, str]] = []  # (момент, location, event_date)
+        self._scheduled: Set[Tuple[str, str]] = set()
+        # Куча пополняется и из потока БД (подписка на изменения)
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def schedule(self, location: str, event_date: str, when: float = None) -> bool:
+        """Запланировать истечение тренировки (повторно одну и ту же - нет)"""
+        key = (location, event_date)
+        when = when if when is not None else expires_at(event_date)
+        if when is None:
+            return False
+        with self._lock:
+            if key in self._scheduled:
+                return False
+            self._scheduled.add(key)
+            heapq.heappush(self._heap, (when, location, event_date))
+            is_next = self._heap[0][1:] == key
+        # Новый ближайший срок - будим цикл, чтобы он пересчитал сон
+        if is_next:
+            self._wake()
+        return True
+
+    def on_db_change(self, user_id: str, section: str):
+        """Подписчик Database: регистрация на новую дату попадает в кучу"""
+        if section != 'gruppenrun' or self._loop is None:
+            return
+        for location, event_date in db.get_user_event_dates(user_id):
+            self.schedule(location, event_date)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        """Запустить планировщик (вызывать внутри event loop)"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("⏰ Планировщик истечения регистраций запущен")
+
+    async def stop(self):
+        """Остановить планировщик"""
+        task, self._task = self._task, None
+        self._loop = None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    def _wake(self):
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # Loop уже закрыт - бот останавливается
+                pass
+
+    def _pop_due(self, now: float) -> List[Tuple[str, str]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, location, event_date = heapq.heappop(self._heap)
+                self._scheduled.discard((location, event_date))
+                due.append((location, event_date))
+        return due
+
+    def _next_delay(self, now: float) -> float:
+        with self._lock:
+            if not self._heap:
+                return MAX_SLEEP
+            return min(max(self._heap[0][0] - now, 0.0), MAX_SLEEP)
+
+    async def resync(self):
+        """Запланировать все тренировки, на которые есть регистрации в БД"""
+        for location, event_date in await adb.get_active_event_dates():
+            self.schedule(location, event_date)
+
+    async def _run(self):
+        # Тренировки с регистрациями на момент старта; прошедшие
+        # (бот был выключен) истекут на первом же шаге
+        await self.resync()
+
+        while True:
+            self._wakeup.clear()
+            for location, event_date in self._pop_due(time.time()):
+                await self._expire(location, event_date)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._next_delay(time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, location: str, event_date: str):
+        try:
+            user_ids = await adb.expire_event(location, event_date)
+        except Exception as e:
+            logger.error(f"❌ Ошибка истечения регистраций {location} {event_date}: {e}")
+            self.schedule(location, event_date, when=time.time() + RETRY_DELAY)
+            return
+        if user_ids:
+            logger.info(f"🗑️ Истекли регистрации {location} на {event_date}: {len(user_ids)}")
+
+
+# Глобальный экземпляр
+expiry_scheduler = ExpiryScheduler()
+db.add_change_listener(expiry_scheduler.on_db_change)
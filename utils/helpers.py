@@ -5,109 +5,277 @@ import os
 from datetime import datetime, timedelta, date
 from config import DB_FILE, FIRST_GRUPPENRUN_DATE, REFERENCE_GR_DATE, REFERENCE_GR_NUMBER, BREAKFAST_MENU
 from utils.database import db
+from utils.cache import data_cache
 
 logger = logging.getLogger(__name__)
 
 # --- Функции для работы с JSON-файлом (база данных) ---
 
+PROFILE_FIELDS = ("name", "phone", "username", "bot_version")
+# Разделы all_data, которые хранятся в SQLite (остальные живут только в памяти)
+DB_FIELDS = PROFILE_FIELDS + ("gruppenrun", "iremel")
+
+def _clone(value):
+    """Глубокая копия словарей/списков из all_data (быстрее copy.deepcopy)"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+class TrackedData(dict):
+    """
+    all_data с отслеживанием изменений
+
+    Хранит копию каждого пользователя на момент загрузки. save_data()
+    сравнивает текущие данные с копией и пишет в БД только изменившихся
+    пользователей и только изменившиеся разделы (профиль, gruppenrun, iremel).
+    """
+
+    def __init__(self, data=None):
+        super().__init__(data or {})
+        self._baseline = {user_id: _clone(user_data) for user_id, user_data in self.items()}
+
+    def collect_changes(self):
+        """
+        Возвращает {user_id: (копия данных, множество изменённых ключей)}
+        Копия нужна, чтобы запись в потоке БД не видела чужих правок.
+        """
+        changes = {}
+        for user_id, user_data in self.items():
+            old = self._baseline.get(user_id)
+            if old == user_data or not isinstance(user_data, dict):
+                continue
+            old = old or {}
+            changed_keys = {
+                key for key in set(old) | set(user_data)
+                if old.get(key) != user_data.get(key)
+            }
+            changes[user_id] = (_clone(user_data), changed_keys)
+        return changes
+
+    def mark_saved(self, changes):
+        """Запомнить сохранённое состояние как новую точку отсчёта"""
+        for user_id, (user_data, _) in changes.items():
+            self._baseline[user_id] = user_data
+
+    def replace_user(self, user_id, db_data):
+        """
+        Подменить пользователя свежими данными из БД
+
+        Разделы, которых нет в SQLite (krugosvetka, breakfast_order),
+        остаются из памяти. Точка отсчёта тоже обновляется: свежие данные
+        из БД не считаются изменением.
+        """
+        current = self.get(user_id)
+        if db_data is None and current is None:
+            return
+        user_data = dict(db_data or {})
+        if isinstance(current, dict):
+            for key, value in current.items():
+                if key not in DB_FIELDS:
+                    user_data[key] = value
+        self[user_id] = user_data
+        self._baseline[user_id] = _clone(user_data)
+
+    def drop_key(self, user_id, key):
+        """Убрать раздел пользователя, уже снятый в БД (без записи при save_data)"""
+        for data in (self.get(user_id), self._baseline.get(user_id)):
+            if isinstance(data, dict):
+                data.pop(key, None)
+
+def _on_breakfast_cleared(user_id, section):
+    """Подписчик Database: заказ завтрака снят вместе с регистрацией"""
+    if section != "breakfast":
+        return
+    all_data = data_cache.peek_data()
+    if isinstance(all_data, TrackedData):
+        all_data.drop_key(user_id, "breakfast_order")
+
+# Кэш узнаёт о каждом изменении в БД и сбрасывает только затронутое
+db.add_change_listener(data_cache.on_db_change)
+# Заказы завтраков живут только в снимке - убираем их оттуда
+db.add_change_listener(_on_breakfast_cleared)
+
 def load_data():
     """
     Загружает данные в формате совместимом с остальным кодом
     (Теперь берёт из SQLite вместо JSON через кэширование)
     """
-    from utils.cache import data_cache
-    return data_cache.get_data(_load_data_from_sqlite)
+    return data_cache.get_data(_load_data_from_sqlite, _refresh_users)
+
+def _read_users(user_ids):
+    """Свежие данные пользователей из SQLite: {user_id: данные или None}"""
+    return {user_id: db.get_user_data(user_id) for user_id in user_ids}
+
+def _refresh_users(all_data, user_ids):
+    """Перечитать из SQLite пользователей, изменённых мимо снимка"""
+    for user_id, db_data in _read_users(user_ids).items():
+        all_data.replace_user(user_id, db_data)
+    logging.debug(f"🔄 load_data: обновлены {len(user_ids)} пользователей из SQLite")
+
+def load_user(user_id):
+    """
+    Данные одного пользователя в формате all_data[user_id] (или None)
+
+    Только для чтения: берёт пользователя из кэшированного снимка, а если
+    снимка нет или пользователь в нём устарел - отдельным запросом к БД
+    (результат тоже кэшируется). Для изменений используй load_data().
+    """
+    user_id = str(user_id)
+    all_data = data_cache.peek_data()
+    if all_data is not None and data_cache.is_user_fresh(user_id):
+        return all_data.get(user_id)
+    return data_cache.get_user(user_id, lambda: db.get_user_data(user_id))
+
+def get_iremel_participants():
+    """
+    Участники Иремеля: {"registered": [имена], "waiting": [имена]}
+
+    Агрегат кэшируется и сбрасывается только при изменении записей
+    Иремеля или профилей. Считается запросом к БД, а не обходом снимка:
+    снимок в это время могут править обработчики в event loop.
+    """
+    return data_cache.get_event("iremel", "participants", db.get_iremel_participants)
 
 def _load_data_from_sqlite():
     """Вспомогательная функция для чтения из SQLite"""
     from utils.database import db
-    
-    all_data = {}
-    
-    # Загружаем всех пользователей
-    users = db.get_all_users()
-    
-    for user in users:
-        user_id = user['user_id']
-        
-        # Инициализируем пользователя в результате
-        all_data[user_id] = {
-            "name": user.get("name"),
-            "phone": user.get("phone"),
-            "username": user.get("username"),
-            "bot_version": user.get("bot_version")
-        }
-        
-        # Добавляем Групpenran регистрацию
-        gr_reg = db.check_gruppenrun_registration(user_id)
-        if gr_reg.get("is_active"):
-            all_data[user_id]["gruppenrun"] = {
-                "type": gr_reg.get("type"),
-                "valid_until": gr_reg.get("valid_until")
-            }
-        
-        # Добавляем Иремель регистрацию
-        ir_reg = db.get_iremel_registration(user_id)
-        if ir_reg:
-            all_data[user_id]["iremel"] = {
-                "is_registered": ir_reg.get("is_registered"),
-                "waiting_list": ir_reg.get("waiting_list"),
-                "payment_type": ir_reg.get("payment_type"),
-                "diet_restrictions": ir_reg.get("diet_restrictions"),
-                "preferences": ir_reg.get("preferences")
-            }
-    
+
+    # Весь снимок одним запросом (без N+1 обращений к БД)
+    all_data = TrackedData(db.get_all_data())
+
     logging.debug(f"✅ load_data: загружены {len(all_data)} пользователей из SQLite")
     return all_data
 
+def _collect_changes(data: dict):
+    """Изменения для записи: дельта для TrackedData, всё подряд для обычного dict"""
+    if isinstance(data, TrackedData):
+        return data.collect_changes()
+    # None = «изменено всё» (старое поведение для словарей без истории)
+    return {user_id: (user_data, None) for user_id, user_data in data.items()}
+
+def _write_changes(changes: dict):
+    """
+    Записать изменения в SQLite одной транзакцией
+
+    Ошибка откатывает всю пачку: точка отсчёта не сдвигается, и эти
+    пользователи запишутся при следующем save_data().
+    """
+    from utils.database import db
+
+    with db.get_connection():
+        for user_id, (user_data, changed_keys) in changes.items():
+            try:
+                # Профиль: только изменившиеся поля
+                profile = {
+                    field: user_data.get(field)
+                    for field in PROFILE_FIELDS
+                    if changed_keys is None or field in changed_keys
+                }
+                if profile:
+                    db.save_user(user_id=user_id, **profile)
+
+                # Групpenran: новая запись только если регистрация изменилась
+                if changed_keys is None or "gruppenrun" in changed_keys:
+                    gr_data = user_data.get("gruppenrun")
+                    location = (gr_data or {}).get("location", "shartas")
+                    if gr_data and gr_data.get("is_registered", True):
+                        db.save_gruppenrun_registration(
+                            user_id=user_id,
+                            reg_type=gr_data.get("type", "onetime"),
+                            valid_until=gr_data.get("valid_until"),
+                            location=location,
+                            registration_for_date=gr_data.get("registration_for_date")
+                        )
+                    elif changed_keys is not None:
+                        # Регистрацию сняли (is_registered=False или раздел удалён):
+                        # снимаем только актуальную, история остаётся
+                        db.unregister_gruppenrun(user_id, location)
+
+                # Иремель
+                if (changed_keys is None or "iremel" in changed_keys) and "iremel" in user_data:
+                    ir_data = user_data["iremel"]
+                    db.save_iremel_registration(
+                        user_id=user_id,
+                        is_registered=ir_data.get("is_registered", False),
+                        waiting_list=ir_data.get("waiting_list", False),
+                        payment_type=ir_data.get("payment_type"),
+                        diet_restrictions=ir_data.get("diet_restrictions"),
+                        preferences=ir_data.get("preferences")
+                    )
+            except Exception as e:
+                logging.error(f"❌ Ошибка при сохранении пользователя {user_id}: {e}")
+                raise
+
+def _after_save(data: dict, changes: dict):
+    if isinstance(data, TrackedData):
+        data.mark_saved(changes)
+
+    logging.debug(f"💾 save_data: сохранены {len(changes)} пользователей в SQLite")
+
+    # Кэш уже инвалидирован точечно (подписка на изменения БД). Если
+    # сохраняли сам кэшированный снимок, в нём и так актуальные данные.
+    if data is data_cache.peek_data():
+        data_cache.mark_fresh(changes)
+
 def save_data(data: dict):
     """
     Сохраняет данные в SQLite (ОБНОВЛЕНО)
     
     Ожидает словарь того же формата как раньше, но теперь сохраняет в БД
+    только пользователей, изменившихся с момента load_data()
     """
-    from utils.database import db
-    
-    for user_id, user_data in data.items():
+    changes = _collect_changes(data)
+    if changes:
+        _write_changes(changes)
+    _after_save(data, changes)
+
+async def load_data_async():
+    """
+    load_data() без блокировки event loop
+
+    Снимок меняется только здесь, в event loop (там же его правят
+    обработчики): поток БД загружает новый снимок, пока его никто
+    не видит, или читает свежие данные устаревших пользователей.
+    """
+    from utils.async_database import adb
+    all_data, stale = data_cache.take_stale_users()
+    if all_data is None:
+        # Без refresh_func: снимок, появившийся тем временем, не правится в потоке БД
+        return await adb.run(data_cache.get_data, _load_data_from_sqlite)
+    if stale:
         try:
-            # Сохраняем пользователя
-            db.save_user(
-                user_id=user_id,
-                name=user_data.get("name"),
-                phone=user_data.get("phone"),
-                username=user_data.get("username"),
-                bot_version=user_data.get("bot_version")
-            )
-            
-            # Сохраняем Групpenran
-            if "gruppenrun" in user_data:
-                gr_data = user_data["gruppenrun"]
-                db.save_gruppenrun_registration(
-                    user_id=user_id,
-                    reg_type=gr_data.get("type", "onetime"),
-                    valid_until=gr_data.get("valid_until")
-                )
-            
-            # Сохраняем Иремель
-            if "iremel" in user_data:
-                ir_data = user_data["iremel"]
-                db.save_iremel_registration(
-                    user_id=user_id,
-                    is_registered=ir_data.get("is_registered", False),
-                    waiting_list=ir_data.get("waiting_list", False),
-                    payment_type=ir_data.get("payment_type"),
-                    diet_restrictions=ir_data.get("diet_restrictions"),
-                    preferences=ir_data.get("preferences")
-                )
-        except Exception as e:
-            logging.error(f"❌ Ошибка при сохранении пользователя {user_id}: {e}")
-    
-    logging.debug(f"💾 save_data: сохранены {len(data)} пользователей в SQLite")
-    
-    # ✅ ИНВАЛИДИРУЕМ КЭШ ПОСЛЕ СОХРАНЕНИЯ
-    from utils.cache import data_cache
-    data_cache.invalidate()
-    logging.debug("📝 Кэш инвалидирован после сохранения")
+            fresh = await adb.run(_read_users, stale)
+        except Exception:
+            # Пусть их перечитает следующий вызов
+            for user_id in stale:
+                data_cache.invalidate(user_id, events=())
+            raise
+        for user_id, db_data in fresh.items():
+            all_data.replace_user(user_id, db_data)
+        logging.debug(f"🔄 load_data: обновлены {len(stale)} пользователей из SQLite")
+    return all_data
+
+async def load_user_async(user_id):
+    """load_user() в потоке БД"""
+    from utils.async_database import adb
+    return await adb.run(load_user, user_id)
+
+async def get_iremel_participants_async():
+    """get_iremel_participants() в потоке БД"""
+    from utils.async_database import adb
+    return await adb.run(get_iremel_participants)
+
+async def save_data_async(data: dict):
+    """save_data() в потоке БД — не блокирует event loop"""
+    from utils.async_database import adb
+    # Дельта собирается здесь, в event loop: поток БД получает копии
+    # изменённых пользователей и не видит параллельных правок словаря
+    changes = _collect_changes(data)
+    if changes:
+        await adb.run(_write_changes, changes)
+    _after_save(data, changes)
 
 # --- Функции для работы с датами и расчётами Группенрана ---
 
@@ -220,7 +388,13 @@ def save_user_profile(user_id, name, phone, username, all_data):
     return all_data[user_id_str]
 
 def check_gruppenrun_registration(user_id, all_data):
-    """Проверяет регистрацию пользователя на Группенран"""
+    """
+    Проверяет регистрацию пользователя на Группенран
+
+    Только читает all_data: истёкшие регистрации вместе с заказом
+    завтрака снимает ExpiryScheduler (utils/expiry.py), поэтому
+    функцию можно звать прямо из обработчиков.
+    """
     user_data = all_data.get(user_id, {})
     gruppenrun_data = user_data.get("gruppenrun", {})
     
@@ -252,13 +426,6 @@ def check_gruppenrun_registration(user_id, all_data):
                 "type": "onetime",
                 "details": f"Разовая регистрация на {reg_date}"
             }
-        else:
-            # АВТООЧИСТКА: Если дата регистрации прошла - очищаем регистрацию И завтрак
-            if "gruppenrun" in all_data[user_id]:
-                all_data[user_id]["gruppenrun"]["is_registered"] = False
-            if "breakfast_order" in all_data[user_id]:
-                del all_data[user_id]["breakfast_order"]
-            save_data(all_data)
     
     return {"is_active": False, "type": None}
 
@@ -364,68 +531,6 @@ def can_user_order_breakfast(user_id, all_data):
 
 # === ФУНКЦИЯ ДЛЯ ОЧИСТКИ ИСТЁКШИХ РЕГИСТРАЦИЙ ===
 
-def cleanup_expired_onetime_registrations(all_data):
-    """
-    Очищает истёкшие разовые регистрации и заказы завтраков
-    Вызывается при каждой проверке регистрации
-    """
-    data_changed = False
-    current_date = date.today()
-    
-    for user_id, user_info in all_data.items():
-        gruppenrun_data = user_info.get("gruppenrun", {})
-        
-        if gruppenrun_data.get("is_registered", False):
-            reg_type = gruppenrun_data.get("type", "onetime")
-            
-            # Обработка разовых регистраций
-            if reg_type == "onetime":
-                reg_date_str = gruppenrun_data.get("registration_for_date")
-                if reg_date_str:
-                    try:
-                        reg_date = datetime.strptime(reg_date_str, "%d.%m.%Y").date()
-                        
-                        # Если дата Группенрана прошла (сегодня понедельник или позже после воскресенья)
-                        days_since_gruppenrun = (current_date - reg_date).days
-                        
-                        # Очищаем регистрацию, если прошло больше суток после даты мероприятия
-                        if days_since_gruppenrun >= 1:
-                            logging.info(f"Очистка истёкшей разовой регистрации для пользователя {user_id} (дата: {reg_date_str})")
-                            
-                            # Очищаем регистрацию на Группенран
-                            user_info["gruppenrun"]["is_registered"] = False
-                            user_info["gruppenrun"]["registration_for_date"] = None
-                            user_info["gruppenrun"]["gruppenrun_number"] = None
-                            
-                            # Очищаем заказ завтраков, связанный с этой регистрацией
-                            if "breakfast_order" in user_info:
-                                logging.info(f"Очистка заказа завтрака для пользователя {user_id}")
-                                del user_info["breakfast_order"]
-                            
-                            data_changed = True
-                    except ValueError:
-                        logging.warning(f"Неверный формат даты регистрации для пользователя {user_id}: {reg_date_str}")
-                        
-            # Обработка месячных абонементов
-            elif reg_type == "monthly":
-                valid_until_str = gruppenrun_data.get("valid_until")
-                if valid_until_str:
-                    try:
-                        valid_until_date = datetime.strptime(valid_until_str, "%Y-%m-%d").date()
-                        if current_date > valid_until_date:
-                            logging.info(f"Очистка истёкшего месячного абонемента для пользователя {user_id}")
-                            user_info["gruppenrun"]["is_registered"] = False
-                            user_info["gruppenrun"]["valid_until"] = None
-                            data_changed = True
-                    except ValueError:
-                        logging.warning(f"Неверный формат даты valid_until для пользователя {user_id}: {valid_until_str}")
-    
-    if data_changed:
-        save_data(all_data)
-        logging.info("База данных обновлена - удалены истёкшие регистрации")
-    
-    return all_data
-
 async def delete_last_admin_message(message, state, bot):
     """Удаляет последнее сообщение админ-панели"""
     data = await state.get_data()
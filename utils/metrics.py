@@ -0,0 +1,362 @@
+# Файл: utils/metrics.py
+# -*- coding: utf-8 -*-
+
+"""
+Метрики бота в формате Prometheus
+
+Бот считает метрики у себя (счётчики, гистограммы) и раз в несколько
+секунд записывает их текстом в METRICS_FILE - атомарно, через временный
+файл и os.replace. Веб-панель отдаёт этот файл на GET /metrics
+(web/app.py): отдельный порт в процессе бота не нужен, а Prometheus
+ходит туда же, куда и браузер.
+
+    metrics.update_seconds.labels("message").observe(0.015)
+    metrics.handler_seconds.labels("gruppenrun").observe(0.012)
+
+Что считается:
+  - апдейты по типам и время обработчиков по роутерам
+  - DataCache (попадания/промахи) и отказы RateLimitMiddleware
+  - SQL-запросы, ожидание потока БД и ошибки «database is locked»
+  - запросы к Bot API и ответы 429
+  - очередь webhook (если бот работает через webhook)
+  - задержка event loop и время сброса FSM в БД
+
+Библиотека prometheus_client не нужна: текстовый формат простой.
+"""
+
+import asyncio
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Как часто переписывать файл метрик (секунд)
+WRITE_INTERVAL = 5.0
+# Как часто мерить задержку event loop (секунд)
+LAG_INTERVAL = 0.5
+
+# Границы гистограмм (секунды)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# ==================== МЕТРИКИ ====================
+
+class _Value:
+    """Значение счётчика/gauge с одним набором меток"""
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _Buckets:
+    """Гистограмма с одним набором меток"""
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя - +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Metric:
+    """
+    Метрика с метками: counter, gauge или histogram
+
+    Значения для каждого набора меток создаются при первом labels()
+    и дальше переиспользуются - в горячем пути стоит держать ссылку:
+
+        rows = metrics.fsm_flush_rows.labels()
+        rows.inc(len(batch))
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str,
+                 labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Без меток - значение есть сразу (0), а не после первого события
+            self.labels()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {values}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = _Buckets(self.buckets) if self.kind == "histogram" else _Value()
+                    self._children[values] = child
+        return child
+
+    def render(self, const: str = "") -> List[str]:
+        """Строки метрики; const - метки процесса (process="worker1") для всех значений"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            labels = _labels(self.labelnames, values, const)
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{labels} {_format_value(child.value)}")
+                continue
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, const, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и функций, обновляющих их перед выгрузкой"""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+        # Имя процесса (BOT_WORKERS > 1) - метка process у всех значений
+        self.process: Optional[str] = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Metric:
+        return self._add(Metric("counter", name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Metric:
+        return self._add(Metric("gauge", name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Metric:
+        return self._add(Metric("histogram", name, documentation, labelnames, buckets))
+
+    def _add(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, callback: Callable[[], None]):
+        """callback() вызывается перед каждой выгрузкой (значения, которые считает кто-то другой)"""
+        self._collectors.append(callback)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        for callback in self._collectors:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сбора метрик: {e}")
+        const = f'process="{_escape(self.process)}"' if self.process else ""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(const))
+        return "\n".join(lines) + "\n"
+
+
+# ==================== МЕТРИКИ БОТА ====================
+
+class BotMetrics(Registry):
+    """Все метрики бота; значения обновляют middleware, БД и хранилище FSM"""
+
+    def __init__(self):
+        super().__init__()
+        # Апдейты и обработчики (middlewares/metrics.py)
+        # rate(gruppenrun_update_duration_seconds_count) - апдейтов в секунду
+        self.update_seconds = self.histogram(
+            "gruppenrun_update_duration_seconds", "Полная обработка апдейта", ["type"])
+        self.handler_seconds = self.histogram(
+            "gruppenrun_handler_duration_seconds", "Время обработчика по роутерам", ["router"])
+        self.handler_errors = self.counter(
+            "gruppenrun_handler_errors_total", "Исключения в обработчиках", ["router"])
+        self.rate_limited = self.counter(
+            "gruppenrun_rate_limit_rejections_total", "Апдейты, отброшенные RateLimitMiddleware", ["event"])
+
+        # DataCache (значения берутся из data_cache при выгрузке)
+        self.cache_hits = self.counter("gruppenrun_cache_hits_total", "Попадания в DataCache")
+        self.cache_misses = self.counter("gruppenrun_cache_misses_total", "Промахи DataCache")
+        self.cache_hit_ratio = self.gauge(
+            "gruppenrun_cache_hit_ratio", "Доля попаданий DataCache с запуска бота")
+        self.cache_size = self.gauge("gruppenrun_cache_entries", "Записей в DataCache")
+
+        # БД (utils/async_database.py, utils/database.py)
+        self.db_queries = self.counter("gruppenrun_db_queries_total", "Выполненные SQL-запросы")
+        self._queries = self.db_queries.labels()
+        self.db_wait_seconds = self.histogram(
+            "gruppenrun_db_wait_seconds", "Ожидание потока БД (вызов adb стоит в очереди)",
+            buckets=FAST_BUCKETS)
+        self.db_call_seconds = self.histogram(
+            "gruppenrun_db_call_duration_seconds", "Выполнение вызова adb в потоке БД",
+            buckets=FAST_BUCKETS)
+        self.db_locked = self.counter(
+            "gruppenrun_db_locked_total", "Ошибки SQLite «database is locked/busy»")
+
+        # Bot API (middlewares/metrics.py)
+        self.api_requests = self.counter(
+            "gruppenrun_telegram_requests_total", "Запросы к Bot API", ["method", "result"])
+        self.api_seconds = self.histogram(
+            "gruppenrun_telegram_request_duration_seconds", "Время запроса к Bot API")
+        self.api_retry_after = self.counter(
+            "gruppenrun_telegram_retry_after_total", "Ответы 429 (TelegramRetryAfter) от Bot API")
+
+        # Webhook (utils/webhook.py)
+        self.webhook_requests = self.counter(
+            "gruppenrun_webhook_requests_total", "Запросы Telegram на webhook", ["result"])
+        self.webhook_queue = self.gauge(
+            "gruppenrun_webhook_queue_size", "Апдейты webhook, ждущие обработки")
+        self.webhook_wait_seconds = self.histogram(
+            "gruppenrun_webhook_queue_wait_seconds", "Сколько апдейт ждал в очереди webhook")
+
+        # Несколько процессов (utils/sharding.py)
+        self.shard_updates = self.counter(
+            "gruppenrun_shard_updates_total", "Апдейты, переданные воркеру", ["shard"])
+        self.shard_queue = self.gauge(
+            "gruppenrun_shard_queue_size", "Апдейты в очереди супервизора к воркеру", ["shard"])
+        self.worker_restarts = self.counter(
+            "gruppenrun_worker_restarts_total", "Перезапуски упавших воркеров", ["shard"])
+
+        # Процесс
+        self.loop_lag = self.histogram(
+            "gruppenrun_event_loop_lag_seconds", "Задержка event loop (опоздание таймера)",
+            buckets=FAST_BUCKETS)
+        self.fsm_flush_seconds = self.histogram(
+            "gruppenrun_fsm_flush_duration_seconds", "Сброс накопленных состояний FSM в БД",
+            buckets=FAST_BUCKETS)
+        self.fsm_flush_rows = self.counter(
+            "gruppenrun_fsm_flush_rows_total", "Записи FSM, сброшенные в БД")
+        self.start_time = self.gauge(
+            "gruppenrun_process_start_time_seconds", "Время запуска бота (unix)")
+        self.start_time.labels().set(time.time())
+
+        self.add_collector(self._collect_cache)
+
+    def _collect_cache(self):
+        from utils.cache import data_cache
+
+        hits, misses = data_cache.hits, data_cache.misses
+        self.cache_hits.labels().set(hits)
+        self.cache_misses.labels().set(misses)
+        self.cache_hit_ratio.labels().set(hits / (hits + misses) if hits + misses else 0.0)
+        self.cache_size.labels().set(len(data_cache._entries))
+
+    def on_statement(self, statement: str):
+        """sqlite3 trace callback: счёт SQL-запросов"""
+        self._queries.inc()
+
+
+# ==================== ВЫГРУЗКА ====================
+
+class MetricsExporter:
+    """
+    Фоновые задачи бота: запись метрик в файл и замер задержки event loop
+
+        await metrics_exporter.start("bot_metrics.prom", database=db)
+        ...
+        await metrics_exporter.stop()
+    """
+
+    def __init__(self, registry: BotMetrics):
+        self.registry = registry
+        self.path: Optional[str] = None
+        self._database = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, path: str, database=None, interval: float = WRITE_INTERVAL):
+        if self._tasks:
+            return
+        self.path = path
+        if database is not None:
+            self._database = database
+            database.add_trace_callback(self.registry.on_statement)
+        self._tasks = [
+            asyncio.create_task(self._write_loop(interval)),
+            asyncio.create_task(self._lag_loop()),
+        ]
+        logger.info(f"📈 Метрики пишутся в {path}")
+
+    async def stop(self):
+        """Остановить задачи и записать метрики последний раз"""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._database is not None:
+            self._database.remove_trace_callback(self.registry.on_statement)
+            self._database = None
+        await self.write()
+
+    async def write(self):
+        """Записать текущие значения (сам файл - не в event loop)"""
+        text = self.registry.render()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_file, text)
+        except OSError as e:
+            logger.error(f"❌ Не удалось записать метрики в {self.path}: {e}")
+
+    def _write_file(self, text: str):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        # Читатель видит либо старый файл целиком, либо новый
+        os.replace(tmp_path, self.path)
+
+    async def _write_loop(self, interval: float):
+        while True:
+            await self.write()
+            await asyncio.sleep(interval)
+
+    async def _lag_loop(self):
+        loop = asyncio.get_running_loop()
+        lag = self.registry.loop_lag.labels()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            lag.observe(max(loop.time() - started - LAG_INTERVAL, 0.0))
+
+
+# Глобальные экземпляры
+metrics = BotMetrics()
+metrics_exporter = MetricsExporter(metrics)
@@ -0,0 +1,576 @@
+# Файл: utils/migrations.py
+# -*- coding: utf-8 -*-
+
+"""
+Версионные миграции схемы bot_data.db
+
+Каждая миграция - функция с номером (@migration). Применённые миграции
+записываются в таблицу schema_version, номер последней дублируется
+в PRAGMA user_version - по нему при старте за один запрос видно, что
+схема актуальна, и никакой DDL не выполняется.
+
+Миграции применяются на живой БД: каждая - отдельная короткая
+транзакция BEGIN IMMEDIATE (WAL: читатели не блокируются), номер
+перепроверяется под блокировкой, поэтому бот и веб-панель могут
+стартовать одновременно.
+
+Новая миграция - новая функция со следующим номером. Уже выпущенные
+миграции не меняем.
+"""
+
+import logging
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (номер, описание, функция)
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], None]]] = []
+
+
+def migration(version: int, description: str):
+    """Зарегистрировать миграцию с номером version"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, definition: str):
+    """ALTER TABLE ... ADD COLUMN, если такой колонки ещё нет"""
+    columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def apply_migrations(conn: sqlite3.Connection) -> int:
+    """
+    Довести схему до последней версии
+
+    Returns:
+        Сколько миграций применено (0 - схема уже актуальна)
+    """
+    target = latest_version()
+    # Быстрый путь: схема актуальна - ни одного DDL
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current >= target:
+        return 0
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    if conn.in_transaction:
+        conn.commit()
+
+    applied = 0
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Перепроверяем под блокировкой: другой процесс мог успеть раньше
+            done = conn.execute(
+                "SELECT 1 FROM schema_version WHERE version = ?", (version,)
+            ).fetchone()
+            if done is None:
+                func(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                    (version, description)
+                )
+                applied += 1
+                logger.info(f"🛠 Миграция {version}: {description}")
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"❌ Миграция {version} не применена: {description}")
+            raise
+
+    return applied
+
+
+# ==================== МИГРАЦИИ ====================
+
+# Последняя дата тренировки, на которую действует регистрация:
+# абонемент - до valid_until, разовая - ближайшая тренировка после записи
+# (Шарташ - воскресенье, включая день записи; Трейл - следующая суббота)
+ACTIVE_EVENT_DATE_SQL = """
+    CASE
+        WHEN {r}.type = 'monthly' THEN COALESCE({r}.valid_until, '9999-12-31')
+        WHEN COALESCE({r}.location, 'shartas') = 'uktus'
+            THEN date({r}.registered_at, 'localtime', '+1 day', 'weekday 6')
+        ELSE date({r}.registered_at, 'localtime', 'weekday 0')
+    END
+"""
+
+
+@migration(1, "исходная схема: пользователи, регистрации, завтраки, события")
+def _m001_initial(conn):
+    # IF NOT EXISTS: рабочая БД создана ещё до миграций
+    # Таблица пользователей
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        name TEXT,
+        phone TEXT,
+        username TEXT,
+        bot_version TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # Таблица регистраций Группенран (с location)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS gruppenrun_registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        location TEXT DEFAULT 'shartas',
+        type TEXT NOT NULL,
+        valid_until DATE,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+
+    # Таблица регистраций Иремель
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS iremel_registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        is_registered BOOLEAN DEFAULT 0,
+        waiting_list BOOLEAN DEFAULT 0,
+        payment_type TEXT,
+        diet_restrictions TEXT,
+        preferences TEXT,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+
+    # Таблица регистраций Кругосветка
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS krugosvetka_registrations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        stages_ids TEXT,
+        pace TEXT,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+
+    # Таблица заказов завтраков
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS breakfast_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        order_date DATE NOT NULL,
+        items TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        UNIQUE(user_id, order_date)
+    )
+    """)
+
+    # Таблица для отслеживания событий
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS event_tracking (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        event_name TEXT NOT NULL,
+        event_data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    """)
+
+    # Индексы
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_phone ON users(phone)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gruppenrun_user ON gruppenrun_registrations(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gruppenrun_location ON gruppenrun_registrations(location)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_iremel_user ON iremel_registrations(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_breakfast_date ON breakfast_orders(order_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date ON event_tracking(created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_name ON event_tracking(event_name)")
+
+
+@migration(2, "таблица состояний FSM")
+def _m002_fsm_storage(conn):
+    # utils/storage.SQLiteStorage
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_storage (
+        bot_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        state TEXT,
+        data TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (bot_id, chat_id, user_id)
+    ) WITHOUT ROWID
+    """)
+
+
+@migration(3, "актуальные регистрации Группенран (active_registrations)")
+def _m003_active_registrations(conn):
+    # По одной (последней) регистрации на пользователя и локацию. Ведётся
+    # триггерами на gruppenrun_registrations, списки на дату - диапазон
+    # по индексу (location, event_date) без обхода всей истории
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS active_registrations (
+        location TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        valid_until DATE,
+        event_date DATE NOT NULL,
+        registration_id INTEGER NOT NULL,
+        registered_at TIMESTAMP,
+        PRIMARY KEY (location, user_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_active_event_date ON active_registrations(location, event_date)"
+    )
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_gruppenrun_active_insert
+    AFTER INSERT ON gruppenrun_registrations
+    WHEN NOT EXISTS (
+        SELECT 1 FROM active_registrations a
+        WHERE a.location = COALESCE(NEW.location, 'shartas')
+          AND a.user_id = NEW.user_id
+          AND a.registered_at > NEW.registered_at
+    )
+    BEGIN
+        INSERT OR REPLACE INTO active_registrations
+            (location, user_id, type, valid_until, event_date, registration_id, registered_at)
+        VALUES (
+            COALESCE(NEW.location, 'shartas'), NEW.user_id, NEW.type, NEW.valid_until,
+            {ACTIVE_EVENT_DATE_SQL.format(r='NEW')}, NEW.id, NEW.registered_at
+        );
+    END
+    """)
+    # Удалили актуальную запись - актуальной становится предыдущая
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_gruppenrun_active_delete
+    AFTER DELETE ON gruppenrun_registrations
+    BEGIN
+        DELETE FROM active_registrations
+        WHERE location = COALESCE(OLD.location, 'shartas')
+          AND user_id = OLD.user_id
+          AND registration_id = OLD.id;
+        INSERT OR IGNORE INTO active_registrations
+            (location, user_id, type, valid_until, event_date, registration_id, registered_at)
+        SELECT COALESCE(g.location, 'shartas'), g.user_id, g.type, g.valid_until,
+               {ACTIVE_EVENT_DATE_SQL.format(r='g')}, g.id, g.registered_at
+        FROM gruppenrun_registrations g
+        WHERE g.user_id = OLD.user_id
+          AND COALESCE(g.location, 'shartas') = COALESCE(OLD.location, 'shartas')
+        ORDER BY g.registered_at DESC, g.id DESC
+        LIMIT 1;
+    END
+    """)
+    # Заполнение из истории регистраций
+    conn.execute("DELETE FROM active_registrations")
+    conn.execute(f"""
+    INSERT INTO active_registrations
+        (location, user_id, type, valid_until, event_date, registration_id, registered_at)
+    SELECT COALESCE(location, 'shartas'), user_id, type, valid_until,
+           {ACTIVE_EVENT_DATE_SQL.format(r='g')}, id, registered_at
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY COALESCE(location, 'shartas'), user_id
+            ORDER BY registered_at DESC, id DESC
+        ) AS rn
+        FROM gruppenrun_registrations
+    ) g
+    WHERE rn = 1
+    """)
+
+
+@migration(4, "составные и покрывающие индексы")
+def _m004_composite_indexes(conn):
+    # Последняя регистрация пользователя по локации и покрывающий индекс
+    # для «активных за N дней» (COUNT DISTINCT user_id)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_gruppenrun_user_location "
+        "ON gruppenrun_registrations(user_id, location, registered_at DESC)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date_user ON event_tracking(created_at, user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(created_at)")
+    # Их префиксы - одноколоночные индексы - больше не нужны
+    conn.execute("DROP INDEX IF EXISTS idx_gruppenrun_user")
+    conn.execute("DROP INDEX IF EXISTS idx_events_date")
+
+
+# С датой тренировки из регистрации (registration_for_date), если она есть
+ACTIVE_EVENT_DATE_SQL_V2 = """
+    CASE
+        WHEN {r}.type = 'monthly' THEN COALESCE({r}.valid_until, '9999-12-31')
+        WHEN {r}.registration_for_date IS NOT NULL THEN {r}.registration_for_date
+        WHEN COALESCE({r}.location, 'shartas') = 'uktus'
+            THEN date({r}.registered_at, 'localtime', '+1 day', 'weekday 6')
+        ELSE date({r}.registered_at, 'localtime', 'weekday 0')
+    END
+"""
+
+
+@migration(5, "поля из JSON (дата тренировки, этапы, сумма завтрака) и ключи для upsert")
+def _m005_import_fields(conn):
+    add_column(conn, "gruppenrun_registrations", "registration_for_date", "DATE")
+    add_column(conn, "krugosvetka_registrations", "stages", "TEXT")
+    add_column(conn, "breakfast_orders", "total_price", "INTEGER")
+
+    # Одна запись Иремеля и Кругосветки на пользователя (как и пишет бот):
+    # дубликаты убираем (остаётся первая - её же читает снимок) и
+    # закрепляем уникальным индексом, чтобы импорт мог делать upsert
+    conn.execute("""
+    DELETE FROM iremel_registrations
+    WHERE id NOT IN (SELECT MIN(id) FROM iremel_registrations GROUP BY user_id)
+    """)
+    conn.execute("""
+    DELETE FROM krugosvetka_registrations
+    WHERE id NOT IN (SELECT MIN(id) FROM krugosvetka_registrations GROUP BY user_id)
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_iremel_user_unique ON iremel_registrations(user_id)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_krugosvetka_user_unique ON krugosvetka_registrations(user_id)")
+    conn.execute("DROP INDEX IF EXISTS idx_iremel_user")
+
+    # Дата тренировки из регистрации точнее вычисленной по registered_at
+    conn.execute("DROP TRIGGER IF EXISTS trg_gruppenrun_active_insert")
+    conn.execute("DROP TRIGGER IF EXISTS trg_gruppenrun_active_delete")
+    conn.execute(f"""
+    CREATE TRIGGER trg_gruppenrun_active_insert
+    AFTER INSERT ON gruppenrun_registrations
+    WHEN NOT EXISTS (
+        SELECT 1 FROM active_registrations a
+        WHERE a.location = COALESCE(NEW.location, 'shartas')
+          AND a.user_id = NEW.user_id
+          AND a.registered_at > NEW.registered_at
+    )
+    BEGIN
+        INSERT OR REPLACE INTO active_registrations
+            (location, user_id, type, valid_until, event_date, registration_id, registered_at)
+        VALUES (
+            COALESCE(NEW.location, 'shartas'), NEW.user_id, NEW.type, NEW.valid_until,
+            {ACTIVE_EVENT_DATE_SQL_V2.format(r='NEW')}, NEW.id, NEW.registered_at
+        );
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER trg_gruppenrun_active_delete
+    AFTER DELETE ON gruppenrun_registrations
+    BEGIN
+        DELETE FROM active_registrations
+        WHERE location = COALESCE(OLD.location, 'shartas')
+          AND user_id = OLD.user_id
+          AND registration_id = OLD.id;
+        INSERT OR IGNORE INTO active_registrations
+            (location, user_id, type, valid_until, event_date, registration_id, registered_at)
+        SELECT COALESCE(g.location, 'shartas'), g.user_id, g.type, g.valid_until,
+               {ACTIVE_EVENT_DATE_SQL_V2.format(r='g')}, g.id, g.registered_at
+        FROM gruppenrun_registrations g
+        WHERE g.user_id = OLD.user_id
+          AND COALESCE(g.location, 'shartas') = COALESCE(OLD.location, 'shartas')
+        ORDER BY g.registered_at DESC, g.id DESC
+        LIMIT 1;
+    END
+    """)
+
+
+@migration(6, "отметки последнего запуска задач планировщика")
+def _m006_scheduler_runs(conn):
+    # utils/scheduler.Scheduler: слот последнего запуска каждой задачи
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scheduler_runs (
+        job TEXT PRIMARY KEY,
+        last_run TIMESTAMP NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+
+@migration(7, "дневные свёртки аналитики (event_daily_stats)")
+def _m007_event_daily_stats(conn):
+    # Счётчики событий по (день, событие): отчёты читают строки дней,
+    # а не всю event_tracking. День - местная дата события
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS event_daily_stats (
+        day DATE NOT NULL,
+        event_name TEXT NOT NULL,
+        events INTEGER NOT NULL DEFAULT 0,
+        users INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, event_name)
+    ) WITHOUT ROWID
+    """)
+    # Кто уже совершал событие в этот день - для счётчика уникальных
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS event_daily_users (
+        day DATE NOT NULL,
+        event_name TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        PRIMARY KEY (day, event_name, user_id)
+    ) WITHOUT ROWID
+    """)
+
+    # Свёртка ведётся триггерами в той же транзакции, что и запись пачки
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_event_rollup
+    AFTER INSERT ON event_tracking
+    BEGIN
+        INSERT INTO event_daily_stats (day, event_name, events)
+        VALUES (date(NEW.created_at, 'localtime'), NEW.event_name, 1)
+        ON CONFLICT(day, event_name) DO UPDATE SET events = events + 1;
+        INSERT OR IGNORE INTO event_daily_users (day, event_name, user_id)
+        VALUES (date(NEW.created_at, 'localtime'), NEW.event_name, NEW.user_id);
+    END
+    """)
+    # INSERT OR IGNORE не вызывает AFTER INSERT для дубликата - считаем только новых
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_event_rollup_users
+    AFTER INSERT ON event_daily_users
+    BEGIN
+        UPDATE event_daily_stats SET users = users + 1
+        WHERE day = NEW.day AND event_name = NEW.event_name;
+    END
+    """)
+
+    # Заполнение по уже накопленным событиям
+    conn.execute("""
+    INSERT OR IGNORE INTO event_daily_users (day, event_name, user_id)
+    SELECT DISTINCT date(created_at, 'localtime'), event_name, user_id
+    FROM event_tracking
+    """)
+    conn.execute("""
+    INSERT OR REPLACE INTO event_daily_stats (day, event_name, events, users)
+    SELECT e.day, e.event_name, e.events,
+           (SELECT COUNT(*) FROM event_daily_users u
+            WHERE u.day = e.day AND u.event_name = e.event_name)
+    FROM (
+        SELECT date(created_at, 'localtime') AS day, event_name, COUNT(*) AS events
+        FROM event_tracking
+        GROUP BY 1, 2
+    ) e
+    """)
+
+
+@migration(8, "справочник имён событий (event_names), event_tracking с event_id")
+def _m008_event_names(conn):
+    # Имя события хранится один раз, в строках события - целочисленный id
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS event_names (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO event_names (name) SELECT DISTINCT event_name FROM event_tracking")
+    conn.execute("INSERT OR IGNORE INTO event_names (name) SELECT DISTINCT event_name FROM event_daily_stats")
+
+    # event_tracking заново: event_id вместо имени, event_data только если
+    # в нём есть что-то кроме повтора имени ({"button": ...} для "button:...")
+    conn.execute("""
+    CREATE TABLE event_tracking_new (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        event_id INTEGER NOT NULL,
+        event_data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (event_id) REFERENCES event_names(id)
+    )
+    """)
+    conn.execute("""
+    INSERT INTO event_tracking_new (id, user_id, event_id, event_data, created_at)
+    SELECT e.id, e.user_id, n.id,
+           CASE
+               WHEN json_valid(e.event_data) AND json(e.event_data) IN (
+                   json_object('button', substr(e.event_name, 8)),
+                   json_object('service', substr(e.event_name, 14)),
+                   json_object('command', substr(e.event_name, 9))
+               ) THEN NULL
+               ELSE e.event_data
+           END,
+           e.created_at
+    FROM event_tracking e
+    JOIN event_names n ON n.name = e.event_name
+    """)
+    conn.execute("DROP TABLE event_tracking")
+    conn.execute("ALTER TABLE event_tracking_new RENAME TO event_tracking")
+    # Диапазоны по дате: активные за N дней и удаление старых событий
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date_user ON event_tracking(created_at, user_id)")
+
+    conn.execute("""
+    CREATE TABLE event_daily_users_new (
+        day DATE NOT NULL,
+        event_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        PRIMARY KEY (day, event_id, user_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("""
+    INSERT INTO event_daily_users_new (day, event_id, user_id)
+    SELECT u.day, n.id, u.user_id
+    FROM event_daily_users u
+    JOIN event_names n ON n.name = u.event_name
+    """)
+    conn.execute("DROP TABLE event_daily_users")
+    conn.execute("ALTER TABLE event_daily_users_new RENAME TO event_daily_users")
+
+    # Триггеры свёртки (старые удалились вместе с таблицами)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_event_rollup
+    AFTER INSERT ON event_tracking
+    BEGIN
+        INSERT INTO event_daily_stats (day, event_name, events)
+        VALUES (
+            date(NEW.created_at, 'localtime'),
+            (SELECT name FROM event_names WHERE id = NEW.event_id),
+            1
+        )
+        ON CONFLICT(day, event_name) DO UPDATE SET events = events + 1;
+        INSERT OR IGNORE INTO event_daily_users (day, event_id, user_id)
+        VALUES (date(NEW.created_at, 'localtime'), NEW.event_id, NEW.user_id);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_event_rollup_users
+    AFTER INSERT ON event_daily_users
+    BEGIN
+        UPDATE event_daily_stats SET users = users + 1
+        WHERE day = NEW.day
+          AND event_name = (SELECT name FROM event_names WHERE id = NEW.event_id);
+    END
+    """)
+
+
+@migration(9, "индексы для постраничного списка пользователей в веб-API")
+def _m009_users_keyset(conn):
+    # Курсор (created_at, user_id): страница - диапазон по индексу без OFFSET
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_created_id ON users(created_at, user_id)")
+    conn.execute("DROP INDEX IF EXISTS idx_users_created")
+    # Фильтр «пользователи с событием»
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_event_daily_users_event ON event_daily_users(event_id, user_id)")
+
+
+@migration(10, "лента изменений для нескольких процессов бота (change_feed)")
+def _m010_change_feed(conn):
+    # Процесс пишет сюда (user_id, раздел) в той же транзакции, что и само
+    # изменение; остальные процессы читают ленту и сбрасывают свои кэши.
+    # AUTOINCREMENT: номера не переиспользуются после очистки старых строк
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_feed (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        origin INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        section TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
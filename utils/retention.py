@@ -0,0 +1,51 @@
+# Файл: utils/retention.py
+# -*- coding: utf-8 -*-
+
+"""
+Срок хранения событий аналитики
+
+Каждое событие сразу попадает в дневные счётчики event_daily_stats
+(триггеры, см. utils/migrations.py), поэтому сырые строки event_tracking
+нужны только за последние EVENT_RETENTION_DAYS дней. Раз в сутки
+(задача планировщика) старые события удаляются пачками, списки
+уникальных пользователей за старые дни - тоже, а освободившиеся
+страницы файла БД возвращаются ОС через incremental_vacuum. Старую БД
+(без auto_vacuum) для этого один раз переводят offline:
+python3 migrate_to_sqlite.py --vacuum.
+"""
+
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from config import EVENT_RETENTION_DAYS
+from utils.async_database import adb
+
+logger = logging.getLogger(__name__)
+
+# Строк за одну транзакцию удаления: между пачками успевают другие записи
+PURGE_BATCH = 5000
+# Страниц (по 4 КБ) за один проход incremental_vacuum
+VACUUM_PAGES = 5000
+
+
+async def apply_retention(days: int = EVENT_RETENTION_DAYS) -> dict:
+    """Удалить события старше days дней и вернуть место; вернуть сводку"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    cutoff_day = (date.today() - timedelta(days=days)).isoformat()
+
+    events = 0
+    while True:
+        deleted = await adb.purge_events(cutoff, PURGE_BATCH)
+        events += deleted
+        if deleted < PURGE_BATCH:
+            break
+
+    daily_users = await adb.purge_daily_users(cutoff_day)
+    pages = await adb.incremental_vacuum(VACUUM_PAGES)
+
+    if events or daily_users or pages:
+        logger.info(
+            f"🧹 Аналитика старше {days} дн.: событий удалено {events}, "
+            f"записей уникальных {daily_users}, страниц освобождено {pages}"
+        )
+    return {"events": events, "daily_users": daily_users, "pages": pages}
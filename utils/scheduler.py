@@ -0,0 +1,218 @@
+# Файл: utils/scheduler.py
+# -*- coding: utf-8 -*-
+
+"""
+Планировщик периодических задач (ежедневный отчёт, свёртки аналитики и т.п.)
+
+Время запуска считается от часов, а не накапливается из sleep(): слоты
+задаются триггером (DailyAt - каждый день в ЧЧ:ММ, Every - каждые N
+секунд от полуночи), поэтому задача не «уезжает» с каждым днём.
+
+Слот последнего запуска хранится в БД (таблица scheduler_runs): после
+перезапуска уже выполненный слот не повторяется, а пропущенный за время
+простоя выполняется один раз, если не прошло больше misfire_grace. Слот
+занимается условным upsert, так что и несколько процессов с одной БД не
+выполнят его дважды. jitter добавляет к моменту запуска случайную
+задержку, чтобы задачи (и процессы) не стартовали одновременно.
+
+    scheduler.add_job("daily_report", DailyAt(9, 0), send_report, jitter=60)
+    scheduler.start()
+    ...
+    await scheduler.stop()
+"""
+
+import asyncio
+import logging
+import random
+from datetime import datetime, time, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from utils.async_database import adb
+
+logger = logging.getLogger(__name__)
+
+# Дольше не спим: часы могли перевести (NTP, смена часового пояса)
+MAX_SLEEP = 3600.0
+
+
+def _slot_key(slot: datetime) -> str:
+    """Слот в виде строки для scheduler_runs (сравнивается как текст)"""
+    return slot.isoformat(sep=" ", timespec="seconds")
+
+
+# ==================== ТРИГГЕРЫ ====================
+
+class DailyAt:
+    """Каждый день в заданное местное время"""
+
+    def __init__(self, hour: int, minute: int = 0):
+        self.at = time(hour, minute)
+
+    def previous(self, now: datetime) -> datetime:
+        """Последний слот не позже now"""
+        slot = datetime.combine(now.date(), self.at)
+        return slot if slot <= now else slot - timedelta(days=1)
+
+    def next(self, now: datetime) -> datetime:
+        """Первый слот строго после now"""
+        return self.previous(now) + timedelta(days=1)
+
+    def __repr__(self):
+        return f"ежедневно в {self.at.strftime('%H:%M')}"
+
+
+class Every:
+    """Каждые N секунд, слоты выровнены по местной полуночи"""
+
+    def __init__(self, seconds: float):
+        if seconds <= 0:
+            raise ValueError("Интервал должен быть больше нуля")
+        self.interval = timedelta(seconds=seconds)
+
+    def previous(self, now: datetime) -> datetime:
+        midnight = datetime.combine(now.date(), time.min)
+        return midnight + ((now - midnight) // self.interval) * self.interval
+
+    def next(self, now: datetime) -> datetime:
+        return self.previous(now) + self.interval
+
+    def __repr__(self):
+        return f"каждые {self.interval.total_seconds():.0f} с"
+
+
+# ==================== ПЛАНИРОВЩИК ====================
+
+class Job:
+    __slots__ = ("name", "trigger", "func", "jitter", "misfire_grace", "retry_delay", "task")
+
+    def __init__(self, name, trigger, func, jitter, misfire_grace, retry_delay):
+        self.name = name
+        self.trigger = trigger
+        self.func = func
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.retry_delay = retry_delay
+        self.task: Optional[asyncio.Task] = None
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._running = False
+
+    def add_job(self, name: str, trigger, func: Callable[[], Awaitable[None]],
+                jitter: float = 0.0, misfire_grace: float = 3600.0, retry_delay: float = 300.0):
+        """
+        Зарегистрировать задачу
+
+        name          - ключ отметки в БД (не менять без нужды)
+        func          - корутина без аргументов
+        jitter        - случайная задержка запуска 0..jitter секунд
+        misfire_grace - сколько секунд после слота его ещё можно догнать
+                        (после простоя бота или при повторе после ошибки)
+        retry_delay   - пауза перед повтором упавшего запуска
+        """
+        if name in self.jobs:
+            raise ValueError(f"Задача {name} уже зарегистрирована")
+        job = Job(name, trigger, func, jitter, misfire_grace, retry_delay)
+        self.jobs[name] = job
+        if self._running:
+            job.task = asyncio.create_task(self._run_job(job))
+        return job
+
+    def start(self):
+        """Запустить все задачи (вызывать внутри event loop)"""
+        if self._running:
+            return
+        self._running = True
+        for job in self.jobs.values():
+            job.task = asyncio.create_task(self._run_job(job))
+            logger.info(f"⏰ Задача {job.name}: {job.trigger!r}")
+
+    async def stop(self):
+        """Остановить задачи (текущий запуск прерывается)"""
+        self._running = False
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.task = None
+
+    async def _first_slot(self, job: Job) -> datetime:
+        """Слот, с которого начинать: пропущенный (если ещё не поздно) или следующий"""
+        now = datetime.now()
+        previous = job.trigger.previous(now)
+        last_run = await adb.get_last_run(job.name)
+        # Отметки нет - задача новая, прошлые слоты не догоняем
+        if last_run is not None and last_run < _slot_key(previous):
+            if (now - previous).total_seconds() <= job.misfire_grace:
+                logger.info(f"⏰ {job.name}: догоняю пропущенный запуск {_slot_key(previous)}")
+                return previous
+        return job.trigger.next(now)
+
+    async def _run_job(self, job: Job):
+        while True:
+            try:
+                slot = await self._first_slot(job)
+                break
+            except Exception as e:
+                # Например, БД занята другим процессом - задача не должна умереть
+                logger.error(f"❌ {job.name}: не удалось прочитать отметку запуска: {e}")
+                await asyncio.sleep(job.retry_delay)
+        while True:
+            # Пропущенный слот догоняем тоже с jitter: после перезапуска
+            # нескольких процессов они не бросятся выполнять его разом
+            start_at = max(slot, datetime.now()) + timedelta(seconds=random.uniform(0, job.jitter))
+            await self._sleep_until(start_at)
+
+            if await self._claim(job, slot):
+                await self._execute(job, slot)
+            else:
+                logger.debug(f"⏰ {job.name}: слот {_slot_key(slot)} уже выполнен")
+
+            slot = job.trigger.next(max(slot, datetime.now()))
+
+    async def _claim(self, job: Job, slot: datetime) -> bool:
+        """Занять слот; при ошибке БД повторять, пока не вышло misfire_grace"""
+        deadline = slot + timedelta(seconds=job.misfire_grace)
+        while True:
+            try:
+                return await adb.claim_run(job.name, _slot_key(slot))
+            except Exception as e:
+                logger.error(f"❌ {job.name}: не удалось занять слот {_slot_key(slot)}: {e}")
+            retry_at = datetime.now() + timedelta(seconds=job.retry_delay)
+            if retry_at > deadline:
+                logger.warning(f"⚠️ {job.name}: слот {_slot_key(slot)} пропущен после ошибок")
+                return False
+            await self._sleep_until(retry_at)
+
+    async def _execute(self, job: Job, slot: datetime):
+        """Выполнить слот; при ошибке повторять, пока не вышло misfire_grace"""
+        deadline = slot + timedelta(seconds=job.misfire_grace)
+        while True:
+            try:
+                await job.func()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка задачи {job.name}: {e}")
+            retry_at = datetime.now() + timedelta(seconds=job.retry_delay)
+            if retry_at > deadline:
+                logger.warning(f"⚠️ {job.name}: слот {_slot_key(slot)} пропущен после ошибок")
+                return
+            await self._sleep_until(retry_at)
+
+    @staticmethod
+    async def _sleep_until(when: datetime):
+        # Спим кусками и сверяемся с часами: перевод часов не сдвигает запуск
+        while True:
+            remaining = (when - datetime.now()).total_seconds()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(remaining, MAX_SLEEP))
+
+
+# Глобальный экземпляр
+scheduler = Scheduler()
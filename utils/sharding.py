@@ -0,0 +1,372 @@
+# Файл: utils/sharding.py
+# -*- coding: utf-8 -*-
+
+"""
+Несколько процессов бота: супервизор и воркеры (BOT_WORKERS > 1)
+
+Один процесс (супервизор) получает апдейты - long polling или webhook -
+и раздаёт их N процессам-воркерам по user_id: пользователь всегда
+попадает в один и тот же воркер. Поэтому всё, что хранится в памяти
+процесса по пользователю (FSM в SQLiteStorage, rate limit, проверка
+версии), остаётся верным, а апдейты одного пользователя обрабатываются
+строго по очереди. Разные пользователи - на разных ядрах.
+
+    супервизор --stdin (NDJSON)--> воркер 0: Dispatcher, handlers/
+               --stdin (NDJSON)--> воркер 1: ...
+
+Апдейт - строка JSON в stdin воркера. Если воркер не успевает, труба
+заполняется, очередь супервизора к нему растёт, а когда и она полна,
+супервизор перестаёт забирать апдейты у Telegram (они ждут там).
+Упавший воркер перезапускается, его очередь сохраняется; апдейты,
+которые он уже прочитал из трубы, теряются - как и при падении
+одного процесса в обычном режиме.
+
+SQLite у всех общий: запись - BEGIN IMMEDIATE с ожиданием (Database),
+а об изменениях процессы узнают из таблицы change_feed
+(ChangeFeedFollower) и сбрасывают свои кэши.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+
+from utils.async_database import adb
+from utils.metrics import metrics
+from utils.webhook import feed_raw_update, install_stop_signals, workflow_data
+
+logger = logging.getLogger(__name__)
+
+# Long polling у супервизора (секунд)
+POLL_TIMEOUT = 30
+# Пауза перед перезапуском упавшего воркера (растёт при падениях подряд)
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 30.0
+# Сколько ждать, пока воркер дообработает свои апдейты при остановке
+STOP_TIMEOUT = 30.0
+# Как часто воркер читает change_feed (секунд)
+FEED_INTERVAL = 0.2
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Пользователь апдейта (для апдейтов без пользователя - чат или 0)"""
+    for key, value in update.items():
+        if key != "update_id" and isinstance(value, dict):
+            owner = value.get("from") or value.get("user") or value.get("chat") or {}
+            return int(owner.get("id") or 0)
+    return 0
+
+
+def shard_of(update: Dict[str, Any], shards: int) -> int:
+    """Номер воркера: по user_id, один и тот же между перезапусками"""
+    return update_user_id(update) % shards
+
+
+def process_file(path: str, process: str) -> str:
+    """Файл процесса: traces.ndjson -> traces.worker1.ndjson"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{process}{ext}"
+
+
+# ==================== СУПЕРВИЗОР ====================
+
+class _Shard:
+    """Воркер со стороны супервизора: процесс и очередь апдейтов к нему"""
+
+    def __init__(self, index: int, queue_size: int):
+        self.index = index
+        self.queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=queue_size)
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.alive = asyncio.Event()
+        self.label = str(index)
+
+
+class Supervisor:
+    """
+    Запуск воркеров, раздача им апдейтов, перезапуск упавших
+
+        supervisor = Supervisor(lambda i: [sys.executable, "main.py", "--worker", str(i)], workers=4)
+        await supervisor.start()
+        await supervisor.serve_polling(bot, allowed_updates)  # до SIGINT/SIGTERM
+        await supervisor.close()
+    """
+
+    def __init__(self, command: Callable[[int], List[str]], workers: int, queue_size: int = 1000):
+        self.command = command
+        self.shards = [_Shard(i, queue_size) for i in range(workers)]
+        self._senders: List[asyncio.Task] = []
+        self._supervisors: List[asyncio.Task] = []
+        self._closing = False
+        self._stopped = asyncio.Event()
+        metrics.add_collector(self._collect)
+
+    def _collect(self):
+        for shard in self.shards:
+            metrics.shard_queue.labels(shard.label).set(shard.queue.qsize())
+
+    async def start(self):
+        for shard in self.shards:
+            self._supervisors.append(asyncio.create_task(self._supervise(shard)))
+            self._senders.append(asyncio.create_task(self._send(shard)))
+
+    async def route(self, update: Dict[str, Any]):
+        """Передать апдейт воркеру его пользователя (ждёт, если очередь полна)"""
+        shard = self.shards[shard_of(update, len(self.shards))]
+        line = json.dumps(update, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        metrics.shard_updates.labels(shard.label).inc()
+        await shard.queue.put(line)
+
+    async def _supervise(self, shard: _Shard):
+        """Держать процесс воркера запущенным"""
+        loop = asyncio.get_running_loop()
+        delay = RESTART_DELAY
+        while not self._closing:
+            started = loop.time()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *self.command(shard.index), stdin=asyncio.subprocess.PIPE
+                )
+            except OSError as e:
+                logger.error(f"❌ Воркер {shard.index} не запустился: {e}")
+                await asyncio.sleep(MAX_RESTART_DELAY)
+                continue
+            shard.process = process
+            shard.alive.set()
+            logger.info(f"🧩 Воркер {shard.index} запущен (pid {process.pid})")
+            code = await process.wait()
+            shard.alive.clear()
+            if self._closing:
+                return
+            metrics.worker_restarts.labels(shard.label).inc()
+            # Падает сразу после старта - не перезапускаем в цикле без паузы
+            delay = RESTART_DELAY if loop.time() - started > 60 else min(delay * 2, MAX_RESTART_DELAY)
+            logger.error(f"❌ Воркер {shard.index} завершился (код {code}), перезапуск через {delay:.0f} с")
+            await asyncio.sleep(delay)
+
+    async def _send(self, shard: _Shard):
+        """Очередь шарда -> stdin воркера; при падении воркера ждём перезапуска"""
+        while True:
+            line = await shard.queue.get()
+            if line is None:
+                return
+            while True:
+                await shard.alive.wait()
+                process = shard.process
+                try:
+                    process.stdin.write(line)
+                    await process.stdin.drain()
+                    break
+                except (BrokenPipeError, ConnectionResetError):
+                    # Воркер упал: апдейт отправим в перезапущенный
+                    # (если он успел его прочитать - обработается дважды)
+                    await process.wait()
+                    if shard.process is process:
+                        shard.alive.clear()
+
+    # ==================== ПОЛУЧЕНИЕ АПДЕЙТОВ ====================
+
+    async def _poll(self, bot: Bot, allowed_updates: List[str]):
+        """
+        getUpdates без разбора в объекты aiogram: супервизору нужен
+        только user_id, а JSON целиком уходит воркеру
+        """
+        url = bot.session.api.api_url(token=bot.token, method="getUpdates")
+        offset = None
+        delay = RESTART_DELAY
+        timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 15)
+        async with aiohttp.ClientSession(timeout=timeout) as http:
+            while True:
+                params = {"timeout": str(POLL_TIMEOUT), "allowed_updates": json.dumps(allowed_updates)}
+                if offset is not None:
+                    params["offset"] = str(offset)
+                try:
+                    async with http.post(url, data=params) as response:
+                        answer = await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logger.error(f"❌ getUpdates: {e!r}, повтор через {delay:.0f} с")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, MAX_RESTART_DELAY)
+                    continue
+                if not answer.get("ok"):
+                    retry_after = (answer.get("parameters") or {}).get("retry_after")
+                    logger.error(f"❌ getUpdates: {answer.get('description')}")
+                    await asyncio.sleep(retry_after or delay)
+                    delay = min(delay * 2, MAX_RESTART_DELAY)
+                    continue
+                delay = RESTART_DELAY
+                for update in answer["result"]:
+                    await self.route(update)
+                    # Подтверждается следующим запросом: при остановке
+                    # посреди пачки остаток придёт снова
+                    offset = update["update_id"] + 1
+
+    async def serve_polling(self, bot: Bot, allowed_updates: List[str]):
+        """Long polling до SIGINT/SIGTERM (или stop())"""
+        install_stop_signals(self.stop)
+        poller = asyncio.create_task(self._poll(bot, allowed_updates))
+        stopped = asyncio.create_task(self._stopped.wait())
+        try:
+            await asyncio.wait({poller, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (poller, stopped):
+                task.cancel()
+            await asyncio.gather(poller, stopped, return_exceptions=True)
+
+    def stop(self):
+        self._stopped.set()
+
+    async def close(self):
+        """Отдать воркерам всё из очередей, закрыть их stdin и дождаться выхода"""
+        self._closing = True
+        for shard in self.shards:
+            await shard.queue.put(None)
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._senders), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Не все апдейты переданы воркерам до остановки")
+        await asyncio.gather(*(self._stop_worker(shard) for shard in self.shards))
+        for task in self._senders + self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._senders, *self._supervisors, return_exceptions=True)
+        self._senders, self._supervisors = [], []
+
+    async def _stop_worker(self, shard: _Shard):
+        process = shard.process
+        if process is None or process.returncode is not None:
+            return
+        # EOF в stdin: воркер дообработает начатое и выйдет сам
+        process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Воркер {shard.index} не завершился, останавливаю принудительно")
+            process.kill()
+            await process.wait()
+
+
+# ==================== ВОРКЕР ====================
+
+class ShardWorker:
+    """
+    Процесс-воркер: апдейты из stdin в Dispatcher
+
+    Апдейты одного пользователя - по очереди, разных - параллельно
+    (не больше concurrency одновременно). EOF в stdin - дообработать
+    начатое и выйти.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, concurrency: int = 64, queue_size: int = 1000):
+        self.bot = bot
+        self.dp = dp
+        self.queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(maxsize=queue_size)
+        self._limit = asyncio.Semaphore(concurrency)
+        # user_id -> апдейты, ждущие своей очереди (есть ключ - задача пользователя работает)
+        self._users: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._data: Dict[str, Any] = {}
+
+    def _read_stdin(self, loop: asyncio.AbstractEventLoop):
+        """Поток чтения stdin: очередь полна - не читаем, труба у супервизора заполняется"""
+        for line in sys.stdin.buffer:
+            asyncio.run_coroutine_threadsafe(self.queue.put(line), loop).result()
+        asyncio.run_coroutine_threadsafe(self.queue.put(None), loop).result()
+
+    async def _run_user(self, user_id: int, pending: Deque[Dict[str, Any]]):
+        try:
+            while pending:
+                update = pending.popleft()
+                async with self._limit:
+                    try:
+                        await feed_raw_update(self.bot, self.dp, update, self._data)
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            del self._users[user_id]
+            if not self._users:
+                self._idle.set()
+
+    async def serve(self):
+        """Обрабатывать апдейты, пока супервизор не закроет stdin"""
+        # Ctrl+C и SIGTERM приходят всей группе процессов - воркер
+        # останавливается только по EOF от супервизора, дообработав очередь
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+        loop = asyncio.get_running_loop()
+        self._data = workflow_data(self.bot, self.dp)
+        await self.dp.emit_startup(bot=self.bot, **self._data)
+        threading.Thread(target=self._read_stdin, args=(loop,), name="stdin", daemon=True).start()
+        try:
+            while True:
+                line = await self.queue.get()
+                if line is None:
+                    break
+                try:
+                    update = json.loads(line)
+                except ValueError as e:
+                    logger.error(f"❌ Неверная строка от супервизора: {e}")
+                    continue
+                user_id = update_user_id(update)
+                pending = self._users.get(user_id)
+                if pending is None:
+                    pending = self._users[user_id] = deque()
+                    self._idle.clear()
+                    asyncio.create_task(self._run_user(user_id, pending))
+                pending.append(update)
+            await self._idle.wait()
+        finally:
+            await self.dp.emit_shutdown(bot=self.bot, **self._data)
+
+
+# ==================== ЛЕНТА ИЗМЕНЕНИЙ ====================
+
+class ChangeFeedFollower:
+    """
+    Изменения из других процессов -> подписчики Database этого процесса
+
+    Кэш (DataCache) и планировщик истечений подписаны на изменения БД,
+    но Database сообщает только о своих. Процессы пишут изменения
+    в change_feed (db.enable_change_feed()), а этот цикл читает чужие.
+    """
+
+    def __init__(self, database, interval: float = FEED_INTERVAL):
+        self.database = database
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.database.enable_change_feed()
+        position = await adb.run(self.database.get_change_feed_position)
+        self._task = asyncio.create_task(self._run(position))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, position: int):
+        from utils.cache import data_cache
+        from utils.expiry import expiry_scheduler
+
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                position, gap = await adb.run(self.database.follow_change_feed, position)
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения change_feed: {e}")
+                continue
+            if gap:
+                logger.warning("⚠️ change_feed: часть изменений уже удалена, кэш сброшен целиком")
+                data_cache.invalidate()
+                if expiry_scheduler.running:
+                    await expiry_scheduler.resync()
@@ -1,19 +1,56 @@
+import asyncio
 import json
+import logging
 import os
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Set, Tuple
 from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
 
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class JSONStorage(BaseStorage):
-    """Простое файловое хранилище для FSM состояний"""
+    """
+    Простое файловое хранилище для FSM состояний
+
+    Режим журнала (journal=True, по умолчанию):
+    - Изменения копятся в памяти и сбрасываются не чаще раза в debounce
+      секунд: несколько set_state/update_data за одно сообщение дают
+      одну запись на пользователя
+    - Запись - строка в конец файла <file_path>.journal (только
+      изменившиеся пользователи, а не весь файл)
+    - Когда в журнале набирается compact_every записей, он сворачивается
+      в основной файл: запись во временный файл + атомарный os.replace
+
+    journal=False - старое поведение (весь файл), но тоже с debounce
+    и атомарной записью.
+    """
     
-    def __init__(self, file_path: str = "fsm_storage.json"):
+    def __init__(self, file_path: str = "fsm_storage.json", journal: bool = True,
+                 debounce: float = 0.5, compact_every: int = 1000):
+        """
+        Args:
+            file_path: Основной файл (снимок всех состояний)
+            journal: Дописывать изменения в журнал вместо перезаписи файла
+            debounce: Окно объединения изменений в секундах (0 - писать сразу)
+            compact_every: После скольких записей журнала сворачивать его в снимок
+        """
         self.file_path = file_path
+        self.journal_path = f"{file_path}.journal"
+        self.journal = journal
+        self.debounce = debounce
+        self.compact_every = compact_every
         self._data: Dict[str, Dict[str, Any]] = {}
+        self._dirty: Set[str] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._journal_records = 0
         self._load()
     
     def _load(self):
-        """Загрузка данных из файла"""
+        """Загрузка снимка из файла и применение журнала поверх него"""
         if os.path.exists(self.file_path):
             try:
                 with open(self.file_path, 'r', encoding='utf-8') as f:
@@ -23,14 +60,89 @@ class JSONStorage(BaseStorage):
                 self._data = {}
         else:
             print("ℹ️ Файл FSM storage не найден, создаём новый")
+
+        if os.path.exists(self.journal_path):
+            self._replay_journal()
+
+    def _replay_journal(self):
+        """Применить записи журнала (последняя запись по ключу побеждает)"""
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Недописанная строка (падение посреди записи) - пропускаем
+                        continue
+                    self._data[record['k']] = record['v']
+                    self._journal_records += 1
+        except Exception as e:
+            print(f"⚠️ Ошибка чтения журнала FSM storage: {e}")
+
+        # Журнал от прошлого запуска сразу сворачиваем в снимок и удаляем -
+        # и при journal=False, иначе он применялся бы при каждом старте
+        self._compact()
+
+    def _write_snapshot(self):
+        """Атомарная запись всего снимка: временный файл + os.replace"""
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+
+    def _compact(self):
+        """Свернуть журнал в основной файл"""
+        try:
+            self._write_snapshot()
+            # Снимок уже содержит всё из журнала - журнал можно удалить
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._journal_records = 0
+        except Exception as e:
+            print(f"⚠️ Ошибка сжатия журнала FSM storage: {e}")
+
+    def _append_journal(self, keys: Set[str]):
+        """Дописать в журнал текущие записи изменившихся пользователей"""
+        lines = [
+            json.dumps({'k': key, 'v': self._data.get(key, {})},
+                       ensure_ascii=False, separators=(',', ':'))
+            for key in keys
+        ]
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        self._journal_records += len(lines)
+        if self._journal_records >= self.compact_every:
+            self._compact()
     
     def _save(self):
-        """Сохранение данных в файл"""
+        """Сохранение накопленных изменений в файл"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
         try:
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            if self.journal:
+                self._append_journal(dirty)
+            else:
+                self._write_snapshot()
         except Exception as e:
+            # Не потеряем изменения: попробуем при следующем сохранении
+            self._dirty |= dirty
             print(f"⚠️ Ошибка сохранения FSM storage: {e}")
+
+    def _mark_dirty(self, storage_key: str):
+        """Запомнить изменение и запланировать отложенное сохранение"""
+        self._dirty.add(storage_key)
+        if self.debounce <= 0:
+            self._save()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.debounce, self._save)
     
     def _make_key(self, key: StorageKey) -> str:
         """Создание уникального ключа пользователя"""
@@ -49,7 +161,7 @@ class JSONStorage(BaseStorage):
             # Преобразуем State в строку (формат: "ModuleName:StateName")
             self._data[storage_key]['state'] = state.state if hasattr(state, 'state') else str(state)
         
-        self._save()
+        self._mark_dirty(storage_key)
     
     async def get_state(self, key: StorageKey) -> Optional[str]:
         """Получение состояния пользователя"""
@@ -62,14 +174,14 @@ class JSONStorage(BaseStorage):
         if storage_key not in self._data:
             self._data[storage_key] = {}
         self._data[storage_key]['data'] = data
-        self._save()
+        self._mark_dirty(storage_key)
     
     async def get_data(self, key: StorageKey) -> Dict[str, Any]:
         """Получение данных пользователя"""
         storage_key = self._make_key(key)
         return self._data.get(storage_key, {}).get('data', {})
     
-    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
         """Обновление данных пользователя"""
         storage_key = self._make_key(key)
         if storage_key not in self._data:
@@ -77,9 +189,158 @@ class JSONStorage(BaseStorage):
         if 'data' not in self._data[storage_key]:
             self._data[storage_key]['data'] = {}
         self._data[storage_key]['data'].update(data)
-        self._save()
+        self._mark_dirty(storage_key)
+        return self._data[storage_key]['data'].copy()
     
     async def close(self) -> None:
         """Закрытие хранилища и сохранение данных"""
         self._save()
+        if self.journal:
+            self._compact()
         print("✅ FSM storage сохранён и закрыт")
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM хранилище в таблице fsm_storage базы bot_data.db
+
+    - Переживает перезапуск бота (в отличие от MemoryStorage)
+    - Горячие ключи живут в памяти: чтение и запись - O(1) без БД
+    - Write-behind: изменения копятся и раз в flush_interval секунд
+      уходят в БД одной транзакцией через поток БД (adb)
+    - В памяти держится не больше max_keys ключей, вытесняются самые
+      давние уже сохранённые; промах - один запрос по первичному ключу
+      (bot_id, chat_id, user_id)
+    """
+
+    def __init__(self, database=None, flush_interval: float = 1.0, max_keys: int = 10000):
+        """
+        Args:
+            database: AsyncDatabase (по умолчанию глобальный adb)
+            flush_interval: Окно накопления изменений в секундах
+            max_keys: Сколько ключей держать в памяти
+        """
+        if database is None:
+            from utils.async_database import adb
+            database = adb
+        self.db = database
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        # (bot_id, chat_id, user_id) -> {"state": ..., "data": {...}}
+        self._records: "OrderedDict[Tuple[int, int, int], Dict[str, Any]]" = OrderedDict()
+        self._dirty: Set[Tuple[int, int, int]] = set()
+        # Ключи, которые сейчас пишутся в БД: вытеснять их нельзя
+        # (при ошибке записи они вернутся в _dirty)
+        self._flushing: Set[Tuple[int, int, int]] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _make_key(self, key: StorageKey) -> Tuple[int, int, int]:
+        """Ключ записи (как индекс таблицы)"""
+        return (key.bot_id, key.chat_id, key.user_id)
+
+    async def _get_record(self, key: StorageKey) -> Dict[str, Any]:
+        """Запись из памяти, при промахе - из БД"""
+        storage_key = self._make_key(key)
+        record = self._records.get(storage_key)
+        if record is not None:
+            self._records.move_to_end(storage_key)
+            return record
+
+        loaded = await self.db.get_fsm_record(*storage_key)
+        # Пока ждали БД, запись могла появиться из другого обработчика
+        record = self._records.get(storage_key)
+        if record is None:
+            record = loaded or {"state": None, "data": {}}
+            self._evict()
+            self._records[storage_key] = record
+        return record
+
+    def _evict(self):
+        """Вытеснить давно не использованные сохранённые ключи"""
+        # Место под новый ключ освобождаем до его добавления
+        excess = len(self._records) + 1 - self.max_keys
+        # Берём с начала (самые давние) без копирования ключей; несохранённые
+        # переносим в конец - следующий промах их уже не перебирает
+        for _ in range(len(self._records)):
+            if excess <= 0:
+                break
+            storage_key, record = self._records.popitem(last=False)
+            if storage_key in self._dirty or storage_key in self._flushing:
+                self._records[storage_key] = record
+            else:
+                excess -= 1
+
+    def _mark_dirty(self, key: StorageKey):
+        """Запомнить изменение и запланировать запись в БД"""
+        self._dirty.add(self._make_key(key))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения в БД"""
+        # По одному сбросу за раз (close() дождётся идущего)
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            self._flushing = dirty
+            try:
+                # Сериализуем здесь: поток БД получает неизменяемые строки
+                rows = []
+                for storage_key in dirty:
+                    record = self._records[storage_key]
+                    data = record["data"]
+                    rows.append((
+                        *storage_key,
+                        record["state"],
+                        json.dumps(data, ensure_ascii=False) if data else None
+                    ))
+                started = time.perf_counter()
+                await self.db.save_fsm_records(rows)
+                metrics.fsm_flush_seconds.labels().observe(time.perf_counter() - started)
+                metrics.fsm_flush_rows.labels().inc(len(rows))
+            except Exception as e:
+                # Вернём ключи в очередь - запишем при следующем сбросе
+                self._dirty |= dirty
+                logger.error(f"❌ Ошибка сохранения FSM в БД: {e}")
+            finally:
+                self._flushing = set()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """Установка состояния пользователя"""
+        record = await self._get_record(key)
+        if state is None:
+            record["state"] = None
+        else:
+            record["state"] = state.state if hasattr(state, 'state') else str(state)
+        self._mark_dirty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """Получение состояния пользователя"""
+        return (await self._get_record(key))["state"]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """Сохранение данных пользователя"""
+        record = await self._get_record(key)
+        record["data"] = dict(data)
+        self._mark_dirty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """Получение данных пользователя"""
+        return (await self._get_record(key))["data"].copy()
+
+    async def close(self) -> None:
+        """Сохранить всё несохранённое (при остановке бота)"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        logger.info("✅ FSM storage (SQLite) сохранён и закрыт")
@@ -0,0 +1,256 @@
+# Файл: utils/tracing.py
+# -*- coding: utf-8 -*-
+
+"""
+Трейсы апдейтов: куда ушло время обработки
+
+На каждый апдейт - один span (middlewares/tracing.py): сколько заняли
+VersionCheck, RateLimit и обработчик, какие вызовы БД были сделаны
+(имя функции, время, число SQL-запросов) и какие запросы к Bot API.
+Запросы SQL считаются через sqlite3.set_trace_callback на соединениях
+Database, вызовы adb.run() попадают в span того апдейта, из которого
+сделаны. Для медленных апдейтов добавляются самые частые запросы.
+
+Span пишется одной строкой JSON в ротируемый файл (TRACE_FILE) из
+отдельного потока - event loop не ждёт диска:
+
+    {"update_id": 7, "handler": "gruppenrun.gruppenrun_register", "ms": 182.4,
+     "db": {"calls": 2, "queries": 412, "ms": 180.1},
+     "db_calls": [{"name": "load_data", "ms": 178.9, "queries": 410}], ...}
+
+Смотреть медленные: jq 'select(.ms > 100)' traces.ndjson
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ротация файла трейсов
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+# Начиная с какой длительности в span попадают самые частые SQL-запросы
+SLOW_SPAN_MS = 100.0
+TOP_STATEMENTS = 5
+# Сколько символов запроса учитывать (длинные IN (...) обрезаются)
+STATEMENT_CHARS = 300
+# Вызовов БД и Bot API в одном span не больше (остальные только считаются)
+MAX_CALLS = 50
+
+# Trace callback получает запрос с подставленными параметрами - в файл
+# трейсов не должны попасть имена и телефоны, а одинаковые запросы
+# с разными параметрами должны считаться вместе
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """Запрос без значений параметров: литералы заменены на ?"""
+    return _SPACES.sub(" ", _LITERALS.sub("?", statement)).strip()
+
+
+class Span:
+    """Трейс одного апдейта"""
+    __slots__ = ("update_id", "type", "user_id", "started", "wall", "stages", "handler",
+                 "outcome", "error", "db_calls", "db_queries", "db_ms", "loop_queries",
+                 "statements", "api_calls", "api_ms", "api")
+
+    def __init__(self, update_id: int, update_type: str, user_id: Optional[int]):
+        self.update_id = update_id
+        self.type = update_type
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.stages: Dict[str, float] = {}
+        self.handler: Optional[str] = None
+        self.outcome = "stopped"
+        self.error: Optional[str] = None
+        self.db_calls: List[dict] = []
+        self.db_queries = 0
+        self.db_ms = 0.0
+        # SQL прямо из event loop (синхронный db.* в обработчике - блокирует бота)
+        self.loop_queries = 0
+        self.statements: Counter = Counter()
+        self.api_calls = 0
+        self.api_ms = 0.0
+        self.api: List[dict] = []
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds * 1000
+
+    def add_api_call(self, method: str, seconds: float, error: str = None):
+        self.api_calls += 1
+        self.api_ms += seconds * 1000
+        if len(self.api) < MAX_CALLS:
+            call = {"method": method, "ms": round(seconds * 1000, 2)}
+            if error:
+                call["error"] = error
+            self.api.append(call)
+
+    def _stages(self, total_ms: float) -> Dict[str, float]:
+        stages = {name: round(ms, 2) for name, ms in self.stages.items()}
+        # Остальное: роутинг и фильтры, FSM, ожидание своей очереди в event loop
+        stages["dispatch"] = round(max(total_ms - sum(self.stages.values()), 0.0), 2)
+        return stages
+
+    def to_dict(self, total_ms: float) -> Dict[str, Any]:
+        record = {
+            "ts": datetime.fromtimestamp(self.wall).isoformat(timespec="milliseconds"),
+            "update_id": self.update_id,
+            "type": self.type,
+            "user_id": self.user_id,
+            "handler": self.handler,
+            "outcome": self.outcome,
+            "ms": round(total_ms, 2),
+            "stages": self._stages(total_ms),
+            "db": {"calls": len(self.db_calls), "queries": self.db_queries, "ms": round(self.db_ms, 2)},
+            "db_calls": self.db_calls[:MAX_CALLS],
+            "api": {"calls": self.api_calls, "ms": round(self.api_ms, 2)},
+            "api_calls": self.api,
+        }
+        if self.loop_queries:
+            record["db"]["loop_queries"] = self.loop_queries
+        if self.error:
+            record["error"] = self.error
+        if total_ms >= SLOW_SPAN_MS and self.statements:
+            shapes: Counter = Counter()
+            for statement, count in self.statements.items():
+                shapes[normalize_sql(statement)] += count
+            record["sql_top"] = [
+                {"sql": sql, "count": count} for sql, count in shapes.most_common(TOP_STATEMENTS)
+            ]
+        return record
+
+
+class _DbCall:
+    """Один вызов adb.run() внутри span (в потоке БД)"""
+    __slots__ = ("span", "queries")
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.queries = 0
+
+
+# Span апдейта, который сейчас обрабатывается (в задаче aiogram)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    """
+    Запись span-ов в NDJSON
+
+        tracer.enable("traces.ndjson", database=db)  # при старте бота
+        tracer.close()                                # при остановке
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._records: Optional[queue.SimpleQueue] = None
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._database = None
+        # Вызов БД, который сейчас выполняется в потоке (поток БД один,
+        # вызовы идут по одному)
+        self._local = threading.local()
+
+    def enable(self, path: str, database=None, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+        """Начать писать трейсы в path (ротация по max_bytes)"""
+        if self.enabled:
+            return
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        # Диск - в потоке QueueListener, а не в event loop. Записи кладутся
+        # в очередь напрямую, мимо логгеров: уровни и logging.disable()
+        # на трейсы не влияют
+        self._records = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(self._records, handler)
+        self._listener.start()
+
+        if database is not None:
+            self._database = database
+            database.add_trace_callback(self._on_statement)
+        self.enabled = True
+        logger.info(f"🔎 Трейсы апдейтов пишутся в {path}")
+
+    def close(self):
+        """Дописать очередь и закрыть файл"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._database is not None:
+            self._database.remove_trace_callback(self._on_statement)
+            self._database = None
+        if self._listener is not None:
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+        self._records = None
+
+    # ==================== SPAN ====================
+
+    def start_span(self, update_id: int, update_type: str, user_id: Optional[int]):
+        """Открыть span апдейта; возвращает (span, токен для finish_span)"""
+        span = Span(update_id, update_type, user_id)
+        return span, _current_span.set(span)
+
+    def finish_span(self, span: Span, token):
+        _current_span.reset(token)
+        total_ms = (time.perf_counter() - span.started) * 1000
+        try:
+            line = json.dumps(span.to_dict(total_ms), ensure_ascii=False, separators=(",", ":"))
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ Не удалось записать трейс апдейта {span.update_id}: {e}")
+            return
+        records = self._records
+        if records is not None:
+            records.put_nowait(logging.makeLogRecord({"msg": line, "levelno": logging.INFO}))
+
+    # ==================== БД ====================
+
+    def run_db_call(self, span: Span, name: str, call: Callable[[], Any]) -> Any:
+        """Выполнить call() в потоке БД с учётом в span (вызывается из adb.run)"""
+        record = _DbCall(span)
+        self._local.call = record
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.call = None
+            span.db_queries += record.queries
+            span.db_ms += elapsed * 1000
+            span.db_calls.append({"name": name, "ms": round(elapsed * 1000, 2), "queries": record.queries})
+
+    def _on_statement(self, statement: str):
+        """sqlite3 trace callback: вызывается на каждый выполненный запрос"""
+        call = getattr(self._local, "call", None)
+        if call is not None:
+            span = call.span
+            call.queries += 1
+        else:
+            # Не из adb.run(): либо из event loop внутри апдейта, либо фоновая работа
+            span = _current_span.get()
+            if span is None:
+                return
+            span.loop_queries += 1
+            span.db_queries += 1
+        span.statements[statement[:STATEMENT_CHARS]] += 1
+
+
+# Глобальный экземпляр
+tracer = Tracer()
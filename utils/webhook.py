@@ -0,0 +1,195 @@
+# Файл: utils/webhook.py
+# -*- coding: utf-8 -*-
+
+"""
+Приём апдейтов через webhook (вместо long polling)
+
+Telegram сам присылает апдейты POST-запросом на WEBHOOK_URL. Перед ботом
+стоит reverse proxy с TLS (nginx/caddy), сам бот слушает локальный
+порт (WEBHOOK_HOST:WEBHOOK_PORT) на маленьком aiohttp-приложении:
+
+  - запрос без правильного X-Telegram-Bot-Api-Secret-Token - 401
+  - апдейт кладётся в ограниченную очередь и сразу отвечаем 200:
+    Telegram не ждёт обработчиков
+  - очередь полна - 503, и Telegram повторит апдейт позже
+  - апдейты из очереди разбирают WEBHOOK_WORKERS задач и передают
+    в тот же Dispatcher (dp.feed_update), что и polling, - или в handler,
+    если он задан (супервизор с BOT_WORKERS > 1 раздаёт их воркерам)
+
+    server = WebhookServer(bot, dp, url=WEBHOOK_URL, secret=WEBHOOK_SECRET)
+    await server.serve(WEBHOOK_HOST, WEBHOOK_PORT)  # до SIGINT/SIGTERM
+"""
+
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Сколько ждать обработки оставшихся в очереди апдейтов при остановке (секунд)
+DRAIN_TIMEOUT = 30.0
+
+
+def workflow_data(bot: Bot, dp: Dispatcher) -> Dict[str, Any]:
+    """Данные для обработчиков - те же, что передаёт dp.start_polling"""
+    data = {"dispatcher": dp, "bots": [bot], **dp.workflow_data}
+    data.pop("bot", None)
+    return data
+
+
+async def feed_raw_update(bot: Bot, dp: Dispatcher, raw: Dict[str, Any], data: Dict[str, Any]):
+    """Апдейт из JSON в Dispatcher - как в polling"""
+    update = Update.model_validate(raw, context={"bot": bot})
+    response = await dp.feed_update(bot, update, **data)
+    # Метод, возвращённый обработчиком, отправляем сами (ответ на webhook уже ушёл)
+    if isinstance(response, TelegramMethod):
+        await dp.silent_call_request(bot=bot, result=response)
+
+
+def install_stop_signals(callback: Callable[[], None]):
+    """SIGINT/SIGTERM -> callback() (вместо KeyboardInterrupt посреди обработки)"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, callback)
+        except (NotImplementedError, RuntimeError):
+            # Windows: остановка через KeyboardInterrupt
+            pass
+
+
+class WebhookServer:
+    """aiohttp-приёмник webhook: проверка секрета, очередь, воркеры Dispatcher"""
+
+    def __init__(self, bot: Bot, dp: Dispatcher, url: str, secret: str = "",
+                 queue_size: int = 1000, workers: int = 32, max_connections: int = 40,
+                 handler: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        """
+        Args:
+            url: Публичный адрес webhook (https://...); путь из него слушается локально
+            secret: Секрет для Telegram (пусто - случайный на каждый запуск)
+            queue_size: Сколько апдейтов может ждать обработки
+            workers: Сколько апдейтов обрабатывается одновременно
+            max_connections: Сколько одновременных запросов разрешить Telegram
+            handler: handler(update) вместо передачи в dp (dp - только allowed_updates)
+        """
+        self.bot = bot
+        self.dp = dp
+        self.url = url
+        self.path = urlsplit(url).path or "/webhook"
+        # set_webhook вызывается при каждом запуске - случайный секрет тоже годится
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.workers = workers
+        self.max_connections = max_connections
+        self.handler = handler
+        self.queue: "asyncio.Queue[Tuple[float, Dict[str, Any]]]" = asyncio.Queue(maxsize=queue_size)
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopped = asyncio.Event()
+        self._workflow_data: Dict[str, Any] = {}
+        self._wait_seconds = metrics.webhook_wait_seconds.labels()
+        metrics.add_collector(lambda: metrics.webhook_queue.labels().set(self.queue.qsize()))
+
+    # ==================== ПРИЁМ ====================
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            metrics.webhook_requests.labels("forbidden").inc()
+            logger.warning(f"🚫 Webhook: запрос без верного секрета от {request.remote}")
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            metrics.webhook_requests.labels("bad_request").inc()
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((time.perf_counter(), update))
+        except asyncio.QueueFull:
+            # Telegram повторит доставку - апдейт не потеряется
+            metrics.webhook_requests.labels("queue_full").inc()
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        metrics.webhook_requests.labels("accepted").inc()
+        return web.Response()
+
+    # ==================== ОБРАБОТКА ====================
+
+    async def _worker(self):
+        while True:
+            received, raw = await self.queue.get()
+            try:
+                self._wait_seconds.observe(time.perf_counter() - received)
+                if self.handler is not None:
+                    await self.handler(raw)
+                else:
+                    await feed_raw_update(self.bot, self.dp, raw, self._workflow_data)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта из webhook: {e}")
+            finally:
+                self.queue.task_done()
+
+    # ==================== ЗАПУСК ====================
+
+    async def start(self, host: str, port: int):
+        """Начать принимать апдейты и зарегистрировать webhook в Telegram"""
+        self._workflow_data = workflow_data(self.bot, self.dp)
+        if self.handler is None:
+            await self.dp.emit_startup(bot=self.bot, **self._workflow_data)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+        await self.bot.set_webhook(
+            self.url,
+            secret_token=self.secret,
+            allowed_updates=self.dp.resolve_used_update_types(),
+            max_connections=self.max_connections,
+        )
+        logger.info(f"🌐 Webhook {self.url} -> {host}:{port}{self.path}")
+
+    def stop(self):
+        self._stopped.set()
+
+    async def close(self):
+        """Перестать принимать, дообработать очередь, остановить воркеры"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        # Webhook в Telegram не удаляем: пока бот перезапускается,
+        # апдейты копятся у Telegram и придут после старта
+        try:
+            await asyncio.wait_for(self.queue.join(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Webhook: не дообработано апдейтов: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.handler is None:
+            await self.dp.emit_shutdown(bot=self.bot, **self._workflow_data)
+
+    async def serve(self, host: str, port: int):
+        """start() и работа до SIGINT/SIGTERM (или stop()), затем close()"""
+        install_stop_signals(self.stop)
+        await self.start(host, port)
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
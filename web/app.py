@@ -1,108 +1,97 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+import glob
 import os
-import sqlite3
+import time
+
+from web.config import METRICS_FILE, METRICS_MAX_AGE
+from web.db import pool
+from web.routes import router
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    pool.close()
 
-app = FastAPI(title="Gruppen Run Bot API")
+
+app = FastAPI(title="Gruppen Run Bot API", lifespan=lifespan)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
 WEB_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATES_DIR = os.path.join(WEB_DIR, "templates")
 STATIC_DIR = os.path.join(WEB_DIR, "static")
-DB_PATH = "/root/gruppenrun_bot/bot_data.db"
 
 if os.path.exists(STATIC_DIR):
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# API: /api/status, /api/stats, /api/users, /api/users/export, /api/events
+app.include_router(router)
+
+# ==================== ЭНДПОИНТЫ ====================
 
 @app.get("/")
 async def root():
     return FileResponse(os.path.join(TEMPLATES_DIR, "index.html"))
 
-@app.get("/api/status")
-async def status():
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Всего пользователей
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        users = cursor.fetchone()['count']
-        
-        # Активных за 7 дней
-        cursor.execute("""
-            SELECT COUNT(DISTINCT user_id) as count 
-            FROM event_tracking 
-            WHERE created_at >= datetime('now', '-7 days')
-        """)
-        active = cursor.fetchone()['count']
-        
-        # Всего регистраций
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM (
-                SELECT user_id FROM gruppenrun_registrations
-                UNION ALL
-                SELECT user_id FROM iremel_registrations
-                UNION ALL
-                SELECT user_id FROM krugosvetka_registrations
-            )
-        """)
-        regs = cursor.fetchone()['count']
-        
-        conn.close()
-        return {
-            "is_running": True,
-            "users_count": users,
-            "active_users": active,
-            "registrations": regs
-        }
-    except Exception as e:
-        print(f"Error: {e}")
-        return {"is_running": True, "users_count": 0, "active_users": 0, "registrations": 0}
+# Файлы процессов старше этого не показываем (воркеры прошлых запусков)
+METRICS_FORGET_AFTER = 3600
+
+def _metrics_files():
+    """METRICS_FILE и файлы процессов (bot_metrics.worker1.prom, ...): (процесс, путь)"""
+    root, ext = os.path.splitext(METRICS_FILE)
+    files = [("bot", METRICS_FILE)] if os.path.exists(METRICS_FILE) else []
+    for path in sorted(glob.glob(f"{glob.escape(root)}.*{ext}")):
+        files.append((path[len(root) + 1:len(path) - len(ext)], path))
+    return files
 
-@app.get("/api/stats")
-async def stats():
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) as count FROM gruppenrun_registrations")
-        grupp = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT COUNT(*) as count FROM iremel_registrations WHERE is_registered = 1")
-        iremel = cursor.fetchone()['count']
-        
-        conn.close()
-        return {
-            "gruppenrun_registrations": grupp,
-            "iremel_registrations": iremel
-        }
-    except:
-        return {"gruppenrun_registrations": 0, "iremel_registrations": 0}
+def _merge_metrics(texts):
+    """Несколько выгрузок в одну: HELP/TYPE каждой метрики - один раз"""
+    families = {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith("# HELP "):
+                name = line.split(" ", 3)[2]
+                if name not in families:
+                    families[name] = [line]
+            elif line.startswith("# TYPE "):
+                if len(families[name]) == 1:
+                    families[name].append(line)
+            elif line and name is not None:
+                families[name].append(line)
+    return "".join("\n".join(lines) + "\n" for lines in families.values())
 
-@app.get("/api/users")
-async def users():
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_id, name, username 
-            FROM users 
-            ORDER BY created_at DESC 
-            LIMIT 50
-        """)
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {"user_id": r['user_id'], "first_name": r['name'] or "—", "username": r['username'] or "unknown"}
-            for r in rows
-        ]
-    except:
-        return []
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Метрики бота для Prometheus (файлы пишут процессы бота) + свежесть этих файлов"""
+    texts, up, ages = [], [], []
+    now = time.time()
+    for process, path in _metrics_files():
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            age = max(now - os.stat(path).st_mtime, 0.0)
+        except OSError:
+            continue
+        if process != "bot" and age > METRICS_FORGET_AFTER:
+            continue
+        texts.append(text)
+        up.append(f'gruppenrun_bot_up{{process="{process}"}} {1 if age <= METRICS_MAX_AGE else 0}')
+        ages.append(f'gruppenrun_bot_metrics_age_seconds{{process="{process}"}} {age:.3f}')
+    if not up:
+        up.append("gruppenrun_bot_up 0")
+    texts.append(
+        "# HELP gruppenrun_bot_up Бот пишет метрики (файл не старше METRICS_MAX_AGE)\n"
+        "# TYPE gruppenrun_bot_up gauge\n" + "\n".join(up) + "\n"
+    )
+    if ages:
+        texts.append(
+            "# HELP gruppenrun_bot_metrics_age_seconds Сколько секунд назад бот записал метрики\n"
+            "# TYPE gruppenrun_bot_metrics_age_seconds gauge\n" + "\n".join(ages) + "\n"
+        )
+    return PlainTextResponse(_merge_metrics(texts), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -4,6 +4,12 @@ from pathlib import Path
 # === PATHS ===
 BASE_DIR = Path(__file__).resolve().parent.parent
 DATABASE_URL = "sqlite:///./gruppenrun_bot.db"
+# БД бота (веб только читает); по умолчанию - bot_data.db в корне проекта
+DB_PATH = os.getenv("DB_PATH", str(BASE_DIR / "bot_data.db"))
+# Метрики, которые пишет бот (utils/metrics.py) - отдаются на /metrics
+METRICS_FILE = os.getenv("METRICS_FILE", str(BASE_DIR / "bot_metrics.prom"))
+# Старше - бот считается не работающим (gruppenrun_bot_up 0)
+METRICS_MAX_AGE = float(os.getenv("METRICS_MAX_AGE", 30))
 
 # === SERVER ===
 SERVER_HOST = os.getenv("WEB_HOST", "0.0.0.0")
@@ -0,0 +1,137 @@
+"""
+Доступ веб-панели к bot_data.db
+
+Только чтение: соединения открываются с mode=ro (веб не может ничего
+испортить в БД бота) и живут по одному на поток небольшого пула.
+Запросы выполняются в этом пуле, а не в event loop FastAPI.
+
+Ответы API кэшируются на несколько секунд (ResponseCache): панель
+опрашивает API постоянно, а считать одно и то же на каждый запрос
+незачем. Ответ отдаётся с ETag, и если у браузера та же версия -
+возвращается 304 без тела.
+"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from fastapi import Request, Response
+
+from web.config import DB_PATH
+
+# Потоков для запросов (и соединений - по одному на поток)
+POOL_SIZE = 4
+MMAP_SIZE = 64 * 1024 * 1024
+BUSY_TIMEOUT = 5.0
+
+
+class ReadOnlyPool:
+    """Соединения mode=ro, по одному на поток пула"""
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE):
+        self.uri = f"{Path(path).resolve().as_uri()}?mode=ro"
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="web-db")
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=1")
+            conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self._local.conn = conn
+        return conn
+
+    def _call(self, func: Callable[..., Any], args, kwargs) -> Any:
+        try:
+            return func(self._connection(), *args, **kwargs)
+        except sqlite3.OperationalError:
+            # БД могли пересоздать/переместить - в следующий раз откроем заново
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+                self._local.conn = None
+            raise
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Выполнить func(conn, *args, **kwargs) в потоке пула"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._call, func, args, kwargs)
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class ResponseCache:
+    """
+    JSON-ответы с коротким TTL и ETag
+
+    Одновременные запросы с одним ключом ждут одного вычисления.
+    """
+
+    def __init__(self, ttl: float = 5.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[bytes, str, float]] = {}  # key -> (тело, etag, истекает)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def _get(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float) -> Tuple[bytes, str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            return entry[0], entry[1]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            body = json.dumps(await loader(), ensure_ascii=False, separators=(",", ":")).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            self._store(key, body, etag, ttl)
+            future.set_result((body, etag))
+            return body, etag
+        except BaseException as e:
+            future.set_exception(e)
+            # Исключение уже передано ожидающим - не шумим «never retrieved»
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _store(self, key: str, body: bytes, etag: str, ttl: float):
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            # Сначала выкидываем истёкшие, если не помогло - самые старые
+            for old_key in [k for k, e in self._entries.items() if e[2] <= now]:
+                del self._entries[old_key]
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+        self._entries[key] = (body, etag, now + ttl)
+
+    async def respond(self, request: Request, loader: Callable[[], Awaitable[Any]],
+                      ttl: float = None) -> Response:
+        """Ответ на запрос: из кэша, 304 по If-None-Match или свежий"""
+        key = request.url.path + ("?" + request.url.query if request.url.query else "")
+        body, etag = await self._get(key, loader, self.ttl if ttl is None else ttl)
+        # no-cache: браузер всегда спрашивает, но с If-None-Match получает 304
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Глобальные экземпляры
+pool = ReadOnlyPool()
+response_cache = ResponseCache()
@@ -1,52 +1,230 @@
-from fastapi import APIRouter, HTTPException
+import base64
+import json
+from typing import AsyncIterator, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List
+
+from web.db import pool, response_cache
 
 # === ROUTER ===
 router = APIRouter(prefix="/api", tags=["Bot Management"])
 
+# Строк на страницу при выгрузке (export)
+EXPORT_PAGE_SIZE = 500
+
 # === MODELS ===
 class BotStatus(BaseModel):
     is_running: bool
     users_count: int
-    last_update: str
+    active_users: int
+    registrations: int
 
 class UserInfo(BaseModel):
-    user_id: int
+    user_id: str
     username: str
     first_name: str
-    is_active: bool
+    bot_version: Optional[str] = None
+    created_at: Optional[str] = None
 
-# === ENDPOINTS ===
+class UsersPage(BaseModel):
+    items: List[UserInfo]
+    next_cursor: Optional[str] = None
+
+class EventDay(BaseModel):
+    day: str
+    event: str
+    events: int
+    users: int
+
+# === ЗАПРОСЫ (выполняются в пуле web.db) ===
+
+def _status(conn):
+    # Всего пользователей
+    users = conn.execute("SELECT COUNT(*) as count FROM users").fetchone()['count']
+
+    # Активных за 7 дней (диапазон по индексу event_tracking(created_at, user_id))
+    active = conn.execute("""
+        SELECT COUNT(DISTINCT user_id) as count
+        FROM event_tracking
+        WHERE created_at >= datetime('now', '-7 days')
+    """).fetchone()['count']
+
+    # Всего регистраций: три COUNT(*) вместо UNION ALL - строки не собираются
+    regs = conn.execute("""
+        SELECT (SELECT COUNT(*) FROM gruppenrun_registrations)
+             + (SELECT COUNT(*) FROM iremel_registrations)
+             + (SELECT COUNT(*) FROM krugosvetka_registrations) as count
+    """).fetchone()['count']
 
-@router.get("/status", response_model=BotStatus)
-async def get_bot_status():
-    """Получить статус бота"""
     return {
         "is_running": True,
-        "users_count": 42,
-        "last_update": "2025-11-04T20:38:00"
+        "users_count": users,
+        "active_users": active,
+        "registrations": regs
+    }
+
+def _stats(conn):
+    grupp = conn.execute("SELECT COUNT(*) as count FROM gruppenrun_registrations").fetchone()['count']
+    iremel = conn.execute(
+        "SELECT COUNT(*) as count FROM iremel_registrations WHERE is_registered = 1"
+    ).fetchone()['count']
+    return {
+        "gruppenrun_registrations": grupp,
+        "iremel_registrations": iremel
     }
 
-@router.get("/users", response_model=List[UserInfo])
-async def get_users():
-    """Получить список пользователей"""
+# Фильтры списка пользователей; параметр None - фильтр выключен.
+# event - пользователи с таким событием (в пределах срока хранения аналитики),
+# location - с актуальной регистрацией на локации
+USER_FILTERS = """
+    AND (? IS NULL OR EXISTS (
+        SELECT 1 FROM event_daily_users d
+        WHERE d.event_id = (SELECT id FROM event_names WHERE name = ?)
+          AND d.user_id = u.user_id
+    ))
+    AND (? IS NULL OR EXISTS (
+        SELECT 1 FROM active_registrations a
+        WHERE a.location = ? AND a.user_id = u.user_id
+          AND a.event_date >= date('now', 'localtime')
+    ))
+"""
+
+def _users_page(conn, limit: int, after: Optional[tuple], event: Optional[str], location: Optional[str]):
+    """
+    Страница пользователей, новые сверху
+
+    Keyset-пагинация: следующая страница начинается строго после
+    (created_at, user_id) последней строки - диапазон по индексу
+    idx_users_created_id, сколько бы страниц ни было до неё.
+    """
+    filters = (event, event, location, location)
+    if after is None:
+        cursor = conn.execute(f"""
+            SELECT u.user_id, u.name, u.username, u.bot_version, u.created_at
+            FROM users u
+            WHERE 1 = 1 {USER_FILTERS}
+            ORDER BY u.created_at DESC, u.user_id DESC
+            LIMIT ?
+        """, (*filters, limit))
+    else:
+        cursor = conn.execute(f"""
+            SELECT u.user_id, u.name, u.username, u.bot_version, u.created_at
+            FROM users u
+            WHERE (u.created_at, u.user_id) < (?, ?) {USER_FILTERS}
+            ORDER BY u.created_at DESC, u.user_id DESC
+            LIMIT ?
+        """, (*after, *filters, limit))
+    return cursor.fetchall()
+
+def _event_days(conn, days: int, event: Optional[str]):
+    cursor = conn.execute("""
+        SELECT day, event_name, events, users
+        FROM event_daily_stats
+        WHERE day >= date('now', 'localtime', ?)
+          AND (? IS NULL OR event_name = ?)
+        ORDER BY day DESC, events DESC
+    """, (f"-{days - 1} days", event, event))
     return [
-        {"user_id": 123, "username": "john_doe", "first_name": "John", "is_active": True},
-        {"user_id": 456, "username": "jane_smith", "first_name": "Jane", "is_active": True},
+        {"day": r['day'], "event": r['event_name'], "events": r['events'], "users": r['users']}
+        for r in cursor
     ]
 
-@router.post("/restart")
-async def restart_bot():
-    """Перезагрузить бота"""
-    return {"message": "Bot restart initiated", "status": "success"}
+# === КУРСОР ===
 
-@router.get("/stats")
-async def get_stats():
-    """Получить статистику"""
+def _encode_cursor(row) -> str:
+    raw = json.dumps([row['created_at'], row['user_id']], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, user_id = json.loads(raw)
+        return str(created_at), str(user_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Неверный cursor")
+
+def _user_item(row) -> dict:
     return {
-        "total_users": 42,
-        "active_today": 15,
-        "messages_sent": 523,
-        "errors": 2
+        "user_id": row['user_id'],
+        "first_name": row['name'] or "—",
+        "username": row['username'] or "unknown",
+        "bot_version": row['bot_version'],
+        "created_at": row['created_at'],
     }
+
+# === ENDPOINTS ===
+
+@router.get("/status", response_model=BotStatus)
+async def get_bot_status(request: Request):
+    """Получить статус бота"""
+    try:
+        return await response_cache.respond(request, lambda: pool.run(_status))
+    except Exception as e:
+        print(f"Error: {e}")
+        return {"is_running": True, "users_count": 0, "active_users": 0, "registrations": 0}
+
+@router.get("/stats")
+async def get_stats(request: Request):
+    """Получить статистику"""
+    try:
+        return await response_cache.respond(request, lambda: pool.run(_stats))
+    except:
+        return {"gruppenrun_registrations": 0, "iremel_registrations": 0}
+
+@router.get("/users", response_model=UsersPage)
+async def get_users(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    event: Optional[str] = None,
+    location: Optional[str] = None,
+):
+    """Список пользователей постранично (next_cursor - для следующей страницы)"""
+    after = _decode_cursor(cursor)
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = await pool.run(_users_page, limit + 1, after, event, location)
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": [_user_item(r) for r in rows[:limit]], "next_cursor": next_cursor}
+
+@router.get("/users/export")
+async def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|json)$"),
+    event: Optional[str] = None,
+    location: Optional[str] = None,
+):
+    """Выгрузка всех пользователей потоком (NDJSON или JSON-массив), по странице за раз"""
+
+    async def pages() -> AsyncIterator[List[dict]]:
+        after = None
+        while True:
+            rows = await pool.run(_users_page, EXPORT_PAGE_SIZE, after, event, location)
+            if rows:
+                yield [_user_item(r) for r in rows]
+            if len(rows) < EXPORT_PAGE_SIZE:
+                return
+            after = (rows[-1]['created_at'], rows[-1]['user_id'])
+
+    async def ndjson():
+        async for items in pages():
+            yield "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+    async def json_array():
+        first = True
+        yield "["
+        async for items in pages():
+            for item in items:
+                yield ("" if first else ",") + json.dumps(item, ensure_ascii=False)
+                first = False
+        yield "]"
+
+    if format == "json":
+        return StreamingResponse(json_array(), media_type="application/json")
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.get("/events", response_model=List[EventDay])
+async def get_events(request: Request, days: int = Query(7, ge=1, le=366), event: Optional[str] = None):
+    """События по дням из дневных счётчиков (event_daily_stats)"""
+    return await response_cache.respond(request, lambda: pool.run(_event_days, days, event))